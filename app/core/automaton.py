@@ -0,0 +1,60 @@
+from collections import deque
+from typing import Hashable, Iterable, Optional, Sequence
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over a fixed set of strings (or of other sequences, e.g. tuples of words).
+    Matches all patterns in one pass over the input, one character at a time, which also
+    makes it usable on streams: the current state is all that has to be carried between chunks.
+    """
+
+    def __init__(self, patterns: Iterable[Sequence[Hashable]]):
+        self.goto = [{}] # State transitions, state 0 is the root
+        self.fail = [0]
+        self.depth = [0] # Length of the partial match a state represents
+        self.match = [None] # Pattern completed at this state (own or via the fail chain)
+
+        for pattern in patterns:
+            if pattern:
+                self._add(pattern)
+        self._link()
+
+        # Characters that can start a match, used to skip ahead while in the root state
+        self.first_chars = frozenset(self.goto[0])
+
+    def _add(self, pattern: Sequence[Hashable]):
+        state = 0
+        for char in pattern:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto.append({})
+                self.fail.append(0)
+                self.depth.append(self.depth[state] + 1)
+                self.match.append(None)
+                self.goto[state][char] = next_state
+            state = next_state
+        self.match[state] = pattern
+
+    def _link(self):
+        # Breadth-first so every fail target is finished before it is used (root children fail to root)
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, child in self.goto[state].items():
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                if self.match[child] is None:
+                    self.match[child] = self.match[self.fail[child]]
+                queue.append(child)
+
+    def step(self, state: int, char: Hashable) -> int:
+        while state and char not in self.goto[state]:
+            state = self.fail[state]
+        return self.goto[state].get(char, 0)
+
+    def matched(self, state: int) -> Optional[Sequence[Hashable]]:
+        return self.match[state]
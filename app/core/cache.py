@@ -0,0 +1,126 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by total (estimated) byte size and optionally by entry count.
+    Entries can optionally expire after `ttl` seconds.
+    Safe to use from async code as no operation ever awaits while holding the lock.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int,
+        ttl: Optional[float] = None,
+        sizeof: Callable[[Hashable, Any], int] = None,
+        max_entries: Optional[int] = None,
+    ):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries if max_entries and max_entries > 0 else None
+        self.ttl = ttl if ttl and ttl > 0 else None
+        self._sizeof = sizeof or (lambda key, value: 64)
+        self._data = OrderedDict() # {key: (value, size, expires_at)}
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                # Expired: drop it and report a miss
+                del self._data[key]
+                self.current_bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        size = self._sizeof(key, value)
+        if size > self.max_bytes:
+            return # Would evict everything else, not worth it
+
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+
+            self._data[key] = (value, size, expires_at)
+            self.current_bytes += size
+
+            # Evict least recently used entries until we fit again
+            while self.current_bytes > self.max_bytes or (
+                self.max_entries is not None and len(self._data) > self.max_entries
+            ):
+                _, (_, old_size, _) = self._data.popitem(last=False)
+                self.current_bytes -= old_size
+                self.evictions += 1
+
+    def pop(self, key: Hashable) -> Optional[Any]:
+        """
+        Removes and returns an entry (None if missing or expired).
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+
+            value, size, expires_at = entry
+            self.current_bytes -= size
+            if expires_at is not None and expires_at < time.monotonic():
+                self.expirations += 1
+                return None
+            return value
+
+    def sweep(self) -> int:
+        """
+        Drops every expired entry (get() only notices the ones it is asked for). Returns how many.
+        """
+        if self.ttl is None:
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            expired = [key for key, (_, _, expires_at) in self._data.items() if expires_at < now]
+            for key in expired:
+                _, size, _ = self._data.pop(key)
+                self.current_bytes -= size
+            self.expirations += len(expired)
+        return len(expired)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.current_bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
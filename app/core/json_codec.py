@@ -0,0 +1,34 @@
+"""
+JSON shim for hot paths: orjson when installed (optional, `pip install orjson`), stdlib json otherwise.
+Both sides take/return bytes and produce compact UTF-8 output.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = "orjson" if orjson else "json"
+
+# Catch this instead of json.JSONDecodeError (orjson raises its own subclass of ValueError)
+JSONDecodeError = ValueError
+
+
+def loads(data):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # orjson is strict (UTF-8 only, no NaN/Infinity, 64-bit integers): let json decide
+            pass
+    return json.loads(data)
+
+
+def dumps(obj) -> bytes:
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass # e.g. integers beyond 64 bit
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,191 @@
+import atexit
+import hashlib
+import logging
+import queue
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+from app.core import json_codec, metrics
+from app.core.config import settings
+
+# Logging for the API and the proxy: records are handed to a queue and written by a
+# background thread, so a request never waits on stdout. Hot-path events go through event(),
+# which is level-gated, sampled, rate limited per event and keeps user content out of the logs
+# unless LOG_PII=full.
+
+# Our loggers (module loggers live under "app"). They don't propagate: mitmproxy and uvicorn
+# keep their own handlers on the root logger.
+LOGGER_NAMES = ("app", "TrustLayer", "TrustLayerProxy")
+
+# Attributes every LogRecord has, anything else was passed as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+_JSON_TYPES = (str, int, float, bool, type(None), dict, list, tuple)
+
+_listener = None
+_handler = None
+
+
+def text(value: str):
+    """
+    User content for a log field: as is with LOG_PII=full, otherwise only its length and a short
+    hash (equal texts have equal hashes, so repeated prompts can still be spotted).
+    """
+    if settings.LOG_PII == "full":
+        return value
+    return {"len": len(value), "sha256": hashlib.sha256(value.encode("utf-8", "surrogatepass")).hexdigest()[:12]}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, msg (or event) and the record's fields.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value if isinstance(value, _JSON_TYPES) else str(value)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json_codec.dumps(entry).decode("utf-8")
+
+
+class TextFormatter(logging.Formatter):
+    """
+    Human readable: "level logger: msg key=value ...".
+    """
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        line = super().format(record)
+        # The event name already is the message
+        fields = [f"{key}={value}" for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES and key != "event"]
+        return f"{line} {' '.join(fields)}" if fields else line
+
+
+class _DroppingQueueHandler(QueueHandler):
+    """
+    Never blocks the caller: when the writer thread falls behind, records are dropped and counted.
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The formatter runs in the writer thread, only make the record safe to hand over
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging():
+    """
+    Installs the queue-backed handler on our loggers. Safe to call more than once.
+    """
+    global _listener, _handler
+    if _listener is not None:
+        return
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JsonFormatter() if settings.LOG_FORMAT == "json" else TextFormatter())
+
+    _handler = _DroppingQueueHandler(queue.Queue(maxsize=settings.LOG_QUEUE_SIZE))
+    _listener = QueueListener(_handler.queue, output, respect_handler_level=False)
+    _listener.start()
+    atexit.register(_listener.stop) # Flushes what is still queued
+
+    for name in LOGGER_NAMES:
+        logger = logging.getLogger(name)
+        logger.handlers = [_handler]
+        logger.setLevel(settings.LOG_LEVEL.upper())
+        logger.propagate = False
+
+
+def stats() -> dict:
+    return {
+        "queued": _handler.queue.qsize() if _handler else 0,
+        "dropped": _handler.dropped if _handler else 0,
+        "suppressed": _suppressed,
+    }
+
+
+# --- Hot-path Events ---
+# Token bucket per event name: {event: [tokens, last refill, suppressed since last emit]}
+_buckets = {}
+_buckets_lock = threading.Lock()
+_suppressed = 0 # Events dropped by the rate limit, all time
+
+
+def _allowed(name: str) -> int:
+    """
+    Returns -1 when the event is over its rate, otherwise how many were suppressed before it.
+    """
+    global _suppressed
+    rate = settings.LOG_RATE_LIMIT_PER_SECOND
+    if rate <= 0:
+        return 0
+    now = time.monotonic()
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            bucket = _buckets[name] = [rate, now, 0]
+        bucket[0] = min(rate, bucket[0] + (now - bucket[1]) * rate) # Burst of up to one second
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            _suppressed += 1
+            return -1
+        bucket[0] -= 1
+        suppressed, bucket[2] = bucket[2], 0
+        return suppressed
+
+
+def event(logger: logging.Logger, name: str, level: int = logging.INFO, sampled: bool = False, **fields):
+    """
+    Structured event, e.g. event(logger, "request_sanitized", host=host, entities=items).
+    Cheap when filtered out: the level is checked before anything is built. sampled=True events
+    (per-request chatter) are emitted for a LOG_SAMPLE_RATE fraction only. Pass user content
+    through text().
+    """
+    if not logger.isEnabledFor(level):
+        return
+    if sampled and settings.LOG_SAMPLE_RATE < 1.0 and random.random() >= settings.LOG_SAMPLE_RATE:
+        return
+    suppressed = _allowed(name)
+    if suppressed < 0:
+        return
+    if suppressed:
+        fields["suppressed"] = suppressed # Dropped by the rate limit since the last one
+    # LogRecord refuses extras that shadow its own attributes ("filename", "msg", ...)
+    extra = {"event": name}
+    for key, value in fields.items():
+        extra[f"field_{key}" if key in _RECORD_ATTRIBUTES else key] = value
+    logger.log(level, name, extra=extra)
+
+
+metrics.register_stats("trustlayer_log", "Logging", stats, gauges=("queued",), counters=("dropped", "suppressed"))
@@ -0,0 +1,221 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app.core.config import settings
+
+# Metrics in the Prometheus text format, without a client library. Every process (API, proxy)
+# exposes its own; Prometheus tells them apart by the scrape target.
+# Disabled (METRICS_ENABLED=false), every call returns right away.
+ENABLED = settings.METRICS_ENABLED
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds, from cache hits (sub-millisecond) to slow providers
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_metrics = [] # Render order
+_callbacks = [] # [(name, kind, help, label, callback)], read at scrape time
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {} # {label values: total}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *labels, amount: float = 1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {} # {label values: [bucket counts..., sum, count]}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value: float, *labels):
+        if not ENABLED:
+            return
+        index = bisect_left(self.buckets, value) # Bucket counts are made cumulative when rendered
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labels):
+        """
+        Context manager observing the time spent inside it (also across awaits).
+        """
+        if not ENABLED:
+            return _NOOP
+        return _Timer(self, labels)
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(labels, list(values)) for labels, values in self._series.items()]
+        for labels, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = 'le="' + _number(bound) + '"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(round(values[-2], 6))}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {values[-1]}")
+        return lines
+
+
+_NOOP = nullcontext()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, labels: tuple):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
+
+
+def register_callback(name: str, kind: str, help: str, callback, label: str = None):
+    """
+    Value computed when scraped (cache sizes, pool usage, ...): nothing is paid on the request path.
+    callback() returns a number, or {label value: number} when `label` is given. kind: "gauge" or "counter".
+    """
+    _callbacks.append((name, kind, help, label, callback))
+
+
+def register_stats(prefix: str, what: str, stats, gauges=(), counters=()):
+    """
+    Exposes fields of a stats() dict: `prefix_<field>` for gauges, `prefix_<field>_total` for counters.
+    """
+    for field in gauges:
+        register_callback(f"{prefix}_{field}", "gauge", f"{what}: {field}.", lambda field=field: stats()[field])
+    for field in counters:
+        register_callback(f"{prefix}_{field}_total", "counter", f"{what}: {field}.", lambda field=field: stats()[field])
+
+
+def render() -> str:
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for name, kind, help, label, callback in _callbacks:
+        try:
+            value = callback()
+        except Exception:
+            continue # A broken source must not break the whole scrape
+        if value is None:
+            continue
+        lines.append(f"# HELP {name} {help}")
+        lines.append(f"# TYPE {name} {kind}")
+        if label is None:
+            lines.append(f"{name} {_number(value)}")
+        else:
+            for label_value, item in value.items():
+                lines.append(f"{name}{_labels((label,), (label_value,))} {_number(item)}")
+    return "\n".join(lines) + "\n"
+
+
+# --- Pipeline Metrics ---
+# Stages: extract, analyze, redact, rewrite, audit, audit_write, upstream, upstream_first_chunk, restore, request
+STAGE_SECONDS = Histogram("trustlayer_stage_seconds", "Time spent per pipeline stage.", ["stage"])
+ENTITIES = Counter("trustlayer_entities_redacted_total", "Entities redacted, by type.", ["entity_type"])
+REQUESTS = Counter("trustlayer_requests_total", "Requests handled, by outcome.", ["outcome"])
+
+
+def stage(name: str):
+    """
+    `with metrics.stage("analyze"): ...` records the time spent in a pipeline stage.
+    """
+    if not ENABLED:
+        return _NOOP
+    return _Timer(STAGE_SECONDS, (name,))
+
+
+def observe_stage(name: str, seconds: float):
+    # For stages timed piecewise (e.g. a stream restored chunk by chunk)
+    STAGE_SECONDS.observe(seconds, name)
+
+
+def count_entities(items: dict):
+    if not ENABLED:
+        return
+    for entity_type, count in items.items():
+        ENTITIES.inc(entity_type, amount=count)
+
+
+# --- Standalone Endpoint (processes without a web framework, e.g. the proxy) ---
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # Scrapes every few seconds would flood the output
+
+
+def start_http_server(host: str, port: int):
+    """
+    Serves /metrics from a daemon thread. Returns the server (call shutdown() to stop it), or None when disabled.
+    """
+    if not ENABLED or not port:
+        return None
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
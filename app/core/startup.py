@@ -0,0 +1,53 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# Startup bookkeeping shared by the API, the proxy and worker processes (each process has its own)
+_lock = threading.Lock()
+_timings = {} # {component: seconds}
+_components = {} # {component: "pending" | "ready" | "failed"}
+
+
+@contextmanager
+def timed(component: str):
+    """
+    Records how long a startup step took, e.g. `with timed("database"): ...`
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _timings[component] = round(time.perf_counter() - started, 4)
+
+
+def mark(component: str, state: str):
+    with _lock:
+        _components[component] = state
+
+
+def set_timing(component: str, seconds: float):
+    # For steps timed elsewhere, e.g. inside a worker process
+    with _lock:
+        _timings[component] = round(seconds, 4)
+
+
+def _all_ready() -> bool:
+    return bool(_components) and all(state == "ready" for state in _components.values())
+
+
+def is_ready() -> bool:
+    """
+    True once every registered component finished its startup successfully.
+    """
+    with _lock:
+        return _all_ready()
+
+
+def status() -> dict:
+    with _lock:
+        return {
+            "ready": _all_ready(),
+            "components": dict(_components),
+            "timings": dict(_timings),
+        }
@@ -1,19 +1,30 @@
+import os
+import time
 import uuid
+import tempfile
+import asyncio
 import logging
 from typing import Optional
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks
+from fastapi import FastAPI, Request, UploadFile, File, Form, Depends, HTTPException, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from sqlalchemy.ext.asyncio import AsyncSession
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
+from app.core import json_codec, log, metrics, startup
 from app.core.config import settings
-from app.core.database import init_db, get_db
-from app.modules.redaction import redact_text, deanonymize_text # Updated import
-from app.modules.document import extract_text
-from app.modules.audit import create_audit_log
-from app.services.llm_proxy import call_llm, LLMProxyError
-
-# Configure Logging
-logging.basicConfig(level=logging.INFO)
+from app.core.database import init_db
+from app.modules.redaction import deanonymize_text, StreamRestorer
+from app.modules.document import iter_sections, extractor_stats, warm_up as warm_up_documents
+from app.modules.audit import audit_writer, enqueue_audit_log, run_compaction_loop
+from app.services.llm_proxy import call_llm, stream_llm, LLMProxyError
+from app.services.http_client import start_client, close_client, pool_stats
+from app.services.conversation_store import conversation_store
+from app.services.redaction_executor import (
+    RedactionOverloaded, redact_sections_async, start_executor, shutdown_executor, warm_up_executor,
+)
+
+# Configure Logging (structured, queued: requests never wait on the console)
+log.setup_logging()
 logger = logging.getLogger("TrustLayer")
 
 app = FastAPI(title=settings.PROJECT_NAME, version=settings.VERSION)
@@ -27,87 +38,302 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+async def _warm_up():
+    # Runs in the background: the server answers /health right away, /ready once this is done
+    if settings.WARMUP_ON_STARTUP:
+        try:
+            await warm_up_executor()
+        except Exception:
+            pass # Marked as failed, /ready keeps reporting 503
+    else:
+        # Engines load lazily on the first request
+        startup.mark("redaction", "ready")
+
+    if settings.DOCUMENT_WARMUP:
+        startup.mark("documents", "pending")
+        try:
+            await asyncio.to_thread(warm_up_documents)
+            startup.mark("documents", "ready")
+        except Exception as e:
+            startup.mark("documents", "failed")
+            logger.error(f"Document extractor warm-up failed: {e}")
+
+    logger.info(f"Startup timings: {startup.status()['timings']}")
+
 @app.on_event("startup")
 async def startup_event():
+    startup.mark("database", "pending")
     try:
-        await init_db()
+        with startup.timed("database"):
+            await init_db()
+        startup.mark("database", "ready")
         logger.info("Database initialized.")
     except Exception as e:
+        startup.mark("database", "failed")
         logger.critical(f"Database initialization failed: {e}")
         # In prod, we might want to shut down, but proper retry handling is better.
 
+    # Audit records are written in bulk by a background task
+    audit_writer.start()
+
+    # Idle conversations (and the PII they map) are dropped in the background
+    conversation_store.start()
+
+    # Rollup backfill + retention (only the API runs this, proxies just write)
+    app.state.compaction_task = asyncio.create_task(run_compaction_loop())
+
+    # Spin up the NER worker processes before traffic arrives
+    start_executor()
+
+    # Open the pooled upstream client (connections are reused across requests)
+    with startup.timed("upstream_client"):
+        await start_client()
+
+    # Load + exercise the NER engines without holding up the server start
+    app.state.warmup_task = asyncio.create_task(_warm_up())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    app.state.warmup_task.cancel()
+    app.state.compaction_task.cancel()
+    conversation_store.stop()
+    shutdown_executor()
+    await close_client()
+    # Drain queued audit records before the process exits
+    await audit_writer.stop()
+
 @app.post("/v1/chat/completions")
 async def chat_completions(
+    request: Request,
     prompt: Optional[str] = Form(None),
     file: UploadFile = File(None),
-    db: AsyncSession = Depends(get_db)
+    stream: bool = Form(False),
+    conversation_id: Optional[str] = Form(None)
 ):
     """
     Secure endpoint that accepts a text prompt OR a file.
     It extracts text, redacts PII, logs the audit, and forwards to LLM.
+    With stream=true the answer is sent as Server-Sent Events while the LLM generates it.
+    Requests sharing a conversation_id get the same placeholder for the same value.
     """
     request_id = str(uuid.uuid4())
-    logger.info(f"Processing Request ID: {request_id}")
+    started = time.perf_counter()
+    log.event(logger, "request_received", logging.DEBUG, request_id=request_id, stream=stream, upload=file is not None)
     
     # 1. Input Handling
-    raw_text = ""
+    # Uploads are spooled to disk and never held in memory as a whole
+    upload_path = None
     try:
         if file:
-            logger.info(f"Processing File: {file.filename}")
-            file_content = await file.read()
-            raw_text = extract_text(file_buffer=file_content)
-        elif prompt:
-            raw_text = prompt
-        else:
+            log.event(logger, "file_received", logging.DEBUG, upload_name=log.text(file.filename or ""), content_type=file.content_type)
+            upload_path = await _spool_upload(file)
+        elif not prompt:
+            metrics.REQUESTS.inc("bad_request")
             raise HTTPException(status_code=400, detail="No prompt or file provided")
-
-        if not raw_text:
-            raise HTTPException(status_code=400, detail="Could not extract text from input")
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Input processing failed: {e}")
+        metrics.REQUESTS.inc("input_error")
         raise HTTPException(status_code=500, detail="Failed to process input")
 
     # 2. Redaction
+    # Documents are extracted section by section and redacted in overlapping windows
+    # Conversations are scoped to the client, ids are not secrets
+    conversation_key = f"{request.client.host if request.client else ''}|api|{conversation_id}" if conversation_id else None
     try:
-        redaction_result = redact_text(raw_text)
+        # For documents this includes the extraction (also recorded on its own as "extract")
+        with metrics.stage("redact"):
+            if upload_path:
+                conversation = conversation_store.get(conversation_key) if conversation_key else None
+                pseudonyms = conversation.pseudonyms if conversation else None
+                redaction_result = await redact_sections_async(iter_sections(upload_path), pseudonyms)
+                if conversation:
+                    conversation_store.save(conversation_key, conversation)
+                deanonymize_map = pseudonyms.values if conversation else redaction_result.mapping
+            else:
+                results, deanonymize_map = await conversation_store.redact(conversation_key, [prompt])
+                redaction_result = results[0]
         sanitized_text = redaction_result.text
-        # We hold the mapping in memory for this request
-        deanonymize_map = redaction_result.mapping 
+        # We hold the mapping in memory for this request (every token of the conversation so far)
+    except RedactionOverloaded as e:
+        # Nothing is forwarded unredacted: the client is asked to come back instead
+        log.event(logger, "redaction_overloaded", logging.WARNING, error=str(e))
+        metrics.REQUESTS.inc("overloaded")
+        raise HTTPException(status_code=503, detail="Redaction overloaded, retry later", headers={"Retry-After": "1"})
     except Exception as e:
         logger.error(f"Redaction failed: {e}")
+        metrics.REQUESTS.inc("redaction_error")
         raise HTTPException(status_code=500, detail="Governance Policy Failure")
+    finally:
+        if upload_path:
+            os.unlink(upload_path)
+
+    if not sanitized_text.strip():
+        metrics.REQUESTS.inc("bad_request")
+        raise HTTPException(status_code=400, detail="Could not extract text from input")
     
     # 3. Audit Logging (Async)
-    # Note: Fire and forget task or await? Await ensures audit is committed.
-    try:
-        if redaction_result.items:
-            logger.info(f"Redacted Entities: {redaction_result.items}")
-            for entity_type, count in redaction_result.items.items():
-                await create_audit_log(db, entity_type, count, request_id)
-    except Exception as e:
-        logger.error(f"Audit logging failed: {e}")
-        # We proceed even if logs fail, but in strict secure environments we might fail closed.
-        # For now, we log the error.
+    # Records are queued and committed in bulk by the audit writer, the request never waits on SQLite.
+    # Streaming requests are audited once the stream has ended (see _stream_completion).
+    if stream:
+        return await _stream_completion(request_id, sanitized_text, redaction_result, deanonymize_map, started)
+
+    await _write_audit(redaction_result.items, request_id)
 
     # 4. Forward to LLM
     try:
-        llm_response_sanitized = await call_llm(sanitized_text)
+        with metrics.stage("upstream"):
+            llm_response_sanitized = await call_llm(sanitized_text)
     except LLMProxyError as e:
         logger.error(f"LLM Call failed: {e}")
+        metrics.REQUESTS.inc("upstream_error")
         raise HTTPException(status_code=502, detail=f"LLM Provider Error: {str(e)}")
         
     # 5. De-Anonymize Response (The Magic Step)
     # Restores [PERSON_1] -> John Doe in the final answer so user feels it's normal.
-    final_response = deanonymize_text(llm_response_sanitized, deanonymize_map)
-    
+    with metrics.stage("restore"):
+        final_response = deanonymize_text(llm_response_sanitized, deanonymize_map)
+
+    metrics.REQUESTS.inc("ok")
+    metrics.observe_stage("request", time.perf_counter() - started)
     return {
         "request_id": request_id,
-        "original_length": len(raw_text),
+        "original_length": redaction_result.source_length,
         "sanitized_length": len(sanitized_text),
         "redacted_entities": redaction_result.items,
-        "llm_response": final_response # User receives "normal" text
+        "llm_response": final_response, # User receives "normal" text
+        "conversation_id": conversation_id,
     }
 
+async def _spool_upload(file: UploadFile) -> str:
+    """
+    Copies an upload to a named temporary file (extractors need a path) in bounded chunks.
+    The caller deletes the file once this returned, a failed copy is removed here.
+    """
+    suffix = os.path.splitext(file.filename or "")[1]
+    with tempfile.NamedTemporaryFile(prefix="trustlayer-", suffix=suffix, delete=False) as spool:
+        try:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_BYTES):
+                spool.write(chunk)
+        except BaseException:
+            # Partial upload contents (possibly PII) must not stay behind in the temp directory
+            spool.close()
+            os.unlink(spool.name)
+            raise
+    return spool.name
+
+async def _write_audit(items: dict, request_id: str):
+    try:
+        if items:
+            log.event(logger, "entities_redacted", sampled=True, request_id=request_id, entities=items)
+            metrics.count_entities(items)
+            with metrics.stage("audit"):
+                for entity_type, count in items.items():
+                    await enqueue_audit_log(entity_type, count, request_id)
+    except Exception as e:
+        logger.error(f"Audit logging failed: {e}")
+        # We proceed even if logs fail, but in strict secure environments we might fail closed.
+        # For now, we log the error.
+
+async def _close_stream_audit(request_id: str, items: dict, state: dict):
+    # Runs after the last byte was sent (or the client went away)
+    log.event(logger, "stream_closed", sampled=True, request_id=request_id, completed=state["completed"])
+    await _write_audit(items, request_id)
+
+async def _stream_completion(request_id: str, sanitized_text: str, redaction_result, deanonymize_map: dict, started: float) -> StreamingResponse:
+    """
+    Forwards the LLM stream as Server-Sent Events, restoring placeholders as chunks arrive.
+    """
+    upstream = stream_llm(sanitized_text)
+
+    # 4. Forward to LLM: wait for the first chunk so provider errors still surface as a 502
+    try:
+        with metrics.stage("upstream_first_chunk"):
+            first_chunk = await anext(upstream, "")
+    except LLMProxyError as e:
+        logger.error(f"LLM Call failed: {e}")
+        metrics.REQUESTS.inc("upstream_error")
+        raise HTTPException(status_code=502, detail=f"LLM Provider Error: {str(e)}")
+
+    # 5. De-Anonymize incrementally (tokens split across chunks are held back until complete)
+    restorer = StreamRestorer(deanonymize_map)
+    state = {"completed": False, "restoring": 0.0}
+
+    def restore(chunk: str) -> str:
+        # Restore time adds up over the chunks, it is observed once per stream
+        restore_started = time.perf_counter()
+        delta = restorer.feed_text(chunk)
+        state["restoring"] += time.perf_counter() - restore_started
+        return delta
+
+    def event(payload: dict) -> bytes:
+        return b"data: " + json_codec.dumps(payload) + b"\n\n"
+
+    async def body():
+        try:
+            delta = restore(first_chunk)
+            if delta:
+                yield event({"request_id": request_id, "delta": delta})
+
+            async for chunk in upstream:
+                delta = restore(chunk)
+                if delta:
+                    yield event({"request_id": request_id, "delta": delta})
+
+            tail = restorer.flush_text()
+            if tail:
+                yield event({"request_id": request_id, "delta": tail})
+
+            state["completed"] = True
+            yield event({
+                "request_id": request_id,
+                "redacted_entities": redaction_result.items,
+                "done": True,
+            })
+            yield b"data: [DONE]\n\n"
+        except LLMProxyError as e:
+            logger.error(f"LLM Stream failed: {e}")
+            yield event({"request_id": request_id, "error": f"LLM Provider Error: {str(e)}"})
+        finally:
+            await upstream.aclose()
+            metrics.REQUESTS.inc("stream" if state["completed"] else "stream_aborted")
+            metrics.observe_stage("restore", state["restoring"])
+            metrics.observe_stage("request", time.perf_counter() - started)
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream",
+        headers={"X-Request-ID": request_id, "Cache-Control": "no-cache"},
+        background=BackgroundTask(_close_stream_audit, request_id, redaction_result.items, state),
+    )
+
 @app.get("/health")
 def health_check():
+    # Liveness: the process is up, even if it cannot serve traffic quickly yet
     return {"status": "ok"}
+
+@app.get("/ready")
+def readiness_check():
+    """
+    Readiness: 200 once the database is initialized and the NER engines are warm, 503 before.
+    Includes per-component startup timings (seconds).
+    """
+    status = startup.status()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    # Prometheus scrape target: stage timings, entity counters, cache/pool/queue gauges
+    if not metrics.ENABLED:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/v1/upstream/pool")
+def upstream_pool():
+    return pool_stats()
+
+@app.get("/v1/documents/extractors")
+def document_extractors():
+    # Files, bytes and extraction time per extractor (text, html, docx, tika)
+    return extractor_stats()
@@ -1,6 +1,15 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime
-from app.core.database import Base
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+from sqlalchemy import Boolean, Column, Integer, String, DateTime, Index, event, insert, delete, func, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from app.core import metrics
+from app.core.config import settings
+from app.core.database import Base, SessionLocal
+
+logger = logging.getLogger(__name__)
 
 class AuditLog(Base):
     __tablename__ = "audit_logs"
@@ -11,26 +20,491 @@ class AuditLog(Base):
     count = Column(Integer)
     request_id = Column(String, index=True)
 
+    __table_args__ = (
+        # Time range scans grouped by type (covering: no table lookups for the dashboard)
+        Index("ix_audit_logs_timestamp_entity_count", "timestamp", "entity_type", "count"),
+        # Per-type time series
+        Index("ix_audit_logs_entity_timestamp", "entity_type", "timestamp"),
+    )
+
+class AuditRollup(Base):
+    """
+    Pre-aggregated counts per entity type and time bucket, maintained on every audit write.
+    The dashboard reads these instead of scanning audit_logs.
+    """
+    __tablename__ = "audit_rollups"
+
+    granularity = Column(String, primary_key=True) # minute | hour | day
+    bucket_start = Column(DateTime, primary_key=True)
+    entity_type = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0)
+
+class AuditMigration(Base):
+    """
+    One-off data migrations and where they stand, e.g. the rollup backfill of older databases.
+    """
+    __tablename__ = "audit_migrations"
+
+    name = Column(String, primary_key=True)
+    cutoff_id = Column(Integer, nullable=False, default=0) # Last audit_logs id the migration covers
+    done = Column(Boolean, nullable=False, default=False)
+
 # CRUD Ops
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
+ROLLUP_BACKFILL = "rollup_backfill"
+
+# create_all() has to create audit_logs and audit_migrations before audit_rollups (see below)
+AuditRollup.__table__.add_is_dependent_on(AuditLog.__table__)
+AuditRollup.__table__.add_is_dependent_on(AuditMigration.__table__)
+
+@event.listens_for(AuditRollup.__table__, "before_create")
+def _remember_rollup_cutoff(target, connection, **kw):
+    # Until audit_rollups exists no write can maintain it (the rollup upsert fails together with
+    # its audit rows), so exactly the rows up to here are missing from the rollups
+    connection.info["rollup_cutoff"] = connection.execute(select(func.max(AuditLog.id))).scalar() or 0
+
+@event.listens_for(AuditRollup.__table__, "after_create")
+def _schedule_rollup_backfill(target, connection, **kw):
+    cutoff = connection.info.pop("rollup_cutoff", 0)
+    connection.execute(insert(AuditMigration).values(name=ROLLUP_BACKFILL, cutoff_id=cutoff, done=cutoff == 0))
+
+BUCKETS = ("minute", "hour", "day")
+
+def truncate_timestamp(timestamp: datetime, granularity: str) -> datetime:
+    if granularity == "minute":
+        return timestamp.replace(second=0, microsecond=0)
+    if granularity == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+async def _update_rollups(db: AsyncSession, records: list):
+    """
+    Adds a batch of audit records to the rollup buckets (one upsert per touched bucket).
+    Runs inside the caller's transaction so raw rows and rollups never disagree.
+    """
+    totals = {}
+    for record in records:
+        for granularity in BUCKETS:
+            key = (granularity, truncate_timestamp(record["timestamp"], granularity), record["entity_type"])
+            totals[key] = totals.get(key, 0) + record["count"]
+    await _upsert_rollups(db, totals)
+
+async def _upsert_rollups(db: AsyncSession, totals: dict):
+    """
+    Adds {(granularity, bucket_start, entity_type): count} to the rollups, creating missing buckets.
+    """
+    rows = [
+        {"granularity": granularity, "bucket_start": bucket_start, "entity_type": entity_type, "count": count}
+        for (granularity, bucket_start, entity_type), count in totals.items()
+    ]
+    dialect = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    statement = dialect.insert(AuditRollup)
+    statement = statement.on_conflict_do_update(
+        index_elements=["granularity", "bucket_start", "entity_type"],
+        set_={"count": AuditRollup.count + statement.excluded.count},
+    )
+    await db.execute(statement, rows)
+
 async def create_audit_log(db: AsyncSession, entity_type: str, count: int, request_id: str):
-    db_log = AuditLog(entity_type=entity_type, count=count, request_id=request_id)
+    db_log = AuditLog(timestamp=datetime.utcnow(), entity_type=entity_type, count=count, request_id=request_id)
     db.add(db_log)
+    await _update_rollups(db, [{"timestamp": db_log.timestamp, "entity_type": entity_type, "count": count}])
     await db.commit()
     await db.refresh(db_log)
-    print(f"[AUDIT] Logged: {entity_type} ({count}) -> ID: {db_log.id}")
+    logger.debug(f"Audit record {db_log.id}: {entity_type} ({count})")
     return db_log
 
-async def get_audit_stats(db: AsyncSession):
-    # This is a simple aggregation for the dashboard
-    # Returns list of tuples (entity_type, count)
-    result = await db.execute(select(AuditLog)) # In prod, use GROUP BY
-    logs = result.scalars().all()
-    
-    # Manual aggregation for simplicity with async
-    stats = {}
-    for log in logs:
-        stats[log.entity_type] = stats.get(log.entity_type, 0) + log.count
-    return stats
+class AuditWriter:
+    """
+    Buffers audit records in memory and writes them in bulk from a background task,
+    so requests never wait for a SQLite commit. Flushes every `batch_size` records
+    or `flush_interval` seconds, whichever comes first.
+    """
+
+    _STOP = object()
+
+    def __init__(self, max_queue: int, batch_size: int, flush_interval: float, overflow_policy: str, retries: int = 3):
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow_policy = overflow_policy
+        self.retries = retries
+        self._queue = None
+        self._task = None
+        self._stopping = False
+
+        # Counters
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.retried = 0
+        self.requeued = 0
+
+    def start(self):
+        """
+        Starts the flush task on the running event loop.
+        """
+        if self._task is None:
+            self._stopping = False
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            logger.info("Audit writer started")
+
+    async def stop(self):
+        """
+        Graceful shutdown: everything queued so far is written before this returns.
+        """
+        if self._task is None:
+            return
+        self._stopping = True
+        await self._queue.put(self._STOP)
+        await self._task
+        self._task = None
+        logger.info(f"Audit writer stopped ({self.written} written, {self.dropped} dropped)")
+
+    async def enqueue(self, entity_type: str, count: int, request_id: str):
+        record = {
+            "timestamp": datetime.utcnow(),
+            "entity_type": entity_type,
+            "count": count,
+            "request_id": request_id,
+        }
+
+        # No writer running (scripts, shutdown): write directly
+        if self._task is None or self._stopping:
+            await self._write([record])
+            return
+
+        if self.overflow_policy == "block":
+            await self._queue.put(record)
+            return
+
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.overflow_policy == "drop_oldest":
+                self._queue.get_nowait()
+                self._queue.put_nowait(record)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            item = await self._queue.get()
+            deadline = loop.time() + self.flush_interval
+
+            # Collect until the batch is full, the window closes or we are asked to stop
+            while item is not self._STOP:
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+
+            if batch:
+                await self._write(batch)
+            if item is self._STOP:
+                return
+
+    async def _write(self, batch: list):
+        for attempt in range(self.retries + 1):
+            try:
+                with metrics.stage("audit_write"):
+                    async with SessionLocal() as db:
+                        await db.execute(insert(AuditLog), batch)
+                        await _update_rollups(db, batch)
+                        await db.commit()
+                self.written += len(batch)
+                self.batches += 1
+                return
+            except OperationalError as e:
+                # Locked / busy database (e.g. a long migration holds the write lock): transient
+                if attempt < self.retries:
+                    self.retried += 1
+                    await asyncio.sleep(min(0.5 * 2 ** attempt, 5.0))
+                    continue
+                if self._requeue(batch):
+                    logger.warning(f"Audit flush of {len(batch)} records failed, queued again: {e}")
+                    return
+                error = e
+            except Exception as e:
+                error = e
+                break
+        self.failed += len(batch)
+        logger.error(f"Audit flush of {len(batch)} records failed: {error}")
+
+    def _requeue(self, batch: list) -> bool:
+        """
+        Puts a batch back into the queue for the next flush, while the writer is running.
+        """
+        if self._task is None or self._stopping:
+            return False
+        for record in batch:
+            try:
+                self._queue.put_nowait(record)
+                self.requeued += 1
+            except asyncio.QueueFull:
+                self.dropped += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue else 0,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "retried": self.retried,
+            "requeued": self.requeued,
+        }
+
+audit_writer = AuditWriter(
+    max_queue=settings.AUDIT_QUEUE_MAX,
+    batch_size=settings.AUDIT_BATCH_SIZE,
+    flush_interval=settings.AUDIT_FLUSH_INTERVAL_SECONDS,
+    overflow_policy=settings.AUDIT_OVERFLOW_POLICY,
+    retries=settings.AUDIT_WRITE_RETRIES,
+)
+metrics.register_stats(
+    "trustlayer_audit", "Audit writer", audit_writer.stats,
+    gauges=("queued",), counters=("written", "dropped", "failed", "batches", "retried", "requeued"),
+)
+
+async def enqueue_audit_log(entity_type: str, count: int, request_id: str):
+    """
+    Request-path audit logging: returns immediately, the record is written in the next bulk flush.
+    """
+    await audit_writer.enqueue(entity_type, count, request_id)
+
+# --- Aggregations (computed by the database, never by loading rows into Python) ---
+
+_SQLITE_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+}
+
+def _in_range(query, start: Optional[datetime], end: Optional[datetime]):
+    if start is not None:
+        query = query.where(AuditLog.timestamp >= start)
+    if end is not None:
+        query = query.where(AuditLog.timestamp < end)
+    return query
+
+def _bucket_expression(db: AsyncSession, bucket: str):
+    if bucket not in BUCKETS:
+        raise ValueError(f"Unknown bucket '{bucket}', expected one of {BUCKETS}")
+    if db.bind.dialect.name == "sqlite":
+        return func.strftime(_SQLITE_BUCKET_FORMATS[bucket], AuditLog.timestamp)
+    return func.date_trunc(bucket, AuditLog.timestamp)
+
+async def get_audit_stats(db: AsyncSession, start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """
+    Total redactions per entity type: {entity_type: count}.
+    """
+    query = select(AuditLog.entity_type, func.sum(AuditLog.count)).group_by(AuditLog.entity_type)
+    result = await db.execute(_in_range(query, start, end))
+    return {entity_type: total for entity_type, total in result.all()}
+
+async def get_time_buckets(
+    db: AsyncSession,
+    bucket: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    entity_type: Optional[str] = None,
+    up_to_id: Optional[int] = None,
+) -> list[tuple]:
+    """
+    Redaction counts per time bucket (minute/hour/day) and entity type:
+    [(bucket_start, entity_type, count)], oldest bucket first. `up_to_id` limits it to older rows.
+    """
+    bucket_start = _bucket_expression(db, bucket).label("bucket_start")
+    query = (
+        select(bucket_start, AuditLog.entity_type, func.sum(AuditLog.count))
+        .group_by(bucket_start, AuditLog.entity_type)
+        .order_by(bucket_start)
+    )
+    if entity_type is not None:
+        query = query.where(AuditLog.entity_type == entity_type)
+    if up_to_id is not None:
+        query = query.where(AuditLog.id <= up_to_id)
+
+    result = await db.execute(_in_range(query, start, end))
+    rows = []
+    for started, row_type, total in result.all():
+        # SQLite hands back the formatted string
+        if isinstance(started, str):
+            started = datetime.fromisoformat(started)
+        rows.append((started, row_type, total))
+    return rows
+
+async def get_top_entities(
+    db: AsyncSession, limit: int = 10, start: Optional[datetime] = None, end: Optional[datetime] = None
+) -> list[tuple]:
+    """
+    Most redacted entity types: [(entity_type, count)], largest first.
+    """
+    total = func.sum(AuditLog.count).label("total")
+    query = select(AuditLog.entity_type, total).group_by(AuditLog.entity_type).order_by(total.desc()).limit(limit)
+    result = await db.execute(_in_range(query, start, end))
+    return [tuple(row) for row in result.all()]
+
+async def get_recent_logs(db: AsyncSession, limit: int = 50, before_id: Optional[int] = None) -> list:
+    """
+    Newest audit logs first. Pass the smallest id of the previous page as `before_id`
+    to get the next one (keyset pagination, constant cost no matter how deep).
+    """
+    query = select(AuditLog).order_by(AuditLog.id.desc()).limit(limit)
+    if before_id is not None:
+        query = query.where(AuditLog.id < before_id)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+# --- Rollups (dashboard reads, cost independent of history size) ---
+
+ROLLUP_RETENTION_DAYS = {
+    "minute": settings.AUDIT_MINUTE_ROLLUP_RETENTION_DAYS,
+    "hour": settings.AUDIT_HOUR_ROLLUP_RETENTION_DAYS,
+    "day": settings.AUDIT_DAY_ROLLUP_RETENTION_DAYS,
+}
+
+def granularities_for(span: Optional[timedelta]) -> list[str]:
+    """
+    Rollup granularities still retained for the whole of `span` (None = all history).
+    """
+    available = []
+    for granularity in BUCKETS:
+        retention = ROLLUP_RETENTION_DAYS[granularity]
+        if not retention or (span is not None and span <= timedelta(days=retention)):
+            available.append(granularity)
+    return available
+
+async def get_rollup_buckets(
+    db: AsyncSession,
+    granularity: str = "hour",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> list[tuple]:
+    """
+    Same shape as get_time_buckets(), read from the rollup table: [(bucket_start, entity_type, count)].
+    """
+    query = (
+        select(AuditRollup.bucket_start, AuditRollup.entity_type, AuditRollup.count)
+        .where(AuditRollup.granularity == granularity)
+        .order_by(AuditRollup.bucket_start)
+    )
+    if start is not None:
+        query = query.where(AuditRollup.bucket_start >= truncate_timestamp(start, granularity))
+    if end is not None:
+        query = query.where(AuditRollup.bucket_start < end)
+    result = await db.execute(query)
+    return [tuple(row) for row in result.all()]
+
+async def get_rollup_stats(db: AsyncSession, granularity: str = "day", start: Optional[datetime] = None) -> dict:
+    """
+    Totals per entity type from the rollups: {entity_type: count}.
+    """
+    query = (
+        select(AuditRollup.entity_type, func.sum(AuditRollup.count))
+        .where(AuditRollup.granularity == granularity)
+        .group_by(AuditRollup.entity_type)
+    )
+    if start is not None:
+        query = query.where(AuditRollup.bucket_start >= truncate_timestamp(start, granularity))
+    result = await db.execute(query)
+    return {entity_type: total for entity_type, total in result.all()}
+
+async def backfill_rollups(db: AsyncSession):
+    """
+    Adds the audit_logs rows that predate the rollups (up to the cutoff recorded when audit_rollups
+    was created) to them. Runs once per database: the migration is claimed in the transaction
+    that writes the totals, so concurrent callers and later calls are no-ops.
+    """
+    cutoff = (await db.execute(
+        select(AuditMigration.cutoff_id)
+        .where(AuditMigration.name == ROLLUP_BACKFILL, AuditMigration.done.is_(False))
+    )).scalar_one_or_none()
+    if cutoff is None:
+        await db.rollback()
+        return
+
+    # Read-only pass, no write lock held: rows up to the cutoff don't change (compaction
+    # waits for the backfill), however long the GROUP BYs take on a large history
+    totals = {}
+    for granularity in BUCKETS:
+        for bucket_start, entity_type, count in await get_time_buckets(db, bucket=granularity, up_to_id=cutoff):
+            totals[(granularity, bucket_start, entity_type)] = count
+    await db.rollback()
+
+    # Short write transaction: claim + upsert, concurrent audit flushes wait only for this
+    claimed = await db.execute(
+        update(AuditMigration)
+        .where(AuditMigration.name == ROLLUP_BACKFILL, AuditMigration.done.is_(False))
+        .values(done=True)
+    )
+    if claimed.rowcount != 1:
+        await db.rollback() # Done by someone else in the meantime
+        return
+    if totals:
+        # Same upsert as the writer: buckets it already started are added to, not replaced
+        await _upsert_rollups(db, totals)
+    await db.commit()
+    logger.info(f"Audit rollups backfilled from {len(totals)} buckets (audit ids up to {cutoff})")
+
+async def compact_audit_data(db: AsyncSession, now: Optional[datetime] = None) -> dict:
+    """
+    Retention: raw rows and finer rollups past their retention are deleted,
+    their counts live on in the coarser rollups. Returns deleted rows per table/granularity.
+    """
+    now = now or datetime.utcnow()
+    deleted = {}
+
+    if settings.AUDIT_RAW_RETENTION_DAYS:
+        cutoff = now - timedelta(days=settings.AUDIT_RAW_RETENTION_DAYS)
+        result = await db.execute(delete(AuditLog).where(AuditLog.timestamp < cutoff))
+        deleted["raw"] = result.rowcount
+
+    for granularity, retention in ROLLUP_RETENTION_DAYS.items():
+        if not retention:
+            continue
+        cutoff = truncate_timestamp(now - timedelta(days=retention), granularity)
+        result = await db.execute(
+            delete(AuditRollup)
+            .where(AuditRollup.granularity == granularity)
+            .where(AuditRollup.bucket_start < cutoff)
+        )
+        deleted[granularity] = result.rowcount
+
+    await db.commit()
+    return deleted
+
+async def run_compaction_loop(interval: float = None):
+    """
+    Background task: backfills the rollups once, then compacts every `interval` seconds.
+    Compaction waits for the backfill (retried every round): it would delete rows not yet counted.
+    """
+    interval = interval or settings.AUDIT_COMPACTION_INTERVAL_SECONDS
+    backfilled = False
+
+    while True:
+        try:
+            if not backfilled:
+                async with SessionLocal() as db:
+                    await backfill_rollups(db)
+                backfilled = True
+            async with SessionLocal() as db:
+                deleted = await compact_audit_data(db)
+            if any(deleted.values()):
+                logger.info(f"Audit compaction removed {deleted}")
+        except Exception as e:
+            logger.error(f"Audit compaction failed: {e}")
+        await asyncio.sleep(interval)
@@ -1,22 +1,352 @@
-import tika
-from tika import parser
+import codecs
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urlparse
+from xml.etree import ElementTree
 
-# Initialize Tika
-tika.initVM()
+import httpx
+
+from app.core import metrics
+from app.core.config import settings
+from app.core.startup import timed
+
+logger = logging.getLogger(__name__)
+
+# Tika (and its JVM/server) is started on the first extraction, not at import:
+# processes that never see an upload don't pay for it.
+_tika_ready = False
+_tika_lock = threading.Lock()
+
+def _ensure_tika():
+    global _tika_ready
+    if _tika_ready:
+        return
+    with _tika_lock:
+        if not _tika_ready:
+            with timed("tika"):
+                import tika
+                # Initialize Tika
+                tika.initVM()
+            _tika_ready = True
+
+def warm_up():
+    """
+    Starts Tika up front by parsing a tiny document (spawns the Tika server on first use).
+    """
+    _ensure_tika()
+    from tika import parser
+    with timed("tika_warmup"):
+        parser.from_buffer(b"TrustLayer warm-up")
+
+# --- Extractor Registry ---
+# Common formats are extracted in-process, everything else goes through Tika.
+Extractor = namedtuple("Extractor", ["name", "extract"]) # extract(file_path, encoding, section_chars) -> iter[str]
+
+EXTRACTORS = {} # {mime_type: Extractor}
+
+def register_extractor(name: str, *mime_types: str):
+    def decorator(extract):
+        for mime_type in mime_types:
+            EXTRACTORS[mime_type] = Extractor(name, extract)
+        return extract
+    return decorator
+
+# Per-format extraction stats: {name: {"files", "bytes", "seconds"}}
+_stats = {}
+_stats_lock = threading.Lock()
+
+def extractor_stats() -> dict:
+    with _stats_lock:
+        return {
+            name: {**stats, "avg_ms": round(stats["seconds"] / stats["files"] * 1000, 2) if stats["files"] else 0.0}
+            for name, stats in _stats.items()
+        }
+
+def _record(name: str, size: int, seconds: float):
+    with _stats_lock:
+        stats = _stats.setdefault(name, {"files": 0, "bytes": 0, "seconds": 0.0})
+        stats["files"] += 1
+        stats["bytes"] += size
+        stats["seconds"] = round(stats["seconds"] + seconds, 6)
+
+# --- MIME Sniffing ---
+SNIFF_BYTES = 8192
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+MAGIC_NUMBERS = [
+    (b"%PDF", "application/pdf"),
+    (b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", "application/x-ole-storage"), # .doc/.xls/.msg
+    (b"{\\rtf", "application/rtf"),
+    (b"\x89PNG", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF8", "image/gif"),
+]
+
+BOMS = [
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+]
+
+def _text_encoding(sample: bytes):
+    """
+    Returns the encoding of a text sample, or None if it looks binary.
+    """
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    if b"\x00" in sample:
+        return None
+    try:
+        # The sample may end in the middle of a character, hence the incremental decoder
+        codecs.getincrementaldecoder("utf-8")().decode(sample, final=False)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    # Legacy 8-bit text: mostly printable characters
+    printable = sum(1 for byte in sample if byte >= 32 or byte in b"\t\n\r\f")
+    return "cp1252" if printable >= 0.95 * len(sample) else None
+
+def sniff(file_path: str) -> tuple:
+    """
+    Detects (mime_type, text_encoding) from the file content, the extension is only a hint
+    for text formats. text_encoding is None for binary formats.
+    """
+    with open(file_path, "rb") as f:
+        sample = f.read(SNIFF_BYTES)
+
+    for magic, mime_type in MAGIC_NUMBERS:
+        if sample.startswith(magic):
+            return mime_type, None
+
+    if sample.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                if "word/document.xml" in archive.namelist():
+                    return DOCX_MIME, None
+        except zipfile.BadZipFile:
+            pass
+        return "application/zip", None # xlsx, pptx, odt, ... are left to Tika
+
+    encoding = _text_encoding(sample)
+    if encoding is None:
+        return "application/octet-stream", None
+
+    guessed, _ = mimetypes.guess_type(file_path)
+    head = sample.decode(encoding, errors="ignore").lstrip("\ufeff \t\r\n").lower()
+    if head.startswith(("<!doctype html", "<html")) or guessed in ("text/html", "application/xhtml+xml"):
+        return "text/html", encoding
+    if guessed in ("text/csv", "application/json", "text/markdown"):
+        return guessed, encoding
+    if head.startswith(("{", "[")):
+        return "application/json", encoding
+    if head.startswith("<?xml") or guessed in ("text/xml", "application/xml"):
+        return "application/xml", encoding # Markup worth a real parser, Tika handles it
+    return "text/plain", encoding
+
+# --- In-process Extractors ---
+def _read_decoded(file_path: str, encoding: str):
+    decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+    with open(file_path, "rb") as f:
+        while chunk := f.read(settings.UPLOAD_CHUNK_BYTES):
+            text = decoder.decode(chunk)
+            if text:
+                yield text
+    tail = decoder.decode(b"", final=True)
+    if tail:
+        yield tail
+
+@register_extractor("text", "text/plain", "text/csv", "application/json", "text/markdown")
+def _extract_plain(file_path: str, encoding: str, section_chars: int):
+    # Text-like formats are redacted as they are (JSON keys and CSV layout give the LLM context)
+    pending = ""
+    for text in _read_decoded(file_path, encoding):
+        pending += text
+        start = 0
+        while len(pending) - start >= section_chars:
+            # Cut on a line break when there is one, so sections end on whole lines
+            end = pending.rfind("\n", start, start + section_chars) + 1 or start + section_chars
+            yield pending[start:end]
+            start = end
+        pending = pending[start:]
+    if pending:
+        yield pending
+
+# Elements that end a line of text in (X)HTML
+BLOCK_TAGS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "table", "title", "pre"}
+
+class _SectionParser(HTMLParser):
+    """
+    Collects the text of (X)HTML and cuts it into sections: one per page (<div class="page">
+    in Tika's output) when the format has pages, otherwise blocks of about section_chars.
+    """
+
+    def __init__(self, section_chars: int):
+        super().__init__(convert_charrefs=True)
+        self.section_chars = section_chars
+        self.sections = [] # Finished sections, drained by the caller
+        self._parts = []
+        self._length = 0
+        self._skip = 0 # Inside <head>/<script>/<style>
+
+    def _cut(self):
+        if self._parts:
+            self.sections.append("".join(self._parts))
+            self._parts = []
+            self._length = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("head", "script", "style"):
+            self._skip += 1
+        elif tag == "br":
+            self._newline(tag) # HTML line breaks have no end tag
+
+    def handle_endtag(self, tag):
+        if tag in ("head", "script", "style"):
+            self._skip = max(0, self._skip - 1)
+        elif tag in BLOCK_TAGS and tag != "br" and not self._skip:
+            self._newline(tag)
+
+    def _newline(self, tag):
+        self._parts.append("\n")
+        self._length += 1
+        # Page ends always cut, other blocks only once the section is big enough
+        if tag == "div" or self._length >= self.section_chars:
+            self._cut()
+
+    def handle_data(self, data):
+        if not self._skip:
+            self._parts.append(data)
+            self._length += len(data)
+
+    def close(self):
+        super().close()
+        self._cut()
+
+def _drain(section_parser: _SectionParser):
+    sections, section_parser.sections = section_parser.sections, []
+    for section in sections:
+        if section.strip():
+            yield section
+
+def _parse_markup(chunks, section_chars: int):
+    section_parser = _SectionParser(section_chars)
+    for chunk in chunks:
+        section_parser.feed(chunk)
+        yield from _drain(section_parser)
+    section_parser.close()
+    yield from _drain(section_parser)
+
+@register_extractor("html", "text/html")
+def _extract_html(file_path: str, encoding: str, section_chars: int):
+    yield from _parse_markup(_read_decoded(file_path, encoding), section_chars)
+
+WORD_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+@register_extractor("docx", DOCX_MIME)
+def _extract_docx(file_path: str, encoding: str, section_chars: int):
+    # Body text only, streamed from word/document.xml (paragraphs are cleared once read)
+    parts = []
+    length = 0
+    with zipfile.ZipFile(file_path) as archive, archive.open("word/document.xml") as document_xml:
+        for _, element in ElementTree.iterparse(document_xml, events=("end",)):
+            tag = element.tag
+            if tag == WORD_NS + "t":
+                if element.text:
+                    parts.append(element.text)
+                    length += len(element.text)
+            elif tag == WORD_NS + "tab":
+                parts.append("\t")
+            elif tag in (WORD_NS + "br", WORD_NS + "cr"):
+                parts.append("\n")
+            elif tag == WORD_NS + "p":
+                parts.append("\n")
+                length += 1
+                element.clear()
+                if length >= section_chars:
+                    yield "".join(parts)
+                    parts = []
+                    length = 0
+    if parts:
+        yield "".join(parts)
+
+# --- Tika Fallback ---
+TIKA_READ_TIMEOUT = 60.0 # Seconds without output from the Tika server (tika-python's default)
+
+def _tika_endpoint() -> str:
+    # Same server tika-python uses (TIKA_SERVER_ENDPOINT), started by it when it is local and not running
+    from tika import tika as tika_client
+    endpoint = tika_client.ServerEndpoint
+    if not tika_client.TikaClientOnly:
+        url = urlparse(endpoint)
+        endpoint = tika_client.checkTikaServer(url.scheme, url.hostname, url.port, tika_client.TikaServerJar)
+    return endpoint
+
+def _extract_tika(file_path: str, encoding: str, section_chars: int):
+    # The file is streamed to the Tika server and its XHTML parsed as it arrives: one section per
+    # page for paged formats, only the current one is held in memory (tika-python buffers it all)
+    _ensure_tika()
+    timeout = httpx.Timeout(TIKA_READ_TIMEOUT, connect=5.0)
+    with open(file_path, "rb") as f, httpx.stream(
+        "PUT", f"{_tika_endpoint()}/tika", content=f, headers={"Accept": "text/html"}, timeout=timeout,
+    ) as response:
+        response.raise_for_status()
+        yield from _parse_markup(response.iter_text(), section_chars)
+
+TIKA_EXTRACTOR = Extractor("tika", _extract_tika)
+
+def iter_sections(file_path: str, section_chars: int = None):
+    """
+    Yields the text of a document page by page (or in sections of about section_chars).
+    The format is sniffed from the content and handled in-process when possible, Tika otherwise.
+    """
+    section_chars = section_chars or settings.DOCUMENT_SECTION_CHARS
+    mime_type, encoding = sniff(file_path)
+    extractor = EXTRACTORS.get(mime_type, TIKA_EXTRACTOR)
+    size = os.path.getsize(file_path)
+
+    # Time spent extracting only (not the consumer's redaction work between sections)
+    elapsed = 0.0
+    sections = extractor.extract(file_path, encoding, section_chars)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                section = next(sections)
+            except StopIteration:
+                break
+            finally:
+                elapsed += time.perf_counter() - started
+            yield section
+    finally:
+        _record(extractor.name, size, elapsed)
+        metrics.observe_stage("extract", elapsed)
 
 def extract_text(file_path: str = None, file_buffer: bytes = None) -> str:
     """
-    Extract text from a file path or bytes buffer using Tika.
+    Extract text from a file path or bytes buffer (whole document as one string).
     """
     try:
         if file_buffer:
-            parsed = parser.from_buffer(file_buffer)
+            with tempfile.NamedTemporaryFile(prefix="trustlayer-", delete=False) as spool:
+                spool.write(file_buffer)
+            try:
+                return extract_text(file_path=spool.name)
+            finally:
+                os.unlink(spool.name)
         elif file_path:
-            parsed = parser.from_file(file_path)
+            return "".join(iter_sections(file_path)).strip()
         else:
             return ""
-            
-        return parsed.get("content", "").strip()
     except Exception as e:
-        print(f"Error parsing document: {e}")
+        logger.error(f"Error parsing document: {e}")
         return ""
@@ -0,0 +1,214 @@
+import hashlib
+import json
+import logging
+import os
+import re
+
+from app.core.automaton import AhoCorasick
+from app.core.config import settings
+from app.core.startup import timed
+
+logger = logging.getLogger(__name__)
+
+# Which recognizers the analyzer runs, from settings.RECOGNIZERS_FILE (JSON). Without a file
+# every built-in English recognizer runs, as Presidio ships them. Read once per process.
+#   disable: built-in recognizers to drop, e.g. ["InAadhaarRecognizer", "AuTfnRecognizer"]
+#   enable: the only built-ins to keep instead ("SpacyRecognizer" is the NER one)
+#   thresholds: minimum score per entity type, "default" applies to all others
+#   recognizers: own entity types, with either regex patterns
+#       {"name": "employee_id", "entity": "EMPLOYEE_ID",
+#        "patterns": [{"regex": "\\bE-\\d{6}\\b", "score": 0.9}], "context": ["employee"]}
+#     or a deny-list of terms, matched on whole words ("terms_file": one term per line)
+#       {"name": "customers", "entity": "CUSTOMER", "terms": ["Acme Corp"], "terms_file": "customers.txt",
+#        "case_sensitive": false, "score": 1.0}
+DEFAULT_RECOGNIZERS = {"disable": [], "thresholds": {}, "recognizers": []}
+
+# Presidio compiles recognizer patterns with these flags, the pre-screen has to agree with it.
+# It uses the stdlib re module: patterns need its syntax (no \p{...} classes of the regex package)
+REGEX_FLAGS = re.IGNORECASE | re.MULTILINE | re.DOTALL
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class TermMatcher:
+    """
+    Deny-list lookup. Terms are split into words and all of them go into one AhoCorasick automaton
+    over words, so a text is scanned once however many terms there are, and only whole words
+    match ("Ann" is not found in "Annual").
+    """
+
+    def __init__(self, terms, case_sensitive: bool = False):
+        self.case_sensitive = case_sensitive
+        self.automaton = AhoCorasick(self._words(term) for term in terms)
+
+    def _words(self, text: str) -> tuple:
+        words = WORD_PATTERN.findall(text)
+        return tuple(words if self.case_sensitive else (word.casefold() for word in words))
+
+    def find(self, text: str) -> list[tuple[int, int]]:
+        """
+        Returns the (start, end) offsets of the terms in `text`, the longest one where several end on a word.
+        """
+        automaton = self.automaton
+        case_sensitive = self.case_sensitive
+        state = 0
+        starts = [] # Start offset of every word so far
+        found = []
+        for match in WORD_PATTERN.finditer(text):
+            word = match.group() if case_sensitive else match.group().casefold()
+            starts.append(match.start())
+            state = automaton.step(state, word)
+            term = automaton.matched(state)
+            if term is not None:
+                found.append((starts[-len(term)], match.end()))
+        return found
+
+    def search(self, text: str) -> bool:
+        automaton = self.automaton
+        state = 0
+        for match in WORD_PATTERN.finditer(text):
+            word = match.group() if self.case_sensitive else match.group().casefold()
+            state = automaton.step(state, word)
+            if automaton.matched(state) is not None:
+                return True
+        return False
+
+
+class CustomRecognizer:
+    __slots__ = ("name", "entity", "patterns", "context", "matcher", "score", "terms")
+
+    def __init__(self, name: str, entity: str, patterns=None, context=None, matcher=None, score=1.0, terms=0):
+        self.name = name
+        self.entity = entity
+        self.patterns = patterns or [] # [(name, regex, score)]
+        self.context = context or None
+        self.matcher = matcher # TermMatcher of a deny-list
+        self.score = score # Of deny-list matches
+        self.terms = terms
+
+
+class RecognizerConfig:
+    """
+    Compiled recognizer configuration: the built-ins to keep, own recognizers (deny-lists built
+    into their automaton) and score thresholds. `version` changes whenever the detections may
+    change, including edits of a terms file, and goes into the span cache key.
+    """
+
+    def __init__(self, config: dict, base_dir: str = "."):
+        self.disable = frozenset(config.get("disable", ()))
+        self.enable = frozenset(config["enable"]) if "enable" in config else None
+        thresholds = dict(config.get("thresholds", {}))
+        self.default_threshold = float(thresholds.pop("default", 0.0))
+        self.thresholds = {entity: float(score) for entity, score in thresholds.items()}
+
+        digest = hashlib.sha256(json.dumps(config, sort_keys=True).encode())
+        self.recognizers = []
+        self._prescreen = [] # Compiled patterns of own regex recognizers
+        for entry in config.get("recognizers", []):
+            name = entry.get("name", entry["entity"])
+            if "patterns" in entry:
+                patterns = [
+                    (pattern.get("name", name), pattern["regex"], float(pattern.get("score", 0.8)))
+                    for pattern in entry["patterns"]
+                ]
+                self._prescreen.extend(re.compile(pattern, REGEX_FLAGS) for _, pattern, _ in patterns)
+                self.recognizers.append(CustomRecognizer(name, entry["entity"], patterns=patterns, context=entry.get("context")))
+            else:
+                terms = list(entry.get("terms", []))
+                if "terms_file" in entry:
+                    path = os.path.join(base_dir, entry["terms_file"])
+                    with open(path, encoding="utf-8") as f:
+                        content = f.read()
+                    digest.update(content.encode("utf-8"))
+                    terms.extend(line.strip() for line in content.splitlines())
+                terms = [term for term in terms if term]
+                with timed(f"recognizer_{name}"):
+                    matcher = TermMatcher(terms, case_sensitive=entry.get("case_sensitive", False))
+                self.recognizers.append(CustomRecognizer(
+                    name, entry["entity"], matcher=matcher, score=float(entry.get("score", 1.0)), terms=len(terms),
+                ))
+        self._matchers = [recognizer.matcher for recognizer in self.recognizers if recognizer.matcher]
+        self.version = digest.hexdigest()[:16]
+
+    def keeps(self, builtin_name: str) -> bool:
+        if self.enable is not None:
+            return builtin_name in self.enable
+        return builtin_name not in self.disable
+
+    def prescreen(self, text: str) -> bool:
+        """
+        True if one of the own recognizers may find something: such strings need the pattern tier
+        even without anything the built-in pre-screen knows.
+        """
+        return any(pattern.search(text) for pattern in self._prescreen) or any(matcher.search(text) for matcher in self._matchers)
+
+    @property
+    def analyzer_threshold(self) -> float:
+        # The analyzer may only drop what no threshold lets through, passes() applies the rest
+        return min([self.default_threshold, *self.thresholds.values()])
+
+    def passes(self, entity_type: str, score: float) -> bool:
+        return score >= self.thresholds.get(entity_type, self.default_threshold)
+
+    def build_registry(self, nlp_engine):
+        """
+        Presidio registry with the kept built-ins and the own recognizers. Built once per process
+        together with the analyzer: dropped recognizers cost nothing per analyze call.
+        """
+        from presidio_analyzer import EntityRecognizer, Pattern, PatternRecognizer, RecognizerRegistry, RecognizerResult
+
+        class DenyListRecognizer(EntityRecognizer):
+            # Needs no NLP artifacts, so it also runs in the pattern tier
+            def __init__(self, recognizer: CustomRecognizer):
+                self.matcher = recognizer.matcher
+                self.score = recognizer.score
+                super().__init__(supported_entities=[recognizer.entity], name=recognizer.name, supported_language="en")
+
+            def load(self):
+                pass
+
+            def analyze(self, text, entities, nlp_artifacts=None):
+                entity = self.supported_entities[0]
+                return [RecognizerResult(entity, start, end, self.score) for start, end in self.matcher.find(text)]
+
+        registry = RecognizerRegistry(supported_languages=["en"])
+        registry.load_predefined_recognizers(languages=["en"], nlp_engine=nlp_engine)
+        builtin = {recognizer.name for recognizer in registry.recognizers}
+        for name in (self.enable or set()) | self.disable:
+            if name not in builtin:
+                logger.warning(f"Recognizers: no built-in recognizer named {name}")
+        registry.recognizers = [recognizer for recognizer in registry.recognizers if self.keeps(recognizer.name)]
+        kept = len(registry.recognizers)
+
+        for recognizer in self.recognizers:
+            if recognizer.matcher is not None:
+                registry.add_recognizer(DenyListRecognizer(recognizer))
+            else:
+                registry.add_recognizer(PatternRecognizer(
+                    supported_entity=recognizer.entity,
+                    name=recognizer.name,
+                    patterns=[Pattern(name, pattern, score) for name, pattern, score in recognizer.patterns],
+                    context=recognizer.context,
+                ))
+        logger.info(
+            f"Recognizers: {kept} of {len(builtin)} built-in, {len(self.recognizers)} own "
+            f"({sum(recognizer.terms for recognizer in self.recognizers)} deny-list terms)"
+        )
+        return registry
+
+
+def load_config(path: str) -> RecognizerConfig:
+    """
+    Reads the recognizers file; the built-in defaults are used when it doesn't exist or can't be loaded.
+    """
+    if not os.path.exists(path):
+        return RecognizerConfig(DEFAULT_RECOGNIZERS)
+    try:
+        with open(path, encoding="utf-8") as f:
+            return RecognizerConfig(json.load(f), base_dir=os.path.dirname(os.path.abspath(path)))
+    except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+        logger.error(f"Recognizers: could not load {path}, using the built-in defaults: {e}")
+    return RecognizerConfig(DEFAULT_RECOGNIZERS)
+
+
+recognizer_config = load_config(settings.RECOGNIZERS_FILE)
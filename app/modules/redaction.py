@@ -1,25 +1,124 @@
-from presidio_analyzer import AnalyzerEngine
-from presidio_analyzer.nlp_engine import NlpEngineProvider
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
+import bisect
+import codecs
+import hashlib
+import itertools
+import json
+import threading
+from collections import namedtuple
+from importlib.metadata import version
+
+from app.core import metrics
+from app.core.automaton import AhoCorasick
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.core.startup import timed
+from app.modules.recognizers import recognizer_config
 
 # Configure NLP Engine to use small model (faster install)
 configuration = {
     "nlp_engine_name": "spacy",
     "models": [{"lang_code": "en", "model_name": "en_core_web_sm"}],
 }
-provider = NlpEngineProvider(nlp_configuration=configuration)
-nlp_engine = provider.create_engine()
 
-# Initialize engines
-analyzer = AnalyzerEngine(nlp_engine=nlp_engine, supported_languages=["en"])
-anonymizer = AnonymizerEngine()
+# Engines are built on first use (or by warm_up()), not at import: processes that never
+# analyze text (dashboard, proxy main process with workers) don't pay for spaCy at all.
+Engines = namedtuple("Engines", ["nlp_engine", "analyzer", "batch_analyzer", "anonymizer", "empty_nlp_artifacts"])
+
+_engines = None
+_engines_lock = threading.Lock()
+
+def _build_engines() -> Engines:
+    from presidio_analyzer import AnalyzerEngine, BatchAnalyzerEngine
+    from presidio_analyzer.nlp_engine import NlpArtifacts, NlpEngineProvider
+    from presidio_anonymizer import AnonymizerEngine
+
+    provider = NlpEngineProvider(nlp_configuration=configuration)
+    nlp_engine = provider.create_engine()
+
+    # Initialize engines: only the recognizers of the configuration (see app/modules/recognizers.py)
+    analyzer = AnalyzerEngine(
+        registry=recognizer_config.build_registry(nlp_engine),
+        nlp_engine=nlp_engine,
+        supported_languages=["en"],
+        default_score_threshold=recognizer_config.analyzer_threshold,
+    )
+    return Engines(
+        nlp_engine=nlp_engine,
+        analyzer=analyzer,
+        batch_analyzer=BatchAnalyzerEngine(analyzer_engine=analyzer),
+        anonymizer=AnonymizerEngine(),
+        # Used by the pattern tier: recognizers run without any spaCy output
+        empty_nlp_artifacts=NlpArtifacts(
+            entities=[], tokens=[], tokens_indices=[], lemmas=[], nlp_engine=nlp_engine, language="en"
+        ),
+    )
+
+def get_engines() -> Engines:
+    """
+    Returns the Presidio/spaCy engines, building them on the first call.
+    Thread-safe: concurrent first callers wait for a single build.
+    """
+    global _engines
+    if _engines is None:
+        with _engines_lock:
+            if _engines is None:
+                with timed("redaction_engines"):
+                    _engines = _build_engines()
+    return _engines
+
+def engines_loaded() -> bool:
+    return _engines is not None
+
+# Dummy inputs covering both detection tiers
+WARMUP_JOBS = [
+    ("My name is John Doe and I live in Paris.", "ner"),
+    ("Contact: john.doe@example.com, +1 212-555-0199", "pattern"),
+]
+
+def warm_up():
+    """
+    Builds the engines and runs a few analyses so the spaCy pipeline and recognizers
+    are allocated before real traffic arrives. Bypasses the span cache.
+    """
+    get_engines()
+    with timed("redaction_warmup"):
+        for _ in range(settings.WARMUP_ITERATIONS):
+            analyze_uncached(WARMUP_JOBS)
+
+# Cache of detected entity spans, keyed by a hash of (analyzer config, text).
+# Only offsets are cached (never tokens or values) so numbering stays per-request.
+ANALYZER_CONFIG_VERSION = hashlib.sha256(
+    (json.dumps({
+        "nlp": configuration,
+        "mode": settings.REDACTION_DETECTION_MODE,
+        "prose_min_words": settings.REDACTION_PROSE_MIN_WORDS,
+        "recognizers": recognizer_config.version,
+    }, sort_keys=True) + version("presidio-analyzer")).encode()
+).hexdigest()[:16]
+
+Span = namedtuple("Span", ["start", "end", "entity_type", "score"])
+
+def _span_cache_sizeof(key: bytes, spans: tuple) -> int:
+    # Rough footprint: key + tuple header + one namedtuple per span
+    return len(key) + 64 + 96 * len(spans)
+
+span_cache = LRUCache(
+    max_bytes=settings.REDACTION_CACHE_MAX_BYTES,
+    ttl=settings.REDACTION_CACHE_TTL_SECONDS,
+    sizeof=_span_cache_sizeof,
+)
+metrics.register_stats(
+    "trustlayer_span_cache", "Entity span cache", span_cache.stats,
+    gauges=("entries", "bytes"), counters=("hits", "misses", "evictions", "expirations"),
+)
 
 class RedactionResult:
-    def __init__(self, text: str, items: dict, mapping: dict):
+    def __init__(self, text: str, items: dict, mapping: dict, offsets: list = None, source_length: int = None):
         self.text = text
         self.items = items # {entity_type: count}
         self.mapping = mapping # {token: original_value}
+        self.offsets = offsets or [] # [(start, end, redacted_start, redacted_end)] per token
+        self.source_length = source_length # Length of the original text
 
 import re
 
@@ -28,52 +127,364 @@ UUID_PATTERN = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-
 # Regex for MongoDB ObjectIDs or simple Hashes (24 hex chars)
 HASH_PATTERN = re.compile(r'^[0-9a-f]{24,}$', re.IGNORECASE)
 
-def redact_text(text: str) -> RedactionResult:
-    # 0. Safeguard: Ignore machine IDs
-    if len(text) > 20: 
+def _is_machine_id(text: str) -> bool:
+    # Safeguard: Ignore machine IDs
+    if len(text) > 20:
         if UUID_PATTERN.match(text) or HASH_PATTERN.match(text):
-             # It's an ID, not a sentence. Skip.
-             return RedactionResult(text, {}, {})
+            # It's an ID, not a sentence. Skip.
+            return True
+    return False
 
-    # 1. Analyze
-    results = analyzer.analyze(text=text, language='en')
-    
-    # 2. Count entities and Build Mapping
-    entity_counts = {}
-    mapping = {}
-    
-    # We need to sort results by start index in reverse to replace without messing up indices
-    sorted_results = sorted(results, key=lambda x: x.start, reverse=True)
-    
-    # Manual replacement to build mapping (Presidio Deanonymize is complex, manual is robust for simple cases)
-    # We will use simple sequential tokens: [PERSON_1], [EMAIL_1]
-    
-    working_text = text
-    type_counters = {} # {PERSON: 1, EMAIL: 1}
-    
-    final_items = {} # For Audit log
+# --- Tiered Detection ---
+# Cheap pre-screen for the structured identifiers the pattern recognizers look for
+PRESCREEN_PATTERN = re.compile(
+    r"[\w.+-]+@[\w-]+\.[\w.-]+"                 # Email
+    r"|\d(?:[\s().-]*\d){6,}"                   # Phone, Card, SSN (7+ digits, any separators)
+    r"|\b[A-Z]{2}\d{2}(?:\s?[A-Z0-9]){11,30}"    # IBAN
+)
+# An alphabetic word (no digits/underscores), e.g. not "gpt-4o" or "en_US"
+PROSE_WORD_PATTERN = re.compile(r"^[^\W\d_]{2,}[.,!?;:]?$")
 
-    for res in sorted_results:
-        entity_type = res.entity_type
-        original_value = text[res.start:res.end]
-        
-        # Update counters
-        type_counters[entity_type] = type_counters.get(entity_type, 0) + 1
-        count = type_counters[entity_type]
+def _looks_like_prose(text: str) -> bool:
+    # Model names, locales, ids and enum values are single tokens; sentences are not
+    words = text.split(maxsplit=16)
+    if len(words) < settings.REDACTION_PROSE_MIN_WORDS:
+        return False
+    alphabetic = sum(1 for word in words if PROSE_WORD_PATTERN.match(word))
+    return alphabetic >= settings.REDACTION_PROSE_MIN_WORDS
+
+def _select_tier(text: str) -> str:
+    """
+    Decides how much detection a string needs: "ner" (full spaCy + patterns),
+    "pattern" (Presidio pattern recognizers only) or "none".
+    """
+    # Safeguard: Machine IDs never reach any detector
+    if _is_machine_id(text):
+        return "none"
+
+    mode = settings.REDACTION_DETECTION_MODE
+    if mode == "full":
+        return "ner"
+    if mode == "tiered" and _looks_like_prose(text):
+        return "ner"
+    if PRESCREEN_PATTERN.search(text) or recognizer_config.prescreen(text):
+        return "pattern"
+    return "none"
+
+def _analyze_pattern_tier(text: str):
+    engines = get_engines()
+    return engines.analyzer.analyze(text=text, language='en', nlp_artifacts=engines.empty_nlp_artifacts)
+
+def _cache_key(text: str) -> bytes:
+    return hashlib.sha256(f"{ANALYZER_CONFIG_VERSION}\0{text}".encode("utf-8", "surrogatepass")).digest()
+
+def _to_spans(results) -> tuple:
+    if recognizer_config.thresholds:
+        # Per-entity thresholds (the analyzer only applies the lowest of all)
+        results = [r for r in results if recognizer_config.passes(r.entity_type, r.score)]
+    return tuple(Span(r.start, r.end, r.entity_type, r.score) for r in results)
+
+def plan_batch(texts: list[str]) -> tuple[list, dict]:
+    """
+    Cache lookup pass of analyze_batch(). Returns the spans known so far (None for misses)
+    and the misses grouped as {cache_key: (tier, [indexes])}.
+    """
+    spans = [()] * len(texts)
+
+    # Group misses by key so repeated strings in one payload are analyzed once
+    misses = {}
+    for i, text in enumerate(texts):
+        tier = _select_tier(text)
+        if tier == "none":
+            continue
+
+        key = _cache_key(text)
+        cached = span_cache.get(key)
+        if cached is not None:
+            spans[i] = cached
+        else:
+            spans[i] = None
+            misses.setdefault(key, (tier, []))[1].append(i)
+    return spans, misses
+
+def analyze_uncached(jobs: list[tuple[str, str]]) -> list[tuple]:
+    """
+    Runs detection for a list of (text, tier) jobs, all NER jobs in a single nlp.pipe pass.
+    Touches no shared state, so it is safe to run in a worker process.
+    """
+    spans = [()] * len(jobs)
+
+    ner_jobs = []
+    for i, (text, tier) in enumerate(jobs):
+        if tier == "ner":
+            ner_jobs.append(i)
+        else:
+            spans[i] = _to_spans(_analyze_pattern_tier(text))
+
+    if ner_jobs:
+        batch_results = get_engines().batch_analyzer.analyze_iterator(
+            texts=[jobs[i][0] for i in ner_jobs], language='en'
+        )
+        for i, results in zip(ner_jobs, batch_results):
+            spans[i] = _to_spans(results)
+    return spans
+
+def fill_misses(spans: list, misses: dict, results: list[tuple]) -> list[tuple]:
+    """
+    Stores freshly analyzed spans in the cache and fills the gaps left by plan_batch().
+    """
+    for (key, (_, indexes)), result_spans in zip(misses.items(), results):
+        span_cache.put(key, result_spans)
+        for i in indexes:
+            spans[i] = result_spans
+    return spans
+
+def miss_jobs(texts: list[str], misses: dict) -> list[tuple[str, str]]:
+    return [(texts[indexes[0]], tier) for tier, indexes in misses.values()]
+
+def analyze_batch(texts: list[str]) -> list[tuple]:
+    """
+    Returns the entity spans for every text, served from the span cache when possible.
+    Cache misses that need NER go through the NLP pipeline in one pass.
+    """
+    spans, misses = plan_batch(texts)
+    if misses:
+        fill_misses(spans, misses, analyze_uncached(miss_jobs(texts, misses)))
+    return spans
+
+def analyze_text(text: str) -> tuple:
+    return analyze_batch([text])[0]
+
+def resolve_overlaps(spans) -> list:
+    """
+    Drops overlapping spans (e.g. EMAIL_ADDRESS and URL on the same characters), keeping the best
+    one according to settings.REDACTION_OVERLAP_PRIORITY. Returns the survivors sorted by start.
+    """
+    if settings.REDACTION_OVERLAP_PRIORITY == "length":
+        priority = lambda span: (span.start - span.end, -span.score, span.start)
+    else:
+        priority = lambda span: (-span.score, span.start - span.end, span.start)
+
+    # Accepted spans, kept sorted by start so each candidate only checks its two neighbours
+    starts, ends, kept = [], [], []
+    for span in sorted(spans, key=priority):
+        if span.end <= span.start:
+            continue
+        i = bisect.bisect_right(starts, span.start)
+        if i > 0 and ends[i - 1] > span.start:
+            continue
+        if i < len(starts) and starts[i] < span.end:
+            continue
+        starts.insert(i, span.start)
+        ends.insert(i, span.end)
+        kept.insert(i, span)
+    return kept
+
+class PseudonymMap:
+    """
+    Assigns tokens per original value: the same value always gets the same token and a token
+    never stands for two values. Share one map across everything that ends up in one LLM context
+    (all leaves of a payload, all windows of a document, all turns of a conversation).
+    """
+
+    def __init__(self):
+        self.tokens = {} # {(entity_type, value): token}
+        self.values = {} # {token: value}, i.e. the de-anonymization mapping
+        self.counters = {} # {entity_type: last number used}
+
+    def token(self, entity_type: str, value: str) -> str:
+        key = (entity_type, value)
+        token = self.tokens.get(key)
+        if token is None:
+            # We will use simple sequential tokens: [PERSON_1], [EMAIL_1] (numbered in order of appearance)
+            count = self.counters.get(entity_type, 0) + 1
+            self.counters[entity_type] = count
+            token = f"[{entity_type}_{count}]"
+            self.tokens[key] = token
+            self.values[token] = value
+        return token
+
+def _render(text: str, spans, pseudonyms: PseudonymMap, result: RedactionResult, base: int = 0, redacted_base: int = 0) -> list[str]:
+    """
+    Replaces `spans` (non-overlapping, sorted) in `text` with tokens and returns the output segments.
+    Tokens, counts and offsets are added to `result`; tokens come from `pseudonyms` so several
+    pieces of text can share them. `base`/`redacted_base` shift the recorded offsets.
+    """
+    segments = []
+    cursor = 0
+    redacted_length = redacted_base
+
+    # Single linear pass: copy the text between entities, emit a token for each entity
+    for span in spans:
+        entity_type = span.entity_type
+        value = text[span.start:span.end]
         
-        # Create Token
-        token = f"[{entity_type}_{count}]"
+        # Create Token (reused if this value was seen before)
+        token = pseudonyms.token(entity_type, value)
         
         # Store Mapping
-        mapping[token] = original_value
-        
-        # Replace in text (string slicing)
-        working_text = working_text[:res.start] + token + working_text[res.end:]
+        result.mapping[token] = value
+
+        gap = text[cursor:span.start]
+        segments.append(gap)
+        segments.append(token)
+        redacted_length += len(gap)
+        result.offsets.append((base + span.start, base + span.end, redacted_length, redacted_length + len(token)))
+        redacted_length += len(token)
+        cursor = span.end
         
         # Update Audit Counts
-        final_items[entity_type] = final_items.get(entity_type, 0) + 1
+        result.items[entity_type] = result.items.get(entity_type, 0) + 1
+
+    segments.append(text[cursor:])
+    return segments
+
+def build_result(text: str, spans, pseudonyms: PseudonymMap = None) -> RedactionResult:
+    if not spans:
+        return RedactionResult(text, {}, {}, source_length=len(text))
+
+    result = RedactionResult("", {}, {}, source_length=len(text))
+    # One entity per character range
+    segments = _render(text, resolve_overlaps(spans), pseudonyms or PseudonymMap(), result)
+    result.text = "".join(segments)
+    return result
+
+class WindowedRedactor:
+    """
+    Redacts a document that arrives in sections (pages) without ever analyzing it as a whole.
+    Text is analyzed in windows of `window` chars; neighbouring windows share `overlap` chars so
+    entities on a boundary are seen in full by one of them and emitted exactly once.
+    Token numbering is continuous over the whole document.
+    Detection is up to the caller (sync or via the worker pool), see redact_sections() for the loop.
+    """
+
+    def __init__(self, window: int = None, overlap: int = None, pseudonyms: PseudonymMap = None):
+        self.window = window or settings.DOCUMENT_WINDOW_CHARS
+        overlap = settings.DOCUMENT_WINDOW_OVERLAP_CHARS if overlap is None else overlap
+        # Every window has to move the output forward by at least half its size
+        self.overlap = max(0, min(overlap, self.window // 4))
+
+        self._pending = [] # Sections not yet merged into the buffer
+        self._pending_length = 0
+        self._buffer = "" # Text from absolute offset `_base` on: context + not yet emitted text
+        self._base = 0
+        self._emitted = 0 # Absolute offset up to which the output is final
+        self._final = False
+
+        self._pseudonyms = pseudonyms or PseudonymMap()
+        self._segments = []
+        self._redacted_length = 0
+        self._result = RedactionResult("", {}, {}, source_length=0)
+
+    def add(self, text: str):
+        if text:
+            self._pending.append(text)
+            self._pending_length += len(text)
+            self._result.source_length += len(text)
+
+    def finish(self):
+        # No more sections: the remaining text is analyzed even if shorter than a window
+        self._final = True
+
+    def _last_window(self) -> bool:
+        return self._final and len(self._buffer) <= self.window
+
+    def next_window(self):
+        """
+        Returns the next text to analyze, or None until enough text is buffered (or everything is emitted).
+        """
+        if len(self._buffer) + self._pending_length < self.window and not self._final:
+            return None
+        if self._pending:
+            self._buffer = "".join([self._buffer, *self._pending])
+            self._pending = []
+            self._pending_length = 0
+        if self._emitted >= self._base + len(self._buffer):
+            return None
+        return self._buffer[:self.window]
+
+    def commit(self, spans):
+        """
+        Applies the spans found in the window returned by next_window() and emits its settled part.
+        """
+        window_length = min(len(self._buffer), self.window)
+        start = self._emitted - self._base # Everything before was emitted by the previous window
+        last = self._last_window()
 
-    return RedactionResult(working_text, final_items, mapping)
+        if last:
+            cut = window_length
+        else:
+            # Keep the tail for the next window, ending the output on whitespace if possible
+            cut = window_length - self.overlap
+            space = max(self._buffer.rfind(char, start, cut) for char in " \n\t")
+            if space >= cut - self.overlap and space > start:
+                cut = space + 1
+
+        accepted = []
+        for span in resolve_overlaps(spans):
+            if span.start < start:
+                continue # In the shared context, already handled
+            if span.start >= cut:
+                break # Re-detected with full context by the next window
+            if not last and span.end >= window_length:
+                cut = span.start # May be cut off by the window edge, leave it to the next window
+                break
+            accepted.append(span)
+        if accepted:
+            cut = max(cut, accepted[-1].end)
+        if cut <= start:
+            cut = window_length # Degenerate case (overlap shorter than an entity), just move on
+
+        segments = _render(
+            self._buffer[start:cut],
+            [span._replace(start=span.start - start, end=span.end - start) for span in accepted],
+            self._pseudonyms,
+            self._result,
+            base=self._emitted,
+            redacted_base=self._redacted_length,
+        )
+        self._segments.extend(segments)
+        self._redacted_length += sum(len(segment) for segment in segments)
+        self._emitted = self._base + cut
+
+        # Drop what no longer serves as context for the next window
+        keep_from = max(cut - self.overlap, 0)
+        self._buffer = self._buffer[keep_from:]
+        self._base += keep_from
+
+    def result(self) -> RedactionResult:
+        self._result.text = "".join(self._segments)
+        return self._result
+
+def redact_text(text: str, pseudonyms: PseudonymMap = None) -> RedactionResult:
+    # 1. Analyze (cached, machine IDs and non-PII metadata are skipped)
+    spans = analyze_text(text)
+    
+    return build_result(text, spans, pseudonyms)
+
+def redact_sections(sections, pseudonyms: PseudonymMap = None) -> RedactionResult:
+    """
+    Redacts a document given as an iterable of text sections (see WindowedRedactor).
+    """
+    redactor = WindowedRedactor(pseudonyms=pseudonyms)
+    for section in itertools.chain(sections, [None]):
+        if section is None:
+            redactor.finish()
+        else:
+            redactor.add(section)
+        while (window := redactor.next_window()) is not None:
+            redactor.commit(analyze_text(window))
+    return redactor.result()
+
+def redact_batch(texts: list[str], pseudonyms: PseudonymMap = None) -> list[RedactionResult]:
+    """
+    Redacts many strings at once (e.g. every leaf of a JSON payload).
+    The spaCy pipeline runs over all of them in a single nlp.pipe pass,
+    results are returned in the same order as the input. Tokens are shared by the whole batch.
+    """
+    batch_spans = analyze_batch(texts)
+    pseudonyms = pseudonyms or PseudonymMap()
+    return [build_result(text, spans, pseudonyms) for text, spans in zip(texts, batch_spans)]
 
 def deanonymize_text(text: str, mapping: dict) -> str:
     """
@@ -83,3 +494,80 @@ def deanonymize_text(text: str, mapping: dict) -> str:
     for token, original_value in mapping.items():
         working_text = working_text.replace(token, original_value)
     return working_text
+
+class StreamRestorer:
+    """
+    Incremental deanonymize_text() for streamed responses.
+    Bytes are decoded incrementally (multibyte characters may be split between chunks) and all
+    tokens are matched by one automaton. Only a possible partial token is held back, everything
+    else is emitted immediately, so tokens split across chunks are still restored.
+    """
+
+    def __init__(self, mapping: dict):
+        self.mapping = mapping
+        self.restored = 0 # Tokens restored so far
+        self._automaton = AhoCorasick(mapping.keys()) if mapping else None
+        self._decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self._state = 0
+        self._pending = "" # Held back: the partial token matched so far
+
+    def feed(self, chunk: bytes) -> bytes:
+        return self.feed_text(self._decoder.decode(chunk)).encode("utf-8")
+
+    def flush(self) -> bytes:
+        """
+        End of stream: returns whatever is still held back.
+        """
+        text = self.feed_text(self._decoder.decode(b"", final=True))
+        return (text + self.flush_text()).encode("utf-8")
+
+    def flush_text(self) -> str:
+        text = self._pending
+        self._pending = ""
+        self._state = 0
+        return text
+
+    def feed_text(self, text: str) -> str:
+        if self._automaton is None:
+            return text
+
+        automaton = self._automaton
+        first_chars = automaton.first_chars
+        state = self._state
+        pending = self._pending
+        out = []
+
+        i = 0
+        length = len(text)
+        while i < length:
+            if state == 0:
+                # Nothing pending: copy everything up to the next possible token start
+                start = i
+                while i < length and text[i] not in first_chars:
+                    i += 1
+                if i > start:
+                    out.append(text[start:i])
+                if i == length:
+                    break
+
+            pending += text[i]
+            state = automaton.step(state, text[i])
+            i += 1
+
+            token = automaton.matched(state)
+            if token is not None:
+                out.append(pending[:len(pending) - len(token)])
+                out.append(self.mapping[token])
+                self.restored += 1
+                pending = ""
+                state = 0
+            else:
+                # Only the current partial match can still become a token
+                keep = automaton.depth[state]
+                if len(pending) > keep:
+                    out.append(pending[:len(pending) - keep])
+                    pending = pending[len(pending) - keep:]
+
+        self._state = state
+        self._pending = pending
+        return "".join(out)
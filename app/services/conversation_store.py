@@ -0,0 +1,129 @@
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from typing import Optional
+
+from app.core import metrics
+from app.core.cache import LRUCache
+from app.core.config import settings
+from app.modules.redaction import PseudonymMap, RedactionResult
+from app.services.redaction_executor import redact_batch_async
+
+logger = logging.getLogger(__name__)
+
+
+def _text_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+
+
+class Conversation:
+    """
+    Redaction state of one conversation: the pseudonym map (so "John Doe" is [PERSON_1] in
+    every turn) and the results of texts already redacted (history resent with every turn).
+    """
+
+    __slots__ = ("pseudonyms", "leaves")
+
+    def __init__(self):
+        self.pseudonyms = PseudonymMap()
+        self.leaves = OrderedDict() # {text cache key: RedactionResult}, oldest first
+
+    def size(self) -> int:
+        # Rough footprint, for the store's byte cap
+        mapping_bytes = sum(len(token) + len(value) + 160 for token, value in self.pseudonyms.values.items())
+        leaf_bytes = sum(len(key) + 2 * len(result.text) + 200 for key, result in self.leaves.items())
+        return 256 + mapping_bytes + leaf_bytes
+
+
+class ConversationStore:
+    """
+    Conversations by id, expiring after `ttl` seconds without a turn and capped in entries/bytes.
+    """
+
+    def __init__(self, ttl: float, max_entries: int, max_bytes: int, max_leaves: int):
+        self._cache = LRUCache(
+            max_bytes=max_bytes,
+            ttl=ttl,
+            sizeof=lambda conversation_id, conversation: len(conversation_id) + conversation.size(),
+            max_entries=max_entries,
+        )
+        self.max_leaves = max_leaves
+        self._sweeper = None
+        self.reused = 0 # Texts served from the conversation instead of being analyzed
+
+    def get(self, conversation_id: str) -> Conversation:
+        conversation = self._cache.get(conversation_id)
+        if conversation is None:
+            conversation = Conversation()
+            self._cache.put(conversation_id, conversation)
+        return conversation
+
+    def save(self, conversation_id: str, conversation: Conversation):
+        # Re-put after every turn: refreshes the expiry and the size accounting
+        while len(conversation.leaves) > self.max_leaves:
+            conversation.leaves.popitem(last=False)
+        self._cache.put(conversation_id, conversation)
+
+    async def redact(self, conversation_id: Optional[str], texts: list[str]) -> tuple[list[RedactionResult], dict]:
+        """
+        Redacts the texts of one turn. Returns the results (same order) and the mapping of every
+        token used so far in the conversation, since the answer may refer to any earlier turn.
+        Without a conversation id the texts only share tokens among themselves.
+        """
+        if conversation_id is None:
+            pseudonyms = PseudonymMap()
+            return await redact_batch_async(texts, pseudonyms), pseudonyms.values
+
+        conversation = self.get(conversation_id)
+        keys = [_text_key(text) for text in texts]
+        results = [conversation.leaves.get(key) for key in keys]
+
+        # Only new texts (usually the latest message) are analyzed
+        fresh = [i for i, result in enumerate(results) if result is None]
+        self.reused += len(texts) - len(fresh)
+        if fresh:
+            fresh_results = await redact_batch_async([texts[i] for i in fresh], conversation.pseudonyms)
+            for i, result in zip(fresh, fresh_results):
+                results[i] = result
+                conversation.leaves[keys[i]] = result
+
+        self.save(conversation_id, conversation)
+        return results, conversation.pseudonyms.values
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        # Same cadence as the mapping store: both hold raw PII that must not outlive its TTL
+        while True:
+            await asyncio.sleep(settings.MAPPING_SWEEP_INTERVAL_SECONDS)
+            try:
+                expired = self._cache.sweep()
+                if expired:
+                    logger.info(f"Conversation store: dropped {expired} idle conversation(s)")
+            except Exception as e:
+                logger.error(f"Conversation store sweep failed: {e}")
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        del stats["hits"], stats["misses"]
+        return {**stats, "reused_texts": self.reused}
+
+
+conversation_store = ConversationStore(
+    ttl=settings.CONVERSATION_TTL_SECONDS,
+    max_entries=settings.CONVERSATION_MAX_ENTRIES,
+    max_bytes=settings.CONVERSATION_MAX_BYTES,
+    max_leaves=settings.CONVERSATION_MAX_LEAVES,
+)
+metrics.register_stats(
+    "trustlayer_conversations", "Conversation store", conversation_store.stats,
+    gauges=("entries", "bytes"), counters=("evictions", "expirations", "reused_texts"),
+)
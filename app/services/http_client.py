@@ -0,0 +1,92 @@
+import logging
+from typing import Optional
+
+import httpx
+
+from app.core import metrics
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# One pooled client per process: connections (TCP + TLS, HTTP/2) are reused across requests
+_client: Optional[httpx.AsyncClient] = None
+_requests_sent = 0
+
+
+async def _count_request(request: httpx.Request):
+    global _requests_sent
+    _requests_sent += 1
+
+
+def _build_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=settings.LLM_BASE_URL,
+        http2=settings.LLM_HTTP2,
+        limits=httpx.Limits(
+            max_connections=settings.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(
+            connect=settings.LLM_CONNECT_TIMEOUT,
+            read=settings.LLM_READ_TIMEOUT,
+            write=settings.LLM_WRITE_TIMEOUT,
+            pool=settings.LLM_POOL_TIMEOUT,
+        ),
+        event_hooks={"request": [_count_request]},
+    )
+
+
+async def start_client():
+    """
+    Called on application startup.
+    """
+    global _client
+    if _client is None:
+        _client = _build_client()
+        logger.info(f"Upstream client ready for {settings.LLM_BASE_URL} (HTTP/2: {settings.LLM_HTTP2})")
+
+
+async def close_client():
+    """
+    Called on application shutdown: closes all pooled connections.
+    """
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    # Lazily created for callers that run without the FastAPI lifecycle (scripts, proxy)
+    global _client
+    if _client is None or _client.is_closed:
+        _client = _build_client()
+    return _client
+
+
+def pool_stats() -> dict:
+    """
+    Connection pool usage of the shared client.
+    """
+    stats = {"connections": 0, "idle": 0, "active": 0, "http2": 0, "requests_sent": _requests_sent}
+    if _client is None:
+        return stats
+
+    # httpx does not expose its pool, read it from the underlying httpcore transport
+    pool = getattr(_client._transport, "_pool", None)
+    for connection in getattr(pool, "connections", []):
+        stats["connections"] += 1
+        if connection.is_idle():
+            stats["idle"] += 1
+        else:
+            stats["active"] += 1
+        if ", HTTP/2, " in connection.info():
+            stats["http2"] += 1
+    return stats
+
+
+metrics.register_stats(
+    "trustlayer_upstream", "Upstream connection pool", pool_stats,
+    gauges=("connections", "idle", "active", "http2"), counters=("requests_sent",),
+)
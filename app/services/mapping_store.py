@@ -0,0 +1,106 @@
+import asyncio
+import logging
+from typing import Optional
+
+from app.core import json_codec, metrics
+from app.core.cache import LRUCache
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Per-entry bookkeeping on top of the payload (key, tuple, OrderedDict slot)
+ENTRY_OVERHEAD = 200
+
+
+class MappingStore:
+    """
+    Holds the token -> original value mapping of every in-flight proxied flow until its response
+    has been restored. Entries expire after `ttl` seconds and the store is capped in entries and
+    bytes, so aborted flows (no response, no stream end) can't accumulate PII in memory.
+    Mappings are kept as compact JSON, optionally Fernet-encrypted.
+    """
+
+    def __init__(
+        self,
+        ttl: float,
+        max_entries: int,
+        max_bytes: int,
+        sweep_interval: float,
+        encrypt: bool = False,
+        key: str = "",
+    ):
+        self._cache = LRUCache(
+            max_bytes=max_bytes,
+            ttl=ttl,
+            sizeof=lambda flow_id, blob: len(flow_id) + len(blob) + ENTRY_OVERHEAD,
+            max_entries=max_entries,
+        )
+        self.sweep_interval = sweep_interval
+        self._sweeper = None
+        self.swept = 0
+
+        self._fernet = None
+        if encrypt:
+            # cryptography ships with mitmproxy
+            from cryptography.fernet import Fernet
+            # Ephemeral key by default: mappings never outlive the process anyway
+            self._fernet = Fernet(key.encode() if key else Fernet.generate_key())
+
+    def put(self, flow_id: str, mapping: dict):
+        blob = json_codec.dumps(mapping)
+        if self._fernet is not None:
+            blob = self._fernet.encrypt(blob)
+        self._cache.put(flow_id, blob)
+
+    def pop(self, flow_id: str) -> Optional[dict]:
+        blob = self._cache.pop(flow_id)
+        if blob is None:
+            return None
+        if self._fernet is not None:
+            blob = self._fernet.decrypt(blob)
+        return json_codec.loads(blob)
+
+    def discard(self, flow_id: str):
+        self._cache.pop(flow_id)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def start(self):
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop())
+
+    def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                expired = self._cache.sweep()
+                self.swept += expired
+                if expired:
+                    logger.info(f"Mapping store: dropped {expired} expired mapping(s), {self.stats()}")
+            except Exception as e:
+                logger.error(f"Mapping store sweep failed: {e}")
+
+    def stats(self) -> dict:
+        stats = self._cache.stats()
+        del stats["hits"], stats["misses"]
+        return {**stats, "swept": self.swept, "encrypted": self._fernet is not None}
+
+
+mapping_store = MappingStore(
+    ttl=settings.MAPPING_TTL_SECONDS,
+    max_entries=settings.MAPPING_MAX_ENTRIES,
+    max_bytes=settings.MAPPING_MAX_BYTES,
+    sweep_interval=settings.MAPPING_SWEEP_INTERVAL_SECONDS,
+    encrypt=settings.MAPPING_ENCRYPTION,
+    key=settings.MAPPING_ENCRYPTION_KEY,
+)
+metrics.register_stats(
+    "trustlayer_mapping_store", "Proxy mapping store", mapping_store.stats,
+    gauges=("entries", "bytes"), counters=("evictions", "expirations", "swept"),
+)
@@ -0,0 +1,76 @@
+import re
+from collections import namedtuple
+from typing import Optional
+
+# Which JSON fields of a provider's request body hold user content. Paths use the routing
+# table syntax: "." between keys, "*" = any key or list index, "**" = any number of levels.
+# A path names string leaves: ids, model names, timezones, ... are never analyzed or rewritten.
+# `conversation` lists body fields holding a conversation id, `conversation_url` is a regex whose
+# first group takes it from the request path. Turns of one conversation share their tokens.
+ProviderAdapter = namedtuple("ProviderAdapter", ["name", "inspect", "conversation", "conversation_url"], defaults=((), None))
+
+PROVIDERS = {
+    # chatgpt.com web app: POST /backend-api/conversation
+    "chatgpt": ProviderAdapter("chatgpt", [
+        "messages.*.content.parts.*",
+        "messages.*.content.text",
+    ], conversation=["conversation_id"]),
+    # OpenAI API: chat completions (string or content parts), responses, legacy completions
+    "openai": ProviderAdapter("openai", [
+        "messages.*.content",
+        "messages.*.content.*.text",
+        "input",
+        "input.*.content",
+        "input.*.content.*.text",
+        "instructions",
+        "prompt",
+    ], conversation=["conversation", "conversation.id"]),
+    # claude.ai web app (completion endpoint) and the Anthropic Messages API
+    "claude": ProviderAdapter("claude", [
+        "prompt",
+        "attachments.*.extracted_content",
+        "messages.*.content",
+        "messages.*.content.*.text",
+        "system",
+        "system.*.text",
+    ], conversation_url=r"/chat_conversations/([0-9a-fA-F-]+)/"),
+    # Gemini API (generateContent). The gemini.google.com web app posts form-encoded
+    # batches, not JSON, and is left alone by the proxy.
+    "gemini": ProviderAdapter("gemini", [
+        "contents.*.parts.*.text",
+        "systemInstruction.parts.*.text",
+        "system_instruction.parts.*.text",
+    ]),
+}
+
+# Unknown providers: fields that commonly carry prompts, at any depth
+GENERIC = ProviderAdapter("generic", [
+    "**.prompt",
+    "**.query",
+    "**.input",
+    "**.message",
+    "**.text",
+    "**.content",
+    "**.parts.*",
+])
+
+
+def adapter_for(provider: str) -> ProviderAdapter:
+    return PROVIDERS.get(provider, GENERIC)
+
+
+def conversation_id(adapter: ProviderAdapter, data, path: str) -> Optional[str]:
+    """
+    Conversation id of a request body, or None (e.g. the first turn of a new ChatGPT conversation).
+    """
+    if adapter.conversation_url:
+        match = re.search(adapter.conversation_url, path)
+        if match:
+            return match.group(1)
+    for field in adapter.conversation:
+        value = data
+        for key in field.split("."):
+            value = value.get(key) if isinstance(value, dict) else None
+        if isinstance(value, str) and value:
+            return value
+    return None
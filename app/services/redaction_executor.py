@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from app.core import metrics, startup
+from app.core.config import settings
+from app.modules import redaction
+from app.modules.redaction import PseudonymMap, RedactionResult
+
+logger = logging.getLogger(__name__)
+
+
+_warm_barrier = None
+
+
+def _init_worker(barrier):
+    # Runs once in every worker process: builds the Presidio/spaCy engines and
+    # allocates the pipeline before real traffic arrives.
+    global _warm_barrier
+    _warm_barrier = barrier
+    redaction.warm_up()
+
+
+def _ping():
+    # Only returns once every worker holds a ping, i.e. all of them finished _init_worker
+    _warm_barrier.wait()
+    return True
+
+
+class RedactionOverloaded(Exception):
+    """
+    Raised instead of queueing when too many batches already wait for a worker.
+    """
+
+
+class RedactionExecutor:
+    """
+    Runs NER in a pool of worker processes so the proxy/API event loops never block on spaCy.
+    Cache lookups and token numbering stay in the calling process, only misses are shipped out.
+    """
+
+    def __init__(self, workers: int, max_pending: int, max_waiting: int = 0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_waiting = max_waiting
+        self._pool = None
+        self._started_at = None
+        self._warming = [] # Ping futures, done once every worker ran its initializer
+        # Backpressure: at most `max_pending` batches queued for the workers
+        self._slots = asyncio.Semaphore(max_pending)
+        self.pending = 0
+        self.rejected = 0
+
+    @property
+    def waiting(self) -> int:
+        # Batches queued behind the `max_pending` ones that hold a slot
+        return max(0, self.pending - self.max_pending)
+
+    def start(self):
+        if self._pool is not None or self.workers <= 0:
+            return
+
+        # spawn: never fork a process that already runs an event loop / mitmproxy
+        context = multiprocessing.get_context("spawn")
+        self._pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(context.Barrier(self.workers),),
+        )
+        # Start (and warm up) the workers now instead of on the first request
+        self._started_at = time.perf_counter()
+        self._warming = [self._pool.submit(_ping) for _ in range(self.workers)]
+        logger.info(f"Redaction executor started with {self.workers} worker processes")
+
+    async def warm_up(self):
+        """
+        Returns once the engines are loaded and exercised where NER will actually run:
+        in every worker process, or in this process when workers are disabled.
+        """
+        startup.mark("redaction", "pending")
+        try:
+            if self.workers <= 0:
+                await asyncio.to_thread(redaction.warm_up)
+            else:
+                self.start()
+                await asyncio.gather(*(asyncio.wrap_future(future) for future in self._warming))
+                startup.set_timing("redaction_workers", time.perf_counter() - self._started_at)
+        except Exception as e:
+            startup.mark("redaction", "failed")
+            logger.error(f"Redaction warm-up failed: {e}")
+            raise
+        startup.mark("redaction", "ready")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+            logger.info("Redaction executor stopped")
+
+    async def _analyze(self, jobs: list[tuple[str, str]]) -> list[tuple]:
+        if self.workers <= 0:
+            return await asyncio.to_thread(redaction.analyze_uncached, jobs)
+
+        self.start()
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, redaction.analyze_uncached, jobs)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed): replace the pool and retry once
+            logger.error("Redaction worker pool broken, restarting it")
+            self._pool = None
+            self.start()
+            return await loop.run_in_executor(self._pool, redaction.analyze_uncached, jobs)
+
+    async def analyze_batch(self, texts: list[str]) -> list[tuple]:
+        spans, misses = redaction.plan_batch(texts)
+        if misses:
+            # Fail fast rather than let the queue (and every caller's latency) grow without bound
+            if self.max_waiting and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                raise RedactionOverloaded(f"{self.waiting} batches already waiting for a redaction worker")
+            self.pending += 1 # Queued + running batches
+            try:
+                # Queueing for a worker included: that is what the request waits for
+                with metrics.stage("analyze"):
+                    async with self._slots:
+                        results = await self._analyze(redaction.miss_jobs(texts, misses))
+            finally:
+                self.pending -= 1
+            redaction.fill_misses(spans, misses, results)
+        return spans
+
+    async def redact_batch(self, texts: list[str], pseudonyms: PseudonymMap = None) -> list[RedactionResult]:
+        spans = await self.analyze_batch(texts)
+        # Tokens are assigned here, in the calling process, after the await: no other request
+        # can interleave with the numbering of this batch
+        pseudonyms = pseudonyms or PseudonymMap()
+        return [redaction.build_result(text, text_spans, pseudonyms) for text, text_spans in zip(texts, spans)]
+
+    async def redact_sections(self, sections, pseudonyms: PseudonymMap = None) -> RedactionResult:
+        redactor = redaction.WindowedRedactor(pseudonyms=pseudonyms)
+        sections = iter(sections)
+        while True:
+            # Extraction blocks (file IO, Tika), pull the sections from a thread
+            section = await asyncio.to_thread(next, sections, None)
+            if section is None:
+                redactor.finish()
+            else:
+                redactor.add(section)
+            while (window := redactor.next_window()) is not None:
+                redactor.commit((await self.analyze_batch([window]))[0])
+            if section is None:
+                return redactor.result()
+
+
+executor = RedactionExecutor(
+    workers=settings.REDACTION_WORKERS,
+    max_pending=settings.REDACTION_MAX_PENDING,
+    max_waiting=settings.REDACTION_MAX_WAITING,
+)
+metrics.register_callback(
+    "trustlayer_redaction_pending_batches", "gauge", "Batches queued or running in the NER workers.",
+    lambda: executor.pending,
+)
+metrics.register_callback(
+    "trustlayer_redaction_waiting_batches", "gauge", "Batches waiting for a free NER worker slot.",
+    lambda: executor.waiting,
+)
+metrics.register_callback(
+    "trustlayer_redaction_rejected_batches_total", "counter", "Batches rejected because too many were waiting.",
+    lambda: executor.rejected,
+)
+
+
+def start_executor():
+    executor.start()
+
+
+def shutdown_executor():
+    executor.shutdown()
+
+
+async def warm_up_executor():
+    await executor.warm_up()
+
+
+async def redact_async(text: str, pseudonyms: PseudonymMap = None) -> RedactionResult:
+    """
+    Async redact_text(): NER runs in the worker pool, the event loop stays free.
+    """
+    return (await executor.redact_batch([text], pseudonyms))[0]
+
+
+async def redact_batch_async(texts: list[str], pseudonyms: PseudonymMap = None) -> list[RedactionResult]:
+    """
+    Async redact_batch(): results are returned in the same order as the input.
+    """
+    return await executor.redact_batch(texts, pseudonyms)
+
+
+async def redact_sections_async(sections, pseudonyms: PseudonymMap = None) -> RedactionResult:
+    """
+    Async redact_sections(): redacts a document window by window, sections are pulled lazily.
+    """
+    return await executor.redact_sections(sections, pseudonyms)
@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from typing import Optional
+
+from app.core.config import settings
+from app.services.providers import adapter_for
+
+logger = logging.getLogger(__name__)
+
+# Built-in table, used when no routes file exists. Same shape as the JSON file:
+#   hosts: "example.com" matches that host only, "*.example.com" any subdomain (not the apex)
+#   methods: request methods worth inspecting (anything else passes through)
+#   paths: regexes, the path has to match one of them (all paths when absent)
+#   ignore_paths: substrings of paths that are never inspected (telemetry, assets, ...)
+#   provider: schema adapter (app/services/providers.py) that knows where the user content is
+#   inspect: JSON paths of the string leaves to redact, overrides the provider's, e.g.
+#            "messages.*.content" ("*" = any key or list index, "**" = any depth, "**" alone = everything)
+DEFAULT_ROUTES = {
+    "ignore_paths": [
+        "statsc", "rgstr", "noise", "g/collect", "cdn/assets",
+        "/ces/", "analytics", "metrics", "events", "timings",
+        "generate_autocompletions", "f/conversation/prepare",
+    ],
+    "routes": [
+        {"name": "chatgpt", "hosts": ["chatgpt.com", "*.chatgpt.com", "chat.openai.com"], "provider": "chatgpt"},
+        {"name": "openai", "hosts": ["openai.com", "*.openai.com"], "provider": "openai"},
+        {"name": "gemini", "hosts": ["gemini.google.com", "generativelanguage.googleapis.com"], "provider": "gemini"},
+        {"name": "claude", "hosts": ["claude.ai", "*.claude.ai", "api.anthropic.com"], "provider": "claude"},
+    ],
+}
+
+DEFAULT_METHODS = ("POST", "PUT")
+
+# Marks the end of a JSON path in the inspect trie
+_END = object()
+
+
+class JsonPaths:
+    """
+    Compiled set of JSON paths. Traversal carries a state (tuple of trie nodes, empty = nothing below
+    is inspected) that is advanced with step() for every key / list index on the way down.
+    """
+
+    def __init__(self, patterns: list[str]):
+        self.root = {}
+        for pattern in patterns:
+            node = self.root
+            for segment in pattern.split("."):
+                node = node.setdefault(segment, {})
+            node[_END] = True
+
+    @staticmethod
+    def _expand(nodes) -> tuple:
+        # "**" also matches zero levels: its continuation is reachable without consuming a key
+        state = {}
+        for node in nodes:
+            while node is not None and id(node) not in state:
+                state[id(node)] = node
+                node = node.get("**")
+        return tuple(state.values())
+
+    def start(self) -> tuple:
+        return self._expand([self.root])
+
+    def step(self, state: tuple, key) -> tuple:
+        key = str(key)
+        matches = []
+        for node in state:
+            for segment in (key, "*"):
+                child = node.get(segment)
+                if child is not None:
+                    matches.append(child)
+            if "**" in node:
+                matches.append(node) # "**" consumes this key and may consume more
+        return self._expand(matches) if matches else ()
+
+    @staticmethod
+    def matches(state: tuple) -> bool:
+        return any(_END in node for node in state)
+
+
+class Route:
+    __slots__ = ("name", "provider", "methods", "paths", "ignore", "inspect")
+
+    def __init__(self, name: str, provider, methods, paths, ignore, inspect):
+        self.name = name
+        self.provider = provider # ProviderAdapter
+        self.methods = methods # frozenset
+        self.paths = paths # Compiled regex or None
+        self.ignore = ignore # Compiled regex or None
+        self.inspect = inspect # JsonPaths
+
+
+def _alternation(patterns, escape: bool):
+    if not patterns:
+        return None
+    return re.compile("|".join(re.escape(pattern) if escape else f"(?:{pattern})" for pattern in patterns))
+
+
+class RoutingTable:
+    """
+    Decides which flows the proxy inspects. Host lookups are dict hits (exact host, then each
+    parent domain for wildcard entries) so flows to other hosts cost a few hash lookups.
+    """
+
+    def __init__(self, config: dict):
+        global_ignore = config.get("ignore_paths", [])
+        self.exact = {} # {host: Route}
+        self.wildcard = {} # {parent_domain: Route}
+
+        for entry in config.get("routes", []):
+            adapter = adapter_for(entry.get("provider"))
+            route = Route(
+                name=entry.get("name", entry["hosts"][0]),
+                provider=adapter,
+                methods=frozenset(method.upper() for method in entry.get("methods", DEFAULT_METHODS)),
+                paths=_alternation(entry.get("paths"), escape=False),
+                ignore=_alternation(global_ignore + entry.get("ignore_paths", []), escape=True),
+                inspect=JsonPaths(entry.get("inspect") or adapter.inspect),
+            )
+            for host in entry["hosts"]:
+                host = host.lower().rstrip(".")
+                if host.startswith("*."):
+                    self.wildcard[host[2:]] = route
+                else:
+                    self.exact[host] = route
+
+    def route_for_host(self, host: str) -> Optional[Route]:
+        host = host.lower().rstrip(".")
+        route = self.exact.get(host)
+        if route is not None or not self.wildcard:
+            return route
+        # a.b.example.com -> b.example.com -> example.com -> com
+        dot = host.find(".")
+        while dot != -1:
+            host = host[dot + 1:]
+            route = self.wildcard.get(host)
+            if route is not None:
+                return route
+            dot = host.find(".")
+        return None
+
+    def match(self, host: str, method: str, path: str) -> Optional[Route]:
+        route = self.route_for_host(host)
+        if route is None or method not in route.methods:
+            return None
+        if route.paths is not None and not route.paths.search(path):
+            return None
+        if route.ignore is not None and route.ignore.search(path):
+            return None
+        return route
+
+
+class Router:
+    """
+    Routing table backed by a JSON file (settings.PROXY_ROUTES_FILE), reloaded when the file changes.
+    The file is stat()ed at most every `reload_interval` seconds; a broken file keeps the last good table.
+    """
+
+    def __init__(self, path: str, reload_interval: float):
+        self.path = path
+        self.reload_interval = reload_interval
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._checked_at = 0.0
+        self.table = RoutingTable(DEFAULT_ROUTES)
+        self.source = "defaults"
+        self.reload()
+
+    def reload(self) -> bool:
+        """
+        Loads the routes file if it changed since the last load. Returns True if the table was replaced.
+        """
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except (FileNotFoundError, TypeError):
+                mtime = None
+
+            if mtime == self._mtime:
+                return False
+            self._mtime = mtime
+
+            if mtime is None:
+                self.table, self.source = RoutingTable(DEFAULT_ROUTES), "defaults"
+                logger.info("Proxy routes: no routes file, using built-in defaults")
+                return True
+
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    table = RoutingTable(json.load(f))
+            except (OSError, ValueError, KeyError, TypeError, re.error) as e:
+                logger.error(f"Proxy routes: could not load {self.path}, keeping the current table: {e}")
+                return False
+
+            self.table, self.source = table, self.path
+            logger.info(f"Proxy routes loaded from {self.path}")
+            return True
+
+    def match(self, host: str, method: str, path: str) -> Optional[Route]:
+        if time.monotonic() - self._checked_at >= self.reload_interval:
+            self.reload()
+        return self.table.match(host, method, path)
+
+
+router = Router(settings.PROXY_ROUTES_FILE, settings.PROXY_ROUTES_RELOAD_SECONDS)
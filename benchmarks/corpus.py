@@ -0,0 +1,161 @@
+"""
+Synthetic, seeded corpus for the benchmarks: prompts with a controlled PII density, provider
+request bodies of a given conversation depth, streamed answers and documents.
+The same seed always gives the same corpus, so runs on different machines/commits compare.
+"""
+import json
+import os
+import random
+import zipfile
+from html import escape
+
+FIRST_NAMES = [
+    "John", "Alice", "Maria", "David", "Priya", "Chen", "Fatima", "Lucas", "Emma", "Omar",
+    "Sofia", "James", "Aisha", "Noah", "Elena", "Kenji", "Olivia", "Mateo", "Hannah", "Ravi",
+]
+LAST_NAMES = [
+    "Doe", "Smith", "Garcia", "Johnson", "Patel", "Wang", "Khan", "Martin", "Brown", "Haddad",
+    "Rossi", "Wilson", "Okafor", "Miller", "Petrova", "Tanaka", "Davis", "Lopez", "Schmidt", "Sharma",
+]
+DOMAINS = ["example.com", "mail.example.org", "corp.example.net"]
+
+FILLER = [
+    "Can you summarize the main points of the quarterly report",
+    "Please rewrite this paragraph so it sounds more formal",
+    "The meeting was moved to next week because of the holidays",
+    "We need a short plan for migrating the billing service",
+    "Explain the difference between a process and a thread",
+    "The customer asked for a refund after the second delivery failed",
+    "Draft a polite reply that declines the invitation",
+    "List three risks of the new onboarding flow and how to mitigate them",
+    "Our team reviewed the contract and found two unclear clauses",
+    "Translate the following note into plain English for the board",
+]
+
+# Templates that carry exactly one entity, {} is replaced by the value
+PII_TEMPLATES = [
+    ("PERSON", "My colleague {} will join the call"),
+    ("PERSON", "Please send the draft to {} before Friday"),
+    ("EMAIL_ADDRESS", "You can reach me at {}"),
+    ("PHONE_NUMBER", "Call the office at {} after lunch"),
+    ("CREDIT_CARD", "The card on file is {}"),
+    ("IP_ADDRESS", "The server at {} stopped answering"),
+]
+
+# Test card numbers (valid checksums, never issued)
+CARDS = ["4111 1111 1111 1111", "5500 0000 0000 0004", "3400 0000 0000 009", "6011 0000 0000 0004"]
+
+
+class Corpus:
+    def __init__(self, seed: int = 42):
+        self.rng = random.Random(seed)
+
+    def _person(self) -> str:
+        return f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)}"
+
+    def _value(self, entity_type: str) -> str:
+        rng = self.rng
+        if entity_type == "PERSON":
+            return self._person()
+        if entity_type == "EMAIL_ADDRESS":
+            return f"{rng.choice(FIRST_NAMES).lower()}.{rng.choice(LAST_NAMES).lower()}{rng.randint(1, 99)}@{rng.choice(DOMAINS)}"
+        if entity_type == "PHONE_NUMBER":
+            return f"(212) 555-{rng.randint(1000, 9999)}"
+        if entity_type == "CREDIT_CARD":
+            return rng.choice(CARDS)
+        return f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+    def sentence(self, pii_density: float) -> str:
+        # pii_density: probability that a sentence carries one entity
+        if self.rng.random() < pii_density:
+            entity_type, template = self.rng.choice(PII_TEMPLATES)
+            return template.format(self._value(entity_type)) + "."
+        return self.rng.choice(FILLER) + "."
+
+    def text(self, length: int, pii_density: float) -> str:
+        """
+        About `length` characters of prose (whole sentences, at least one).
+        """
+        sentences = [self.sentence(pii_density)]
+        size = len(sentences[0])
+        while size < length:
+            sentence = self.sentence(pii_density)
+            sentences.append(sentence)
+            size += len(sentence) + 1
+        return " ".join(sentences)
+
+    def chatgpt_body(self, depth: int, length: int, pii_density: float, conversation_id: str = None) -> dict:
+        """
+        ChatGPT web request body with `depth` messages (resent history + the new message).
+        """
+        body = {
+            "action": "next",
+            "messages": [
+                {
+                    "id": f"msg-{i}",
+                    "author": {"role": "user"},
+                    "content": {"content_type": "text", "parts": [self.text(length, pii_density)]},
+                    "metadata": {},
+                }
+                for i in range(depth)
+            ],
+            "model": "gpt-4o",
+            "timezone": "Europe/Paris",
+            "history_and_training_disabled": False,
+        }
+        if conversation_id:
+            body["conversation_id"] = conversation_id
+        return body
+
+    def answer(self, length: int, tokens: list[str]) -> str:
+        """
+        LLM answer of about `length` characters that mentions the placeholders.
+        """
+        words = self.text(length, 0.0).split(" ")
+        for token in tokens:
+            words.insert(self.rng.randrange(len(words) + 1), token)
+        return " ".join(words)
+
+    def sse_stream(self, answer: str, chunk_size: int) -> list[bytes]:
+        """
+        The answer as a ChatGPT-style event stream (growing message, a few words per event),
+        cut into network chunks of `chunk_size` bytes regardless of event/character boundaries.
+        """
+        words = answer.split(" ")
+        events = []
+        for end in range(8, len(words) + 8, 8):
+            part = " ".join(words[:end])
+            events.append(b"data: " + json.dumps({"message": {"content": {"parts": [part]}}}).encode() + b"\n\n")
+        events.append(b"data: [DONE]\n\n")
+        stream = b"".join(events)
+        return [stream[i:i + chunk_size] for i in range(0, len(stream), chunk_size)]
+
+    def document(self, directory: str, kind: str, size: int, pii_density: float) -> str:
+        """
+        Writes a document of about `size` characters of text. kind: "txt", "html" or "docx".
+        """
+        paragraphs = []
+        total = 0
+        while total < size:
+            paragraph = self.text(600, pii_density)
+            paragraphs.append(paragraph)
+            total += len(paragraph)
+
+        path = os.path.join(directory, f"bench-{size}.{kind}")
+        if kind == "txt":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n\n".join(paragraphs))
+        elif kind == "html":
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("<!DOCTYPE html><html><head><title>Report</title></head><body>")
+                f.writelines(f"<p>{escape(paragraph)}</p>" for paragraph in paragraphs)
+                f.write("</body></html>")
+        elif kind == "docx":
+            namespace = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+            body = "".join(f"<w:p><w:r><w:t>{escape(paragraph)}</w:t></w:r></w:p>" for paragraph in paragraphs)
+            with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr("[Content_Types].xml", '<?xml version="1.0"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"/>')
+                archive.writestr("word/document.xml", f'<?xml version="1.0"?><w:document xmlns:w="{namespace}"><w:body>{body}</w:body></w:document>')
+        else:
+            raise ValueError(f"Unknown document kind '{kind}'")
+        return path
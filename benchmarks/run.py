@@ -0,0 +1,341 @@
+"""
+Benchmarks of the hot paths: redaction, restore, the proxy's request rewrite and stream restore,
+and document extraction. Reports throughput, p50/p99 latency and peak RSS per case.
+
+    python -m benchmarks.run                          # full matrix
+    python -m benchmarks.run --quick                  # small matrix (a minute or two)
+    python -m benchmarks.run --case proxy_request     # one case only
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --compare benchmarks/baseline.json   # exit code 1 on regression
+
+Baselines are machine-specific: record one on the machine you compare on.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+# NER runs in this process (latency and RSS include it), audit records go to a scratch database
+SCRATCH_DIR = tempfile.mkdtemp(prefix="trustlayer-bench-")
+os.environ.setdefault("REDACTION_WORKERS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{SCRATCH_DIR}/bench.db")
+
+from app.core.config import settings
+from app.modules import redaction
+from app.modules.document import extract_text
+from benchmarks.corpus import Corpus
+
+CASES = {} # {name: function(corpus, quick, iterations) -> list of results}
+
+
+def case(name: str):
+    def decorator(function):
+        CASES[name] = function
+        return function
+    return decorator
+
+
+def peak_rss_mb():
+    # High-water mark of this process so far (not per case: run one case with --case for that)
+    try:
+        import resource
+    except ImportError: # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def percentile(sorted_values: list, q: float) -> float:
+    # Nearest rank
+    index = max(0, min(len(sorted_values) - 1, round(q * len(sorted_values) + 0.5) - 1))
+    return sorted_values[index]
+
+
+def measure(name: str, params: dict, inputs: list, run, size, unit: str, warmup: int = 2) -> dict:
+    """
+    Times run(input) for every input but the first `warmup` ones, which are run untimed.
+    size(input) is the amount of work in `unit`, for the throughput.
+    """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for item in inputs[:warmup]:
+            run(item)
+        latencies = []
+        work = 0
+        for item in inputs[warmup:]:
+            started = time.perf_counter()
+            run(item)
+            latencies.append(time.perf_counter() - started)
+            work += size(item)
+
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "case": name,
+        "params": params,
+        "iterations": len(latencies),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "mean_ms": round(total / len(latencies) * 1000, 3),
+        "throughput": round(work / total, 1) if total else 0.0,
+        "unit": f"{unit}/s",
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+# --- Cases ---
+
+@case("redact_text")
+def bench_redact_text(corpus: Corpus, quick: bool, iterations: int):
+    lengths = [200, 2000] if quick else [200, 2000, 20000]
+    densities = [0.2] if quick else [0.0, 0.2, 0.5]
+    results = []
+    for length in lengths:
+        for density in densities:
+            texts = [corpus.text(length, density) for _ in range(iterations + 2)]
+
+            def run(text):
+                redaction.span_cache.clear() # Cold: measure the analysis, not the cache
+                redaction.redact_text(text)
+
+            results.append(measure("redact_text", {"length": length, "pii_density": density, "cache": "cold"}, texts, run, len, "chars"))
+
+    # Same texts again: the span cache path (resent history, retries)
+    texts = [corpus.text(2000, 0.2) for _ in range(iterations)]
+    for text in texts:
+        redaction.redact_text(text)
+    results.append(measure("redact_text", {"length": 2000, "pii_density": 0.2, "cache": "warm"}, texts, redaction.redact_text, len, "chars", warmup=0))
+    return results
+
+
+@case("deanonymize_text")
+def bench_deanonymize_text(corpus: Corpus, quick: bool, iterations: int):
+    results = []
+    for token_count in ([20] if quick else [5, 20, 100]):
+        mapping = {f"[PERSON_{i}]": corpus._person() for i in range(1, token_count + 1)}
+        answers = [corpus.answer(4000, list(mapping)) for _ in range(iterations + 2)]
+        results.append(measure(
+            "deanonymize_text", {"length": 4000, "tokens": token_count}, answers,
+            lambda answer: redaction.deanonymize_text(answer, mapping), len, "chars",
+        ))
+    return results
+
+
+def _load_proxy():
+    try:
+        from mitmproxy.test import tflow
+    except ImportError:
+        print("  mitmproxy is not installed, skipping")
+        return None, None
+    import proxy_addon
+    return proxy_addon.addons[0], tflow
+
+
+@case("proxy_request")
+def bench_proxy_request(corpus: Corpus, quick: bool, iterations: int):
+    addon, tflow = _load_proxy()
+    if addon is None:
+        return []
+
+    from app.core.database import init_db
+    from app.modules.audit import audit_writer
+
+    async def start():
+        # Audit records are queued and written in bulk, as in the running proxy
+        await init_db()
+        audit_writer.start()
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(start())
+
+    def make_flow(body: dict):
+        # (flow, body size): the body is rewritten by the request hook
+        flow = tflow.tflow()
+        flow.request.host = "chatgpt.com"
+        flow.request.path = "/backend-api/conversation"
+        flow.request.method = "POST"
+        flow.request.content = json.dumps(body).encode()
+        return flow, len(flow.request.content)
+
+    def run(item):
+        flow, _ = item
+        loop.run_until_complete(addon.request(flow))
+        addon.mappings.discard(flow.id)
+
+    def run_cold(item):
+        redaction.span_cache.clear()
+        run(item)
+
+    def size(item):
+        return item[1]
+
+    results = []
+    try:
+        for depth in ([1, 10] if quick else [1, 10, 50]):
+            # New conversation: every message is analyzed
+            flows = [make_flow(corpus.chatgpt_body(depth, 300, 0.2)) for _ in range(iterations + 2)]
+            results.append(measure("proxy_request", {"depth": depth, "turn": "first"}, flows, run_cold, size, "bytes"))
+
+            # Next turn of a known conversation: the resent history is reused, only the new message is analyzed
+            flows = []
+            with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+                for i in range(iterations + 2):
+                    body = corpus.chatgpt_body(depth, 300, 0.2, conversation_id=f"bench-{depth}-{i}")
+                    if depth > 1:
+                        run(make_flow(dict(body, messages=body["messages"][:-1])))
+                    flows.append(make_flow(body))
+            results.append(measure("proxy_request", {"depth": depth, "turn": "followup"}, flows, run_cold, size, "bytes"))
+    finally:
+        loop.run_until_complete(audit_writer.stop())
+        loop.close()
+    return results
+
+
+@case("stream_restore")
+def bench_stream_restore(corpus: Corpus, quick: bool, iterations: int):
+    addon, _ = _load_proxy()
+    if addon is None:
+        return []
+
+    mapping = {f"[PERSON_{i}]": corpus._person() for i in range(1, 21)}
+    results = []
+    for chunk_size in ([256] if quick else [16, 256, 4096]):
+        streams = [corpus.sse_stream(corpus.answer(8000, list(mapping)), chunk_size) for _ in range(iterations + 2)]
+
+        def run(chunks):
+            modifier = addon.make_stream_modifier(mapping)
+            for chunk in chunks:
+                modifier(chunk)
+            modifier(b"")
+
+        results.append(measure(
+            "stream_restore", {"answer_chars": 8000, "chunk_bytes": chunk_size}, streams, run,
+            lambda chunks: sum(len(chunk) for chunk in chunks), "bytes",
+        ))
+    return results
+
+
+@case("extract_text")
+def bench_extract_text(corpus: Corpus, quick: bool, iterations: int):
+    results = []
+    for kind in ("txt", "html", "docx"):
+        for size in ([100_000] if quick else [100_000, 1_000_000]):
+            path = corpus.document(SCRATCH_DIR, kind, size, 0.2)
+            results.append(measure(
+                "extract_text", {"format": kind, "chars": size}, [path] * (max(3, iterations // 4) + 1),
+                lambda file_path: extract_text(file_path=file_path), os.path.getsize, "bytes", warmup=1,
+            ))
+            os.unlink(path)
+    return results
+
+
+# --- Report / Baseline ---
+
+def _key(result: dict) -> str:
+    return result["case"] + " " + json.dumps(result["params"], sort_keys=True)
+
+
+def _environment() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ""
+    return {
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "detection_mode": settings.REDACTION_DETECTION_MODE,
+    }
+
+
+def print_results(results: list):
+    print(f"{'case':<18} {'params':<48} {'p50 ms':>10} {'p99 ms':>10} {'throughput':>22} {'peak MB':>8}")
+    for result in results:
+        params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+        throughput = f"{result['throughput']:,.0f} {result['unit']}"
+        print(f"{result['case']:<18} {params:<48} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f} {throughput:>22} {result['peak_rss_mb'] or '-':>8}")
+
+
+def compare(results: list, baseline: dict, tolerance: float) -> int:
+    """
+    Prints the change against the baseline, returns the number of regressions:
+    p50 slower or throughput lower than the baseline by more than `tolerance`.
+    p99 is shown but not gated, it is too noisy on shared machines.
+    """
+    if baseline["environment"].get("platform") != platform.platform():
+        print(f"\nWARNING: baseline recorded on {baseline['environment'].get('platform')}, numbers may not compare")
+
+    previous = {_key(result): result for result in baseline["results"]}
+    regressions = 0
+    print(f"\n{'case':<18} {'params':<48} {'p50':>9} {'p99':>9} {'throughput':>11}")
+    for result in results:
+        base = previous.get(_key(result))
+        if base is None:
+            continue
+        p50 = result["p50_ms"] / base["p50_ms"] - 1 if base["p50_ms"] else 0.0
+        p99 = result["p99_ms"] / base["p99_ms"] - 1 if base["p99_ms"] else 0.0
+        throughput = result["throughput"] / base["throughput"] - 1 if base["throughput"] else 0.0
+        regressed = p50 > tolerance or throughput < -tolerance
+        regressions += regressed
+        params = ", ".join(f"{k}={v}" for k, v in result["params"].items())
+        print(f"{result['case']:<18} {params:<48} {p50:>+9.1%} {p99:>+9.1%} {throughput:>+11.1%}{'  REGRESSION' if regressed else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="TrustLayer hot path benchmarks")
+    parser.add_argument("--case", action="append", choices=sorted(CASES), help="Run only this case (repeatable)")
+    parser.add_argument("--quick", action="store_true", help="Smaller parameter matrix")
+    parser.add_argument("--iterations", type=int, default=None, help="Timed runs per parameter set (default 20, 8 with --quick)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", metavar="PATH", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Store the results as the baseline to compare against")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a stored baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed slowdown before a case counts as a regression (0.15 = 15%%)")
+    args = parser.parse_args()
+
+    iterations = args.iterations or (8 if args.quick else 20)
+    logging.getLogger("presidio-analyzer").setLevel(logging.ERROR)
+
+    # Engines are loaded up front so the first case doesn't pay for spaCy
+    started = time.perf_counter()
+    redaction.warm_up()
+    print(f"Engines loaded in {time.perf_counter() - started:.1f}s, peak RSS {peak_rss_mb()} MB")
+
+    results = []
+    for name in args.case or CASES:
+        print(f"Running {name} ...")
+        corpus = Corpus(args.seed) # Same inputs whichever cases run
+        results.extend(CASES[name](corpus, args.quick, iterations))
+
+    print()
+    print_results(results)
+
+    report = {"environment": _environment(), "results": results}
+    for path in (args.json, args.save_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"\nResults written to {path}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print(f"\n{regressions} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,6 @@
 import streamlit as st
 import asyncio
+from datetime import datetime, timedelta
 import pandas as pd
 import plotly.express as px
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
@@ -7,6 +8,7 @@ from sqlalchemy import text
 from app.core.config import settings
 from app.core.database import init_db, SessionLocal # Use shared session factory
 from app.modules.audit import AuditLog # CRITICAL: Import model so Base knows to create the table
+from app.modules.audit import granularities_for, get_rollup_stats, get_rollup_buckets, get_recent_logs
 
 # Remove local engine definition to avoid locks
 # engine = create_async_engine(settings.DATABASE_URL)
@@ -16,11 +18,30 @@ st.set_page_config(page_title="TrustLayer AI Dashboard", layout="wide")
 
 st.title("🛡️ TrustLayer AI - Governance Dashboard")
 
+# Time Range (read from the pre-aggregated rollups, load time does not depend on history size)
+RANGES = {
+    "Last hour": timedelta(hours=1),
+    "Last 24 hours": timedelta(days=1),
+    "Last 7 days": timedelta(days=7),
+    "Last 30 days": timedelta(days=30),
+    "All time": None,
+}
+# Only ranges some rollup is still retained for in full (e.g. no "All time" when every
+# granularity is compacted away eventually), each with the resolutions that cover it
+RESOLUTIONS = {label: granularities_for(span) for label, span in RANGES.items()}
+RANGES = {label: span for label, span in RANGES.items() if RESOLUTIONS[label]}
+st.sidebar.markdown("### Filters")
+range_label = st.sidebar.selectbox("Time Range", list(RANGES), index=min(1, len(RANGES) - 1))
+resolutions = RESOLUTIONS[range_label]
+bucket = st.sidebar.selectbox("Resolution", resolutions, index=min(1, len(resolutions) - 1))
+start = datetime.utcnow() - RANGES[range_label] if RANGES[range_label] else None
+
 async def load_data():
     async with SessionLocal() as session:
-        result = await session.execute(text("SELECT entity_type, count, timestamp FROM audit_logs"))
-        data = result.fetchall()
-        return data
+        stats = await get_rollup_stats(session, granularity=bucket, start=start)
+        buckets = await get_rollup_buckets(session, granularity=bucket, start=start)
+        recent = await get_recent_logs(session, limit=50)
+        return stats, buckets, recent
 
 from app.core.database import init_db
 from app.modules.audit import AuditLog # CRITICAL: Import model so Base knows to create the table
@@ -33,14 +54,12 @@ try:
     # Initialize DB (Create tables if they don't exist)
     loop.run_until_complete(init_db())
     
-    data = loop.run_until_complete(load_data())
+    stats, buckets, recent = loop.run_until_complete(load_data())
     
-    if data:
-        df = pd.DataFrame(data, columns=["Entity Type", "Count", "Timestamp"])
-        
+    if stats:
         # Metrics
-        total_redactions = df["Count"].sum()
-        unique_entities = df["Entity Type"].nunique()
+        total_redactions = sum(stats.values())
+        unique_entities = len(stats)
         
         col1, col2 = st.columns(2)
         col1.metric("Total PII Tokens Redacted", total_redactions)
@@ -48,12 +67,20 @@ try:
         
         # Charts
         st.subheader("Redaction Activity by Entity Type")
-        grouped = df.groupby("Entity Type")["Count"].sum().reset_index()
+        grouped = pd.DataFrame(list(stats.items()), columns=["Entity Type", "Count"])
         fig = px.bar(grouped, x="Entity Type", y="Count", color="Entity Type")
         st.plotly_chart(fig, use_container_width=True)
+
+        st.subheader(f"Redactions per {bucket.capitalize()}")
+        timeline = pd.DataFrame(buckets, columns=["Time", "Entity Type", "Count"])
+        fig = px.bar(timeline, x="Time", y="Count", color="Entity Type")
+        st.plotly_chart(fig, use_container_width=True)
         
         st.subheader("Recent Logs")
-        st.dataframe(df.sort_values("Timestamp", ascending=False).head(50))
+        st.dataframe(pd.DataFrame(
+            [(log.entity_type, log.count, log.timestamp) for log in recent],
+            columns=["Entity Type", "Count", "Timestamp"],
+        ))
         
     else:
         st.info("No audit logs found yet. Send some requests!")
@@ -1,7 +1,7 @@
-import json
 import logging
 import sys
 import os
+import time
 
 # Fix: Ensure 'app' module can be imported regardless of how mitmweb is launched
 cwd = os.getcwd()
@@ -9,185 +9,221 @@ if cwd not in sys.path:
     sys.path.append(cwd)
 
 from mitmproxy import http
-from app.modules.redaction import redact_text, deanonymize_text
+from app.modules.redaction import StreamRestorer
+from app.core import json_codec, log, metrics, startup
+from app.core.config import settings
+from app.services.conversation_store import conversation_store
+from app.services.mapping_store import mapping_store
+from app.services.providers import conversation_id
+from app.services.routing import router
+from app.services.redaction_executor import (
+    RedactionOverloaded, start_executor, shutdown_executor, warm_up_executor,
+)
 
-# Configure simple logging
-logging.basicConfig(level=logging.INFO)
+# Structured, queued logging: flows never wait on the console (see app/core/log.py)
+log.setup_logging()
 logger = logging.getLogger("TrustLayerProxy")
 
 import asyncio
-from app.modules.audit import create_audit_log
+from app.modules.audit import create_audit_log, audit_writer, enqueue_audit_log
 from app.core.database import get_db, init_db, SessionLocal
 import uuid
 
 class TrustLayerAddon:
     def __init__(self):
-        self.mappings = {} # {flow_id: mapping_dict}
-        logger.info("[INFO] TrustLayer DLP Proxy Active")
+        # {flow_id: mapping}, expires and is size-capped so aborted flows can't leak PII in memory
+        self.mappings = mapping_store
+        self.metrics_server = None
+        logger.info("TrustLayer DLP Proxy Active")
         # Silence Presidio noise
         logging.getLogger("presidio-analyzer").setLevel(logging.ERROR)
-        print("[DIAGNOSTIC] LOADED PROXY VERSION 2.0 (FORCE UPDATE)")
         
     def load(self, loader):
         # We need to initialize the DB. 
         # Since load is sync, we schedule it.
         asyncio.create_task(self._init_db_safe())
+        # Audit records are written in bulk by a background task
+        audit_writer.start()
+        # Drops mappings of flows that never got a response
+        self.mappings.start()
+        conversation_store.start()
+        # NER runs in worker processes so flows never block the proxy event loop
+        start_executor()
+        # mitmproxy has no web app of its own: /metrics is served from a small thread server
+        try:
+            self.metrics_server = metrics.start_http_server(settings.PROXY_METRICS_HOST, settings.PROXY_METRICS_PORT)
+            if self.metrics_server:
+                logger.info(f"Metrics on http://{settings.PROXY_METRICS_HOST}:{settings.PROXY_METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.error(f"Metrics endpoint not started: {e}")
+        if settings.WARMUP_ON_STARTUP:
+            asyncio.create_task(self._warm_up())
+
+    async def done(self):
+        if self.metrics_server:
+            self.metrics_server.shutdown()
+        self.mappings.stop()
+        conversation_store.stop()
+        shutdown_executor()
+        # Drain queued audit records before mitmproxy exits
+        await audit_writer.stop()
+
+    async def _warm_up(self):
+        try:
+            await warm_up_executor()
+            logger.info(f"Proxy warm-up done, startup timings: {startup.status()['timings']}")
+        except Exception as e:
+            logger.error(f"Proxy warm-up failed, engines will load on the first flow: {e}")
 
     async def _init_db_safe(self):
         try:
             await init_db()
-            print("[PROXY] DB Initialized")
             logger.info("DB Initialized for Proxy")
             
             # Create a "Startup" log event so we verify DB is writable
             async with SessionLocal() as db:
-                 print("[PROXY] Attempting to write startup log...")
                  await create_audit_log(db, "SYSTEM_STARTUP", 1, "INIT")
-                 print("[PROXY] Startup log written to DB")
                  logger.info("Startup log written to DB")
                  
         except Exception as e:
             if "already exists" in str(e):
-                print("✅ [PROXY] DB already initialized (Table exists)")
                 logger.info("DB already initialized")
             else:
-                 print(f"[ERROR] [PROXY] DB Init failed: {e}")
                  logger.error(f"DB Init failed: {e}")
 
     # Make request async to support DB calls
     async def request(self, flow: http.HTTPFlow):
-        # Restriction: Only inspect traffic to AI Chat providers
-        target_hosts = ["chat.openai.com", "chatgpt.com", "gemini.google.com", "claude.ai", "openai.com"]
-        if not any(host in flow.request.pretty_host for host in target_hosts):
-           return
-        
-        # Only check POST/PUT (Sending data)
-        if flow.request.method not in ["POST", "PUT"]:
+        # Restriction: Only inspect traffic to AI Chat providers (routes are hot-reloaded from config).
+        # Non-matching hosts, methods and noisy telemetry endpoints are skipped with a few dict/regex lookups.
+        route = router.match(flow.request.pretty_host, flow.request.method, flow.request.path)
+        if route is None:
             return
-            
-        # Ignore noisy telemetry endpoints (Refined)
-        ignore_keywords = [
-            "statsc", "rgstr", "noise", "g/collect", "cdn/assets", 
-            "/ces/", "analytics", "metrics", "events", "timings",
-            "generate_autocompletions", "f/conversation/prepare"
-        ]
-        
-        for ignored in ignore_keywords:
-            if ignored in flow.request.pretty_url:
-                # print(f"[PROXY SKIPPED] {flow.request.pretty_url} (Filter: {ignored})")
-                return
 
-        # Log that we see RELEVANT traffic
-        print(f"[PROXY SEES] {flow.request.method} {flow.request.pretty_url}")
+        # Log that we see RELEVANT traffic (debug level: one line per flow is too much at volume)
+        log.event(logger, "flow_inspected", logging.DEBUG, method=flow.request.method, host=flow.request.pretty_host, route=route.name)
 
+        started = time.perf_counter()
         try:
-            # Debug: Log all POSTs to targets
-            print(f"[PROXY] Inspecting POST to: {flow.request.pretty_url}")
-            
-            try:
-                # Fix: Use get_text() to handle GZIP/Brotli compression automatically
-                content = flow.request.get_text(strict=False)
-            except Exception as e:
-                print(f"[WARN] [PROXY] Failed to decode content (Binary?): {e}")
-                return
-
+            # .content is already decoded from GZIP/Brotli; JSON is parsed straight from the bytes
+            content = flow.request.content
             if not content:
-                print(f"[WARN] [PROXY] No content in request (Length: {len(flow.request.content)})")
+                log.event(logger, "flow_skipped", logging.DEBUG, host=flow.request.pretty_host, reason="empty body")
+                metrics.REQUESTS.inc("skipped")
                 return
 
             # Attempt JSON parsing
             try:
-                data = json.loads(content)
-                # print(f"📄 [PROXY] JSON Keys: {list(data.keys())}") # Debug structure
-            except json.JSONDecodeError:
-                print("[WARN] [PROXY] Failed to parse JSON body")
+                data = json_codec.loads(content)
+            except json_codec.JSONDecodeError:
+                log.event(logger, "flow_skipped", logging.DEBUG, host=flow.request.pretty_host, reason="not JSON")
+                metrics.REQUESTS.inc("skipped")
                 return # Not JSON
             
-            # --- ChatGPT Specific Handling ---
+            # --- Provider Specific Handling (see app/services/providers.py) ---
             modified = False
-            mapping = {}
             final_items = {} # For Audit
             
-            # Recursive search with debug
-            def process_value(val):
-                nonlocal modified, mapping, final_items
-                # DEBUG: FORCE PROOF on almost everything
-                if isinstance(val, str) and len(val) > 1:
-                    # LOG EVERYTHING (To prove we saw it)
-                    # print(f"👀 [PROXY] Analyzing: {val[:50]}...")
-                    
-                    result = redact_text(val)
-                    
-                    # PROOF OF INTERCEPTION:
-                    # We inject this tag even if no PII is found, so the user sees it in ChatGPT's reply context
-                    val = val + " [TrustLayer Verified]"
-                    modified = True 
-                    
-                    if result.items:
-                        # LOGGING: ORIGINAL vs REDACTED
-                        print(f"[USER PROMPT] {val}")
-                        
-                        mapping.update(result.mapping)
-                        
-                        # INJECT VISIBLE INDICATOR (For Testing)
-                        val_redacted = result.text + " [REDACTED]"
-                        print(f"[REDACTED PROMPT] {val_redacted}")
-                        
-                        # Accumulate counts
-                        for k, v in result.items.items():
-                            final_items[k] = final_items.get(k, 0) + v
-                        return val_redacted
-                    else:
-                        # Even if No PII, log it IF it looks like a real prompt (heuristic)
-                        # Avoid logging tiny metadata strings e.g "en-US", "auto"
-                        if len(val) > 4 and " " in val:
-                             print(f"[USER PROMPT] {val}")
-                             
-                        return val # Return the one with [Verified] tag 
-                        # Actually logic above updates 'val' local var but return returns the result.text. 
-                        # Let's be explicit.
-                        return val
-                return val
-
-            # Deep traverse
-            def traverse(obj):
+            # Pass 1: Collect the user content leaves so the NLP pipeline runs ONCE per payload.
+            # Only the provider's content paths are visited (ids, model names, ... are never analyzed),
+            # `state` tracks where we are in the route's JSON paths.
+            paths = route.inspect
+            leaves = [] # [(container, key)] so changed leaves can be replaced in place
+            def collect(obj, state):
+                if not state:
+                    return
                 if isinstance(obj, dict):
-                    return {k: traverse(v) for k, v in obj.items()}
+                    items = obj.items()
                 elif isinstance(obj, list):
-                    return [traverse(elem) for elem in obj]
+                    items = enumerate(obj)
                 else:
-                    return process_value(obj)
+                    return
+                for k, v in items:
+                    child_state = paths.step(state, k)
+                    if isinstance(v, str):
+                        if len(v) > 1 and paths.matches(child_state):
+                            leaves.append((obj, k))
+                    else:
+                        collect(v, child_state)
 
-            new_data = traverse(data)
-            
-            # Debug: Force modified if we found anything (just to be safe)
-            if final_items: 
-                modified = True
-                print(f"[PROXY] DETECTED PII (Summary): {final_items}") # <-- NEW SUMMARY LOG
+            collect(data, paths.start())
+            rewriting = time.perf_counter() - started # Parse + collect + rewrite, observed as "rewrite"
+
+            # Turns of one conversation share their tokens ("John Doe" stays [PERSON_1]) and texts
+            # already redacted in an earlier turn (the resent history) are not analyzed again.
+            # Ids are scoped to the client address, which only separates clients that have their
+            # own: behind NAT (or without aliases behind proxy_cluster) PROXY_CONVERSATIONS is off
+            # and every request stands alone.
+            conversation = None
+            if settings.PROXY_CONVERSATIONS:
+                conversation = (
+                    flow.request.headers.get(settings.CONVERSATION_ID_HEADER)
+                    or conversation_id(route.provider, data, flow.request.path)
+                )
+            if conversation:
+                conversation = f"{flow.client_conn.peername[0]}|{route.name}|{conversation}"
+            with metrics.stage("redact"):
+                results, mapping = await conversation_store.redact(
+                    conversation, [container[key] for container, key in leaves]
+                )
 
+            rewrite_started = time.perf_counter()
+
+            # Pass 2: Rewrite only the leaves that contained PII. The parsed body belongs to this
+            # flow, so they are replaced in place: nothing else is copied or rebuilt.
+            log_leaves = logger.isEnabledFor(logging.DEBUG) # Checked once, not per leaf
+            for (container, key), result in zip(leaves, results):
+                if result.items:
+                    # LOGGING: ORIGINAL vs REDACTED (length + hash only unless LOG_PII=full)
+                    if log_leaves:
+                        log.event(logger, "leaf_redacted", logging.DEBUG, original=log.text(container[key]), redacted=log.text(result.text), entities=result.items)
+                    container[key] = result.text
+                    modified = True
+                    
+                    # Accumulate counts
+                    for k, v in result.items.items():
+                        final_items[k] = final_items.get(k, 0) + v
+
+            # Store mapping for the response (even without PII in this turn: the answer
+            # may refer to tokens of earlier turns of the conversation)
+            if mapping:
+                self.mappings.put(flow.id, mapping)
+
+            # Without PII the original bytes are forwarded untouched (no re-encoding)
             if modified:
-                print(f"[PROXY] Refracted PII in request to {flow.request.pretty_host}")
-                flow.request.content = json.dumps(new_data).encode('utf-8')
-                # Store mapping for the response
-                self.mappings[flow.id] = mapping
+                log.event(logger, "request_sanitized", sampled=True, host=flow.request.pretty_host, route=route.name, leaves=len(leaves), entities=final_items)
+                flow.request.content = json_codec.dumps(data)
                 
                 # Visual Indicator in Header
                 flow.request.headers["X-TrustLayer-Status"] = "Sanitized"
-                
+            metrics.observe_stage("rewrite", rewriting + time.perf_counter() - rewrite_started)
+
+            if modified:
                 # --- AUDIT LOGGING ---
+                metrics.count_entities(final_items)
                 try:
-                    # Create a new session for this log
-                    async with SessionLocal() as db:
-                         request_id = str(uuid.uuid4())
-                         for entity_type, count in final_items.items():
-                             await create_audit_log(db, entity_type, count, request_id)
-                             # logger.info(f"Logged {count} {entity_type}")
+                    # Queued: committed in bulk by the audit writer, the flow never waits on SQLite
+                    request_id = str(uuid.uuid4())
+                    with metrics.stage("audit"):
+                        for entity_type, count in final_items.items():
+                            await enqueue_audit_log(entity_type, count, request_id)
                 except Exception as e:
                     logger.error(f"Audit log failed: {e}")
 
+            metrics.REQUESTS.inc("sanitized" if modified else "clean")
+            metrics.observe_stage("request", time.perf_counter() - started)
 
+        except RedactionOverloaded as e:
+            # Fail closed: the request is answered here, it never reaches the provider unredacted
+            log.event(logger, "redaction_overloaded", logging.WARNING, host=flow.request.pretty_host, error=str(e))
+            metrics.REQUESTS.inc("overloaded")
+            flow.response = http.Response.make(
+                503,
+                json_codec.dumps({"error": {"message": "TrustLayer: redaction overloaded, retry later", "type": "overloaded"}}),
+                {"Content-Type": "application/json", "Retry-After": "1"},
+            )
         except Exception as e:
             logger.error(f"Error processing request: {e}")
+            metrics.REQUESTS.inc("error")
 
     # HYBRID STREAMING STRATEGY (v2 - Real-Time Restore)
     # We use a stream modifier to replace text ON THE FLY.
@@ -196,51 +232,56 @@ class TrustLayerAddon:
         # Always enable streaming first (Default)
         flow.response.stream = True
         
-        # Check if we have pending PII to restore
-        if flow.id in self.mappings:
-            # Assign a generator to perform modification during streaming
-            # flow.response.stream expect a callable that takes chunks and yields chunks
-            flow.response.stream = self.make_stream_modifier(flow.id)
-            print(f"[PROXY] Streaming with Real-Time De-anonymization enabled")
-
-    def make_stream_modifier(self, flow_id):
-        # Closure to capture the flow_id
-        def modifier(chunks):
-            mapping = self.mappings.pop(flow_id, {})
-            
-            # Helper to process a single byte-chunk
-            def process(chunk_bytes):
-                # Protection: Ensure it is bytes
-                if not isinstance(chunk_bytes, bytes):
-                    return chunk_bytes 
-                
-                try:
-                    text = chunk_bytes.decode("utf-8", "ignore")
-                    for safe, real in mapping.items():
-                         if safe in text:
-                             text = text.replace(safe, real)
-                             print(f"[AI RESPONSE] Restored: '{safe}' -> '{real}'")
-                    return text.encode("utf-8")
-                except:
-                    return chunk_bytes
-
-            # Handle both Single Bytes and Iterable
-            if isinstance(chunks, bytes):
-                yield process(chunks)
-            else:
-                try:
-                    for chunk in chunks:
-                        yield process(chunk)
-                except Exception as e:
-                    # If it's not iterable but not bytes?
-                    print(f"[STREAM] Iteration Error: {e}, passing raw")
-                    yield chunks # Fallback
+        # Check if we have pending PII to restore (taken out of the store: the modifier owns it now)
+        mapping = self.mappings.pop(flow.id)
+        if mapping:
+            # Restored values change the body length: the upstream Content-Length would cut the
+            # response short (or leave the client waiting), HTTP/1.1 switches to chunked instead
+            if "content-length" in flow.response.headers:
+                del flow.response.headers["content-length"]
+                if flow.response.http_version == "HTTP/1.1":
+                    flow.response.headers["transfer-encoding"] = "chunked"
+
+            # Assign a callable to perform modification during streaming
+            # flow.response.stream expects a callable that takes a chunk and returns the new chunk
+            flow.response.stream = self.make_stream_modifier(mapping)
+            log.event(logger, "restore_streaming", logging.DEBUG, host=flow.request.pretty_host, tokens=len(mapping))
+
+    def make_stream_modifier(self, mapping):
+        # One stateful restorer per flow: it keeps partial tokens / partial UTF-8
+        # characters between chunks, so "[PERS" + "ON_1]" is still restored.
+        restorer = StreamRestorer(mapping)
+        restoring = [0.0] # Seconds spent restoring this stream, observed once at its end
+
+        # mitmproxy calls this once per chunk and a final time with b"" at the end of the stream
+        def modifier(chunk):
+            # Protection: Ensure it is bytes
+            if not isinstance(chunk, bytes):
+                return chunk
+
+            try:
+                started = time.perf_counter()
+                if chunk == b"":
+                    out = restorer.flush()
+                    metrics.observe_stage("restore", restoring[0] + time.perf_counter() - started)
+                    if restorer.restored:
+                        log.event(logger, "response_restored", sampled=True, restored=restorer.restored)
+                    return out
+                out = restorer.feed(chunk)
+                restoring[0] += time.perf_counter() - started
+                return out
+            except Exception as e:
+                log.event(logger, "restore_failed", logging.WARNING, error=str(e))
+                return chunk
         return modifier
 
     async def response(self, flow: http.HTTPFlow):
-        # Cleanup is handled in the modifier or here if stream wasn't consumed
-        if flow.id in self.mappings:
-            del self.mappings[flow.id]
+        # Cleanup is handled in responseheaders, this covers flows that skipped it
+        self.mappings.discard(flow.id)
+
+    def error(self, flow: http.HTTPFlow):
+        # Aborted/failed flows never reach the response hooks
+        self.mappings.discard(flow.id)
             
 addons = [
     TrustLayerAddon()
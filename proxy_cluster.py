@@ -0,0 +1,268 @@
+"""
+Multi-process proxy: N mitmdump workers behind a TCP front balancer, so NER and JSON handling
+use more than one core.
+
+    python proxy_cluster.py --workers 4 --set confdir=./certs --set block_global=false
+
+Unknown arguments are passed on to every mitmdump worker. Balancing is per TCP connection with
+client affinity:
+  * a flow's request and response travel on one connection, so they are handled by the same
+    worker and the per-flow mappings never have to leave it;
+  * all connections of a client go to the same worker (the next one if it is down), so its
+    conversations keep their pseudonyms;
+  * audit records go to the shared database (SQLite in WAL mode takes concurrent writers).
+Workers only see the balancer as their peer. On Linux each client gets its own loopback source
+address (127.x.y.z, allocated per client IP), which keeps conversations scoped per client. Where
+that is not possible the workers run with PROXY_CONVERSATIONS=false: they could not tell clients apart.
+"""
+import argparse
+import asyncio
+import errno
+import hashlib
+import logging
+import os
+import shutil
+import signal
+import socket
+import sys
+import time
+
+from app.core import log
+from app.core.config import settings
+
+log.setup_logging()
+logger = logging.getLogger("TrustLayerProxy.cluster")
+
+BUFFER_BYTES = 64 * 1024
+RESTART_BACKOFF_MAX = 30.0
+ALIAS_SWEEP_SECONDS = 60.0
+
+
+def _client_hash(client_ip: str) -> bytes:
+    return hashlib.blake2b(client_ip.encode(), digest_size=8).digest()
+
+
+def _aliases_available() -> bool:
+    # 127.0.0.0/8 is all loopback on Linux, elsewhere usually only 127.0.0.1 is configured
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        with socket.socket() as probe:
+            probe.bind(("127.1.0.1", 0))
+        return True
+    except OSError:
+        return False
+
+
+class AliasTable:
+    """
+    Loopback source address per client IP. Allocated, not hashed: two clients never share one.
+    An address is only handed out again after its client was idle for longer than its
+    conversations and mappings live in the workers, so nothing of it can be borrowed.
+    """
+
+    def __init__(self, idle_seconds: float):
+        self.idle_seconds = idle_seconds
+        self._clients = {} # {client_ip: [alias, open connections, last seen]}
+        self._free = [] # Released aliases
+        self._next = 1 << 16 # 127.1.0.0, 127.0.0.x is left alone
+
+    def _allocate(self) -> str:
+        if self._free:
+            return self._free.pop()
+        while self._next < 1 << 24:
+            number = self._next
+            self._next += 1
+            if 0 < number & 0xFF < 0xFF: # No .0 / .255 host parts
+                return f"127.{number >> 16}.{(number >> 8) & 0xFF}.{number & 0xFF}"
+        raise OSError(errno.EADDRNOTAVAIL, "Loopback aliases exhausted")
+
+    def acquire(self, client_ip: str) -> str:
+        entry = self._clients.get(client_ip)
+        if entry is None:
+            entry = self._clients[client_ip] = [self._allocate(), 0, 0.0]
+        entry[1] += 1
+        entry[2] = time.monotonic()
+        return entry[0]
+
+    def release(self, client_ip: str):
+        entry = self._clients[client_ip]
+        entry[1] -= 1
+        entry[2] = time.monotonic()
+
+    def sweep(self) -> int:
+        cutoff = time.monotonic() - self.idle_seconds
+        idle = [client_ip for client_ip, (_, connections, seen) in self._clients.items() if not connections and seen < cutoff]
+        for client_ip in idle:
+            self._free.append(self._clients.pop(client_ip)[0])
+        return len(idle)
+
+    def __len__(self) -> int:
+        return len(self._clients)
+
+
+class Worker:
+    """
+    One mitmdump process, restarted with a backoff when it exits.
+    """
+
+    def __init__(self, index: int, port: int, extra_args: list[str], conversations: bool = True):
+        self.index = index
+        self.port = port
+        self.extra_args = extra_args
+        self.conversations = conversations
+        self.process = None
+        self.restarts = 0
+
+    def command(self) -> list[str]:
+        mitmdump = shutil.which("mitmdump") or "mitmdump"
+        return [
+            mitmdump, "-s", "proxy_addon.py",
+            "--listen-host", "127.0.0.1", "--listen-port", str(self.port),
+            *self.extra_args,
+        ]
+
+    def environment(self) -> dict:
+        env = dict(os.environ)
+        if settings.PROXY_METRICS_PORT:
+            # One metrics endpoint per worker
+            env["PROXY_METRICS_PORT"] = str(settings.PROXY_METRICS_PORT + self.index)
+        if not self.conversations:
+            env["PROXY_CONVERSATIONS"] = "false"
+        return env
+
+    async def run(self, stopping: asyncio.Event):
+        backoff = 1.0
+        while not stopping.is_set():
+            self.process = await asyncio.create_subprocess_exec(*self.command(), env=self.environment())
+            logger.info(f"Proxy worker {self.index} started on port {self.port} (pid {self.process.pid})")
+            code = await self.process.wait()
+            if stopping.is_set():
+                return
+            self.restarts += 1
+            logger.error(f"Proxy worker {self.index} exited with code {code}, restarting in {backoff:.0f}s")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RESTART_BACKOFF_MAX)
+
+    async def stop(self, timeout: float):
+        if self.process is None or self.process.returncode is not None:
+            return
+        # SIGTERM: mitmproxy runs the addon's done() hook, queued audit records are written
+        self.process.terminate()
+        try:
+            await asyncio.wait_for(self.process.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+
+async def _pipe(reader: asyncio.StreamReader, writer: asyncio.StreamWriter, other: asyncio.StreamWriter):
+    try:
+        while data := await reader.read(BUFFER_BYTES):
+            writer.write(data)
+            await writer.drain()
+        if writer.can_write_eof():
+            writer.write_eof() # Half-close, the other direction may still be sending
+    except OSError:
+        # Reset on one side: tear down both directions
+        writer.close()
+        other.close()
+
+
+class Balancer:
+    def __init__(self, workers: list[Worker], aliases: AliasTable = None):
+        self.workers = workers
+        self.aliases = aliases # None: workers see 127.0.0.1 for every client
+        self.connections = 0
+
+    def candidates(self, client_ip: str) -> list[Worker]:
+        # The client's own worker first, then the others in ring order
+        start = int.from_bytes(_client_hash(client_ip)[4:], "big") % len(self.workers)
+        return self.workers[start:] + self.workers[:start]
+
+    async def _connect(self, worker: Worker, alias: str):
+        # Never falls back to 127.0.0.1 when an alias is set: the client would share its scope
+        local_addr = (alias, 0) if alias else None
+        return await asyncio.open_connection("127.0.0.1", worker.port, local_addr=local_addr)
+
+    async def handle(self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter):
+        peer = client_writer.get_extra_info("peername")
+        client_ip = peer[0] if peer else ""
+        try:
+            alias = self.aliases.acquire(client_ip) if self.aliases is not None else None
+        except OSError as e:
+            logger.error(f"Dropping connection: {e}")
+            client_writer.close()
+            return
+
+        try:
+            for worker in self.candidates(client_ip):
+                try:
+                    worker_reader, worker_writer = await self._connect(worker, alias)
+                    break
+                except OSError:
+                    continue # Down or restarting, try the next one
+            else:
+                logger.error("No proxy worker reachable, dropping connection")
+                client_writer.close()
+                return
+
+            self.connections += 1
+            try:
+                await asyncio.gather(
+                    _pipe(client_reader, worker_writer, client_writer),
+                    _pipe(worker_reader, client_writer, worker_writer),
+                )
+            finally:
+                self.connections -= 1
+                worker_writer.close()
+                client_writer.close()
+        finally:
+            if alias is not None:
+                self.aliases.release(client_ip)
+
+    async def sweep_aliases(self, stopping: asyncio.Event):
+        while not stopping.is_set():
+            await asyncio.sleep(ALIAS_SWEEP_SECONDS)
+            self.aliases.sweep()
+
+
+async def main(worker_count: int, extra_args: list[str]):
+    stopping = asyncio.Event()
+    aliases = None
+    if _aliases_available():
+        aliases = AliasTable(idle_seconds=max(settings.CONVERSATION_TTL_SECONDS, settings.MAPPING_TTL_SECONDS))
+    else:
+        logger.warning("Loopback aliases unavailable: workers cannot tell clients apart, conversation reuse is off")
+    workers = [
+        Worker(index, settings.PROXY_WORKER_BASE_PORT + index, extra_args, conversations=aliases is not None)
+        for index in range(worker_count)
+    ]
+    tasks = [asyncio.create_task(worker.run(stopping)) for worker in workers]
+
+    balancer = Balancer(workers, aliases)
+    if aliases is not None:
+        tasks.append(asyncio.create_task(balancer.sweep_aliases(stopping)))
+    server = await asyncio.start_server(
+        balancer.handle, settings.PROXY_LISTEN_HOST, settings.PROXY_LISTEN_PORT,
+        reuse_address=True, backlog=1024,
+    )
+    logger.info(f"Proxy balancer on {settings.PROXY_LISTEN_HOST}:{settings.PROXY_LISTEN_PORT} -> {worker_count} worker(s)")
+
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopping.set)
+
+    await stopping.wait()
+    logger.info("Stopping proxy cluster")
+    server.close()
+    await asyncio.gather(*(worker.stop(timeout=10.0) for worker in workers))
+    for task in tasks:
+        task.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TrustLayer proxy with several worker processes")
+    parser.add_argument("--workers", type=int, default=settings.PROXY_WORKERS, help="mitmdump processes (default: PROXY_WORKERS)")
+    args, extra = parser.parse_known_args()
+    asyncio.run(main(max(1, args.workers), extra))
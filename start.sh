@@ -8,7 +8,12 @@ streamlit run dashboard.py --server.port 8501 --server.address 0.0.0.0 &
 
 # Start MITM Proxy (Port 8080)
 # Use --web-host 0.0.0.0 to allow IAP tunnel to access dashboard at 8081 if needed
-mitmweb -s proxy_addon.py --set confdir=./certs --set block_global=false --listen-host 0.0.0.0 --listen-port 8080 --web-host 0.0.0.0 --web-port 8081 &
+# PROXY_WORKERS > 1: several mitmdump workers behind a balancer on 8080 (no web UI)
+if [ "${PROXY_WORKERS:-1}" -gt 1 ]; then
+    python proxy_cluster.py --set confdir=./certs --set block_global=false &
+else
+    mitmweb -s proxy_addon.py --set confdir=./certs --set block_global=false --listen-host 0.0.0.0 --listen-port 8080 --web-host 0.0.0.0 --web-port 8081 &
+fi
 
 # Wait for any process to exit
 wait -n
@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# Settings are read when app.core.config is imported: configure the test environment first.
+# NER runs in-process, nothing is warmed up and the database is a scratch file.
+_scratch = tempfile.mkdtemp(prefix="trustlayer-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{_scratch}/test.db")
+os.environ.setdefault("REDACTION_WORKERS", "0")
+os.environ.setdefault("WARMUP_ON_STARTUP", "false")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("RECOGNIZERS_FILE", os.path.join(_scratch, "recognizers.json"))
+os.environ.setdefault("PROXY_ROUTES_FILE", os.path.join(_scratch, "proxy_routes.json"))
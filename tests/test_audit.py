@@ -0,0 +1,238 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.database import Base
+from app.modules import audit
+from app.modules.audit import (
+    BUCKETS, AuditLog, AuditMigration, AuditWriter, backfill_rollups, compact_audit_data,
+    get_audit_stats, get_rollup_stats, get_time_buckets, get_top_entities,
+)
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """
+    A scratch database of its own; the audit module writes to it through SessionLocal.
+    """
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/audit.db")
+    sessions = sessionmaker(bind=engine, class_=AsyncSession)
+    monkeypatch.setattr(audit, "SessionLocal", sessions)
+    yield engine, sessions
+    asyncio.run(engine.dispose())
+
+
+def _locked(sessions, times: int):
+    """
+    Session factory whose first `times` sessions fail like a database locked by another writer.
+    """
+    def session():
+        nonlocal times
+        if times:
+            times -= 1
+            raise OperationalError("INSERT", {}, Exception("database is locked"))
+        return sessions()
+    return session
+
+
+def _records(timestamps, entity_type="PERSON"):
+    return [{"timestamp": ts, "entity_type": entity_type, "count": 2, "request_id": "r"} for ts in timestamps]
+
+
+async def _totals(sessions):
+    async with sessions() as db:
+        return await get_audit_stats(db), {g: await get_rollup_stats(db, granularity=g) for g in BUCKETS}
+
+
+def test_writer_maintains_rollups(database):
+    engine, sessions = database
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = AuditWriter(max_queue=100, batch_size=10, flush_interval=0.05, overflow_policy="drop_oldest")
+        writer.start()
+        for i in range(25):
+            await writer.enqueue("EMAIL" if i % 2 else "PERSON", 1, f"r{i}")
+        await writer.stop()
+        return writer.stats(), await _totals(sessions)
+
+    stats, (raw, rollups) = asyncio.run(run())
+    assert stats["written"] == 25 and stats["failed"] == 0
+    assert raw == {"PERSON": 13, "EMAIL": 12}
+    assert all(totals == raw for totals in rollups.values())
+
+
+@pytest.mark.parametrize("policy,kept", [("drop_oldest", ["r2", "r3", "r4"]), ("drop_newest", ["r0", "r1", "r2"])])
+def test_overflow_policy(database, policy, kept):
+    engine, sessions = database
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = AuditWriter(max_queue=3, batch_size=10, flush_interval=0.05, overflow_policy=policy)
+        writer.start()
+        # Nothing awaits in between: the writer gets no chance to drain the queue
+        for i in range(5):
+            await writer.enqueue("PERSON", 1, f"r{i}")
+        await writer.stop()
+        async with sessions() as db:
+            written = (await db.execute(select(AuditLog.request_id).order_by(AuditLog.id))).scalars().all()
+        return writer.stats(), written
+
+    stats, written = asyncio.run(run())
+    assert (stats["dropped"], stats["written"]) == (2, 3)
+    assert written == kept
+
+
+def test_records_are_written_directly_without_a_running_writer(database):
+    engine, sessions = database
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = AuditWriter(max_queue=3, batch_size=10, flush_interval=0.05, overflow_policy="drop_oldest")
+        await writer.enqueue("EMAIL_ADDRESS", 4, "r")
+        return writer.stats(), await _totals(sessions)
+
+    stats, (raw, _) = asyncio.run(run())
+    assert (stats["written"], stats["batches"]) == (1, 1)
+    assert raw == {"EMAIL_ADDRESS": 4}
+
+
+def test_aggregations_group_in_the_database(database):
+    engine, sessions = database
+    day = datetime(2026, 3, 1)
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+            await conn.execute(insert(AuditLog), [
+                *_records([day.replace(hour=9, minute=5), day.replace(hour=9, minute=50), day.replace(hour=11)]),
+                *_records([day.replace(hour=9, minute=5), day + timedelta(days=1)], entity_type="EMAIL_ADDRESS"),
+            ])
+        async with sessions() as db:
+            return (
+                await get_audit_stats(db, start=day, end=day + timedelta(days=1)),
+                await get_time_buckets(db, bucket="hour", end=day + timedelta(days=1)),
+                await get_time_buckets(db, bucket="day", entity_type="PERSON"),
+                await get_top_entities(db, limit=1),
+            )
+
+    stats, hours, days, top = asyncio.run(run())
+    assert stats == {"PERSON": 6, "EMAIL_ADDRESS": 2}
+    assert sorted(hours) == [
+        (day.replace(hour=9), "EMAIL_ADDRESS", 2),
+        (day.replace(hour=9), "PERSON", 4),
+        (day.replace(hour=11), "PERSON", 2),
+    ]
+    assert days == [(day, "PERSON", 6)]
+    assert top == [("PERSON", 6)]
+
+
+def test_locked_flush_is_retried(database, monkeypatch):
+    engine, sessions = database
+    monkeypatch.setattr(audit, "SessionLocal", _locked(sessions, times=2))
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        monkeypatch.setattr(audit.asyncio, "sleep", _no_sleep)
+        writer = AuditWriter(max_queue=100, batch_size=10, flush_interval=0.05, overflow_policy="drop_oldest", retries=3)
+        await writer._write(_records([datetime.utcnow()] * 3))
+        return writer.stats(), await _totals(sessions)
+
+    stats, (raw, _) = asyncio.run(run())
+    assert stats["retried"] == 2 and stats["written"] == 3 and stats["failed"] == 0
+    assert raw == {"PERSON": 6}
+
+
+def test_locked_flush_is_requeued_when_retries_run_out(database, monkeypatch):
+    engine, sessions = database
+    monkeypatch.setattr(audit, "SessionLocal", _locked(sessions, times=1))
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = AuditWriter(max_queue=100, batch_size=10, flush_interval=0.05, overflow_policy="drop_oldest", retries=0)
+        writer.start()
+        await writer._write(_records([datetime.utcnow()] * 3)) # Locked: back into the queue
+        await writer.stop() # Written by the final flush
+        return writer.stats(), await _totals(sessions)
+
+    stats, (raw, _) = asyncio.run(run())
+    assert stats["requeued"] == 3 and stats["written"] == 3 and stats["failed"] == 0
+    assert raw == {"PERSON": 6}
+
+
+def test_backfill_of_an_older_database(database):
+    engine, sessions = database
+    started = datetime(2026, 1, 1)
+
+    async def run():
+        # A database from before the rollups: audit_logs only, with history
+        async with engine.begin() as conn:
+            await conn.run_sync(AuditLog.__table__.create)
+            await conn.execute(insert(AuditLog), _records(started + timedelta(minutes=7 * i) for i in range(500)))
+            await conn.run_sync(Base.metadata.create_all)
+        async with sessions() as db:
+            migration = (await db.execute(select(AuditMigration))).scalar_one()
+            assert (migration.cutoff_id, migration.done) == (500, False)
+
+        # Written after the upgrade, before the backfill ran: already in the rollups
+        await AuditWriter(100, 10, 0.05, "drop_oldest")._write(_records([started + timedelta(days=3)]))
+
+        async with sessions() as db:
+            await backfill_rollups(db)
+        first = await _totals(sessions)
+        async with sessions() as db:
+            await backfill_rollups(db) # Done already: a no-op
+        return first, await _totals(sessions)
+
+    (raw, rollups), again = asyncio.run(run())
+    assert raw == {"PERSON": 1002}
+    assert all(totals == raw for totals in rollups.values())
+    assert again == (raw, rollups)
+
+
+def test_compaction_keeps_totals_in_coarser_rollups(database, monkeypatch):
+    engine, sessions = database
+    monkeypatch.setattr(audit.settings, "AUDIT_RAW_RETENTION_DAYS", 30)
+    monkeypatch.setitem(audit.ROLLUP_RETENTION_DAYS, "minute", 2)
+    monkeypatch.setitem(audit.ROLLUP_RETENTION_DAYS, "hour", 90)
+    monkeypatch.setitem(audit.ROLLUP_RETENTION_DAYS, "day", 0)
+    now = datetime(2026, 6, 1, 12)
+
+    async def run():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        writer = AuditWriter(100, 10, 0.05, "drop_oldest")
+        await writer._write(_records([now - timedelta(days=120), now - timedelta(days=40), now - timedelta(hours=1)]))
+        async with sessions() as db:
+            deleted = await compact_audit_data(db, now=now)
+        return deleted, await _totals(sessions)
+
+    deleted, (raw, rollups) = asyncio.run(run())
+    assert deleted == {"raw": 2, "minute": 2, "hour": 1}
+    assert raw == {"PERSON": 2}
+    assert rollups == {"minute": {"PERSON": 2}, "hour": {"PERSON": 4}, "day": {"PERSON": 6}}
+
+
+async def _no_sleep(seconds):
+    pass
+
+
+def test_granularities_for_retained_ranges(monkeypatch):
+    monkeypatch.setattr(audit, "ROLLUP_RETENTION_DAYS", {"minute": 2, "hour": 90, "day": 0})
+    assert audit.granularities_for(timedelta(hours=1)) == ["minute", "hour", "day"]
+    assert audit.granularities_for(timedelta(days=30)) == ["hour", "day"]
+    assert audit.granularities_for(None) == ["day"]
+
+    # Day rollups compacted too: nothing covers all of history
+    monkeypatch.setitem(audit.ROLLUP_RETENTION_DAYS, "day", 365)
+    assert audit.granularities_for(None) == []
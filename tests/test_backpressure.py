@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+from mitmproxy.test import tflow
+
+import proxy_addon
+from app.core import metrics
+from app.main import app
+from app.services.conversation_store import conversation_store
+from app.services.redaction_executor import RedactionExecutor, RedactionOverloaded
+
+
+def test_waiters_beyond_the_limit_are_rejected(monkeypatch):
+    executor = RedactionExecutor(workers=0, max_pending=1, max_waiting=1)
+    release = None
+
+    async def blocked(jobs):
+        await release.wait()
+        return [[] for _ in jobs]
+
+    monkeypatch.setattr(executor, "_analyze", blocked)
+
+    async def run():
+        nonlocal release
+        release = asyncio.Event()
+        # Uncached texts: every batch needs the workers
+        running = asyncio.create_task(executor.analyze_batch(["waiter test one"]))
+        waiting = asyncio.create_task(executor.analyze_batch(["waiter test two"]))
+        await asyncio.sleep(0)
+        assert (executor.pending, executor.waiting) == (2, 1)
+
+        with pytest.raises(RedactionOverloaded):
+            await executor.analyze_batch(["waiter test three"])
+
+        release.set()
+        await asyncio.gather(running, waiting)
+        assert (executor.pending, executor.waiting, executor.rejected) == (0, 0, 1)
+
+    asyncio.run(run())
+
+
+def _overloaded(monkeypatch):
+    async def redact(conversation, texts):
+        raise RedactionOverloaded("test")
+    monkeypatch.setattr(conversation_store, "redact", redact)
+
+
+def test_api_answers_503_when_overloaded(monkeypatch):
+    _overloaded(monkeypatch)
+    response = TestClient(app).post("/v1/chat/completions", data={"prompt": "My name is John Doe."})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+
+def test_proxy_fails_closed_when_overloaded(monkeypatch):
+    _overloaded(monkeypatch)
+    flow = tflow.tflow()
+    flow.request.host = "api.openai.com"
+    flow.request.method = "POST"
+    flow.request.path = "/v1/chat/completions"
+    flow.request.content = json.dumps({"messages": [{"role": "user", "content": "My name is John Doe."}]}).encode()
+
+    asyncio.run(proxy_addon.TrustLayerAddon().request(flow))
+
+    # Answered by the proxy: the unredacted request is never sent upstream
+    assert flow.response is not None and flow.response.status_code == 503
+    assert json.loads(flow.response.content)["error"]["type"] == "overloaded"
+
+
+def test_waiting_batches_are_exposed():
+    text = metrics.render()
+    assert "trustlayer_redaction_waiting_batches 0" in text
+    assert "trustlayer_redaction_rejected_batches_total" in text
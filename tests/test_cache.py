@@ -0,0 +1,104 @@
+import asyncio
+
+from app.core import cache
+from app.core.cache import LRUCache
+from app.modules.redaction import analyze_batch, span_cache
+from app.services.mapping_store import MappingStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    lru = LRUCache(max_bytes=100, sizeof=lambda key, value: len(value))
+    lru.put("a", "x" * 40)
+    lru.put("b", "x" * 40)
+    assert lru.get("a") is not None # "b" is now the least recently used
+    lru.put("c", "x" * 40)
+
+    assert lru.get("b") is None and lru.get("a") and lru.get("c")
+    assert (lru.current_bytes, lru.evictions) == (80, 1)
+
+    # Bigger than the whole cache: not stored, nothing evicted for it
+    lru.put("d", "x" * 101)
+    assert lru.get("d") is None and len(lru) == 2
+
+
+def test_entry_count_limit():
+    lru = LRUCache(max_bytes=10_000, max_entries=2)
+    for key in "abc":
+        lru.put(key, key)
+    assert lru.get("a") is None and lru.stats()["entries"] == 2
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    lru = LRUCache(max_bytes=1000, ttl=10, sizeof=lambda key, value: 10)
+    lru.put("a", 1)
+    lru.put("b", 2)
+
+    clock.now += 5
+    assert lru.get("a") == 1
+    clock.now += 6
+    assert lru.get("a") is None # A hit does not extend the lifetime
+    assert lru.sweep() == 1 # "b", never asked for again
+    assert (len(lru), lru.current_bytes, lru.expirations) == (0, 0, 2)
+
+
+def test_repeated_texts_are_served_from_the_span_cache():
+    span_cache.clear()
+    text = "Please forward this to jane.doe@example.com today."
+    first = analyze_batch([text])
+    hits = span_cache.hits
+    assert analyze_batch([text]) == first
+    assert span_cache.hits == hits + 1
+    span_cache.clear()
+
+
+def test_mapping_store_forgets_flows_that_never_got_a_response(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    store = MappingStore(ttl=60, max_entries=10, max_bytes=100_000, sweep_interval=1)
+    store.put("answered", {"[PERSON_1]": "John Doe"})
+    store.put("aborted", {"[PERSON_1]": "Jane Roe"})
+
+    assert store.pop("answered") == {"[PERSON_1]": "John Doe"}
+    assert store.pop("answered") is None # Taken out by the response
+
+    clock.now += 61
+    store.put("late", {"[PERSON_1]": "Ann"})
+    assert store._cache.sweep() == 1 and len(store) == 1
+    assert store.pop("aborted") is None
+
+
+def test_mapping_store_is_capped():
+    store = MappingStore(ttl=60, max_entries=2, max_bytes=100_000, sweep_interval=1)
+    for flow_id in ("a", "b", "c"):
+        store.put(flow_id, {"[PERSON_1]": "John Doe"})
+    assert len(store) == 2 and store.pop("a") is None
+
+
+def test_mapping_store_encrypts_in_memory():
+    store = MappingStore(ttl=60, max_entries=10, max_bytes=100_000, sweep_interval=1, encrypt=True)
+    store.put("flow", {"[PERSON_1]": "John Doe"})
+    blob = store._cache.get("flow")
+    assert b"John Doe" not in blob
+    assert store.pop("flow") == {"[PERSON_1]": "John Doe"}
+
+
+def test_mapping_store_sweeps_in_the_background():
+    async def run():
+        store = MappingStore(ttl=0.01, max_entries=10, max_bytes=100_000, sweep_interval=0.02)
+        store.start()
+        store.put("aborted", {"[PERSON_1]": "John Doe"})
+        await asyncio.sleep(0.1)
+        store.stop()
+        return len(store), store.swept
+
+    assert asyncio.run(run()) == (0, 1)
@@ -0,0 +1,79 @@
+import asyncio
+
+import pytest
+
+from app.services import conversation_store as store_module
+from app.services.conversation_store import ConversationStore
+
+FIRST = "My name is John Doe."
+SECOND = "Please send it to John Doe at jd@example.com."
+
+
+@pytest.fixture
+def analyzed(monkeypatch):
+    """
+    Records the texts that actually go to the analyzer.
+    """
+    texts = []
+    redact_batch_async = store_module.redact_batch_async
+
+    async def recording(batch, pseudonyms=None):
+        texts.extend(batch)
+        return await redact_batch_async(batch, pseudonyms)
+
+    monkeypatch.setattr(store_module, "redact_batch_async", recording)
+    return texts
+
+
+def _store(**kwargs):
+    return ConversationStore(**{"ttl": 60, "max_entries": 10, "max_bytes": 1_000_000, "max_leaves": 10, **kwargs})
+
+
+def test_turns_of_a_conversation_share_tokens(analyzed):
+    store = _store()
+
+    async def run():
+        first, _ = await store.redact("chat-1", [FIRST])
+        # The next turn resends the history
+        second, mapping = await store.redact("chat-1", [FIRST, SECOND])
+        return first, second, mapping
+
+    first, second, mapping = asyncio.run(run())
+    assert first[0].text == "My name is [PERSON_1]."
+    assert [result.text for result in second] == [
+        "My name is [PERSON_1].",
+        "Please send it to [PERSON_1] at [EMAIL_ADDRESS_1].",
+    ]
+    # Every token so far, the answer may refer to any turn
+    assert mapping == {"[PERSON_1]": "John Doe", "[EMAIL_ADDRESS_1]": "jd@example.com"}
+    # The history was not analyzed again
+    assert analyzed == [FIRST, SECOND]
+    assert store.stats()["reused_texts"] == 1
+
+
+def test_conversations_do_not_share_tokens(analyzed):
+    store = _store()
+
+    async def run():
+        await store.redact("chat-1", ["Write to ann@example.com."])
+        results, mapping = await store.redact("chat-2", ["Or to bob@example.com."])
+        alone, alone_mapping = await store.redact(None, ["Or to bob@example.com."])
+        return results, mapping, alone, alone_mapping
+
+    results, mapping, alone, alone_mapping = asyncio.run(run())
+    assert results[0].text == alone[0].text == "Or to [EMAIL_ADDRESS_1]."
+    assert mapping == alone_mapping == {"[EMAIL_ADDRESS_1]": "bob@example.com"}
+
+
+def test_remembered_texts_are_capped(analyzed):
+    store = _store(max_leaves=2)
+
+    async def run():
+        for text in ("First text.", "Second text.", "Third text."):
+            await store.redact("chat-1", [text])
+        await store.redact("chat-1", ["First text."]) # Forgotten: analyzed again
+        return store.get("chat-1")
+
+    conversation = asyncio.run(run())
+    assert len(conversation.leaves) == 2
+    assert analyzed.count("First text.") == 2
@@ -0,0 +1,126 @@
+import threading
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.modules import document
+from app.modules.document import DOCX_MIME, EXTRACTORS, TIKA_EXTRACTOR, extractor_stats, iter_sections, sniff
+
+def _docx(path, paragraphs):
+    body = "".join(f"<w:p><w:r><w:t>{text}</w:t></w:r></w:p>" for text in paragraphs)
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("[Content_Types].xml", "<Types/>")
+        archive.writestr(
+            "word/document.xml",
+            '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f"<w:body>{body}</w:body></w:document>",
+        )
+    return str(path)
+
+
+@pytest.mark.parametrize("name,content,expected", [
+    ("scan.bin", b"%PDF-1.7\n...", ("application/pdf", None)),
+    ("notes.txt", "Grüße\n".encode("utf-16"), ("text/plain", "utf-16")),
+    ("page.txt", b"<!DOCTYPE html><html><body>Hi</body></html>", ("text/html", "utf-8")),
+    ("data", b'  {"name": "John Doe"}', ("application/json", "utf-8")),
+    ("table.csv", b"name,email\nJohn,john@example.com\n", ("text/csv", "utf-8")),
+    ("legacy.txt", "Caf\xe9 au lait".encode("cp1252"), ("text/plain", "cp1252")),
+    ("blob.txt", bytes(range(256)), ("application/octet-stream", None)),
+    ("sheet.xlsx", None, ("application/zip", None)),
+])
+def test_sniff_goes_by_content(tmp_path, name, content, expected):
+    path = tmp_path / name
+    if content is None:
+        with zipfile.ZipFile(path, "w") as archive:
+            archive.writestr("xl/workbook.xml", "<workbook/>")
+    else:
+        path.write_bytes(content)
+    assert sniff(str(path)) == expected
+
+
+def test_docx_is_extracted_in_process(tmp_path):
+    path = _docx(tmp_path / "letter.bin", ["Dear John Doe,", "see you soon."])
+    assert sniff(path) == (DOCX_MIME, None)
+    files = extractor_stats().get("docx", {}).get("files", 0)
+
+    assert "".join(iter_sections(path)) == "Dear John Doe,\nsee you soon.\n"
+    assert extractor_stats()["docx"]["files"] == files + 1
+
+
+def test_plain_text_sections_end_on_line_breaks(tmp_path):
+    path = tmp_path / "notes.txt"
+    lines = [f"Line {i} about John Doe.\n" for i in range(40)]
+    path.write_text("".join(lines))
+
+    sections = list(iter_sections(str(path), section_chars=100))
+    assert "".join(sections) == "".join(lines)
+    assert all(section.endswith("\n") and len(section) <= 100 for section in sections)
+
+
+def test_everything_else_goes_to_tika():
+    assert EXTRACTORS["text/html"].name == "html"
+    assert EXTRACTORS.get("application/pdf", TIKA_EXTRACTOR) is TIKA_EXTRACTOR
+
+
+PAGES = ["First page, John Doe.", "Second page.", "Third page, jane@example.com."]
+
+
+class StandInTika(BaseHTTPRequestHandler):
+    """
+    Tika server /tika answering with XHTML, one chunk per page; the last page is only
+    sent once the test has seen the first section.
+    """
+    protocol_version = "HTTP/1.1"
+    received = []
+    first_section_seen = None
+    held_back = False # The last page had to be sent without the first section having been seen
+
+    def do_PUT(self):
+        StandInTika.received.append(self.rfile.read(int(self.headers["Content-Length"])))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=UTF-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunks = ['<html xmlns="http://www.w3.org/1999/xhtml"><head><title></title></head><body>']
+        chunks += [f'<div class="page"><p>{page}</p>\n</div>' for page in PAGES]
+        chunks.append("</body></html>")
+        for i, chunk in enumerate(chunks):
+            if i == len(chunks) - 2:
+                StandInTika.held_back = not StandInTika.first_section_seen.wait(5)
+            data = chunk.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def tika_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInTika)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandInTika.received = []
+    StandInTika.first_section_seen = threading.Event()
+    StandInTika.held_back = False
+    monkeypatch.setattr(document, "_tika_ready", True)
+    monkeypatch.setattr(document, "_tika_endpoint", lambda: f"http://127.0.0.1:{server.server_port}")
+    yield StandInTika
+    server.shutdown()
+    server.server_close()
+
+
+def test_tika_output_is_sectioned_while_it_streams(tika_server, tmp_path):
+    path = tmp_path / "upload.pdf"
+    path.write_bytes(b"%PDF-1.4 stand-in")
+
+    sections = iter_sections(str(path))
+    first = next(sections)
+    # The last page has not been sent yet: the first one was handed over on its own
+    tika_server.first_section_seen.set()
+    rest = list(sections)
+
+    assert [section.strip() for section in [first, *rest]] == PAGES
+    assert tika_server.received == [b"%PDF-1.4 stand-in"]
+    assert not tika_server.held_back
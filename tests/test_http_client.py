@@ -0,0 +1,68 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.core.config import settings
+from app.services import http_client
+from app.services.llm_proxy import call_llm
+
+
+class StandInLLM(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible /chat/completions answering with a JSON completion, over keep-alive connections.
+    """
+    protocol_version = "HTTP/1.1"
+    connections = set()
+    authorization = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        StandInLLM.connections.add(self.client_address)
+        StandInLLM.authorization.append(self.headers["Authorization"])
+
+        answer = json.dumps({"choices": [{"message": {"content": f"Echo: {body['messages'][0]['content']}"}}]}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInLLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandInLLM.connections = set()
+    StandInLLM.authorization = []
+
+    monkeypatch.setattr(settings, "LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(settings, "LLM_HTTP2", False)
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test") # Not a mock key: the real call path runs
+    http_client._client = None # Built for the stand-in on first use
+    yield StandInLLM
+    http_client._client = None
+    server.shutdown()
+    server.server_close()
+
+
+def test_calls_share_one_pooled_connection(stand_in):
+    async def run():
+        sent = http_client.pool_stats()["requests_sent"]
+        answers = [await call_llm(f"prompt {i}") for i in range(3)]
+        stats = http_client.pool_stats()
+        await http_client.close_client()
+        return answers, stats, stats["requests_sent"] - sent
+
+    answers, stats, sent = asyncio.run(run())
+    assert answers == [f"Echo: prompt {i}" for i in range(3)]
+    assert sent == 3
+    # Kept alive and reused: one TCP connection for all calls
+    assert len(stand_in.connections) == 1
+    assert (stats["connections"], stats["idle"]) == (1, 1)
+    assert stand_in.authorization == ["Bearer sk-test"] * 3
@@ -0,0 +1,122 @@
+import asyncio
+import json
+
+import pytest
+from mitmproxy.test import tflow
+
+import proxy_addon
+from app.core import json_codec
+from app.core.config import settings
+from app.core.database import init_db
+from app.services.conversation_store import conversation_store
+
+
+@pytest.fixture
+def addon(monkeypatch):
+    """
+    The proxy addon, with every conversation_store.redact() batch recorded.
+    """
+    asyncio.run(init_db())
+    batches = []
+    redact = conversation_store.redact
+
+    async def recording(conversation, texts):
+        batches.append(list(texts))
+        return await redact(conversation, texts)
+
+    monkeypatch.setattr(conversation_store, "redact", recording)
+    instance = proxy_addon.TrustLayerAddon()
+    instance.batches = batches
+    return instance
+
+
+def _flow(payload, host="api.openai.com", path="/v1/chat/completions"):
+    flow = tflow.tflow()
+    flow.request.host = host
+    flow.request.method = "POST"
+    flow.request.path = path
+    flow.request.content = json.dumps(payload).encode()
+    return flow
+
+
+def test_all_leaves_of_a_payload_are_redacted_in_one_batch(addon):
+    flow = _flow({
+        "model": "gpt-4o",
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "My name is John Doe."},
+            {"role": "user", "content": [{"type": "text", "text": "Write to John Doe."}]},
+        ],
+    })
+    asyncio.run(addon.request(flow))
+
+    # Only the content leaves, all of them at once
+    assert addon.batches == [["You are a helpful assistant.", "My name is John Doe.", "Write to John Doe."]]
+    body = json.loads(flow.request.content)
+    assert body["model"] == "gpt-4o"
+    assert body["messages"][1]["content"] == "My name is [PERSON_1]."
+    assert body["messages"][2]["content"][0]["text"] == "Write to [PERSON_1]."
+    assert flow.request.headers["X-TrustLayer-Status"] == "Sanitized"
+    assert addon.mappings.pop(flow.id) == {"[PERSON_1]": "John Doe"}
+
+
+def test_restored_responses_drop_the_upstream_content_length(addon):
+    flow = tflow.tflow(resp=True)
+    flow.response.headers["content-length"] = str(len(b"Hi [PERSON_1]"))
+    addon.mappings.put(flow.id, {"[PERSON_1]": "John Doe"})
+
+    addon.responseheaders(flow)
+
+    # The restored body is longer than the upstream one
+    assert "content-length" not in flow.response.headers
+    assert flow.response.headers["transfer-encoding"] == "chunked"
+    assert flow.response.stream(b"Hi [PERSON_1]") + flow.response.stream(b"") == b"Hi John Doe"
+
+
+def test_responses_without_mapping_stream_untouched(addon):
+    flow = tflow.tflow(resp=True)
+    flow.response.headers["content-length"] = "5"
+    addon.responseheaders(flow)
+    assert flow.response.stream is True and flow.response.headers["content-length"] == "5"
+
+
+def test_payloads_without_pii_are_forwarded_byte_for_byte(addon):
+    flow = _flow({})
+    original = b'{ "messages" : [ {"role": "user", "content": "Please explain how binary search works."} ],\n  "model":"gpt-4o" }'
+    flow.request.content = original
+    asyncio.run(addon.request(flow))
+
+    assert flow.request.content == original
+    assert "X-TrustLayer-Status" not in flow.request.headers
+
+
+def test_rewritten_payloads_keep_everything_else():
+    body = {"messages": [{"content": "Grüße an John Doe"}], "seed": 2 ** 70, "temperature": 0.2, "stop": None}
+    assert json_codec.loads(json_codec.dumps(body)) == body
+    assert json_codec.dumps({"a": "é"}) == '{"a":"é"}'.encode("utf-8") # Compact UTF-8, no escapes
+
+
+def test_failed_flows_leave_no_mapping_behind(addon):
+    flow = tflow.tflow()
+    addon.mappings.put(flow.id, {"[PERSON_1]": "John Doe"})
+    addon.error(flow)
+    assert addon.mappings.pop(flow.id) is None
+
+
+def test_proxy_conversations_are_scoped_to_the_client(addon, monkeypatch):
+    monkeypatch.setattr(settings, "PROXY_CONVERSATIONS", True)
+
+    def turn(peer, text):
+        flow = _flow({"messages": [{"role": "user", "content": text}]})
+        flow.client_conn.peername = (peer, 50000)
+        flow.request.headers[settings.CONVERSATION_ID_HEADER] = "chat-7"
+        asyncio.run(addon.request(flow))
+        return json.loads(flow.request.content)["messages"][0]["content"]
+
+    assert turn("127.0.5.1", "Write to ann@example.com.") == "Write to [EMAIL_ADDRESS_1]."
+    assert turn("127.0.5.1", "Or to bob@example.com.") == "Or to [EMAIL_ADDRESS_2]."
+    # Same id from another client: a conversation of its own
+    assert turn("127.0.5.2", "Or to bob@example.com.") == "Or to [EMAIL_ADDRESS_1]."
+
+    monkeypatch.setattr(settings, "PROXY_CONVERSATIONS", False)
+    assert turn("127.0.5.1", "Or to bob@example.com.") == "Or to [EMAIL_ADDRESS_1]."
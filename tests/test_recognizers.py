@@ -0,0 +1,60 @@
+import json
+
+from app.modules.recognizers import RecognizerConfig, TermMatcher, load_config
+
+
+def test_per_entity_threshold_below_default_applies():
+    config = RecognizerConfig({"thresholds": {"default": 0.5, "PHONE_NUMBER": 0.3}})
+    # The analyzer must not drop what a lower per-entity threshold lets through
+    assert config.analyzer_threshold == 0.3
+    assert config.passes("PHONE_NUMBER", 0.4)
+    assert not config.passes("PHONE_NUMBER", 0.2)
+    assert not config.passes("URL", 0.4)
+    assert config.passes("URL", 0.5)
+
+
+def test_per_entity_threshold_above_default_applies():
+    config = RecognizerConfig({"thresholds": {"DATE_TIME": 0.8}})
+    assert config.analyzer_threshold == 0.0
+    assert not config.passes("DATE_TIME", 0.6)
+    assert config.passes("PERSON", 0.1)
+
+
+def test_no_thresholds_keep_everything():
+    config = RecognizerConfig({})
+    assert config.analyzer_threshold == 0.0
+    assert config.passes("PERSON", 0.0)
+
+
+def test_term_matcher_matches_whole_words_only():
+    matcher = TermMatcher(["Acme Corp", "Ann", "Acme"])
+    text = "Annual report: ACME corp and Ann, not Acme-Corporation."
+    assert [text[start:end] for start, end in matcher.find(text)] == ["ACME", "ACME corp", "Ann", "Acme"]
+    assert not matcher.search("Annual Corporation report")
+
+
+def test_term_matcher_case_sensitive():
+    matcher = TermMatcher(["Acme Corp"], case_sensitive=True)
+    assert matcher.find("acme corp, Acme Corp") == [(11, 20)]
+
+
+def test_prescreen_sees_own_recognizers():
+    config = RecognizerConfig({"recognizers": [
+        {"name": "employee_id", "entity": "EMPLOYEE_ID", "patterns": [{"regex": "\\bE-\\d{6}\\b", "score": 0.9}]},
+        {"name": "customers", "entity": "CUSTOMER", "terms": ["Acme Corp"]},
+    ]})
+    assert config.prescreen("E-123456")
+    assert config.prescreen("acme corp")
+    assert not config.prescreen("gpt-4o")
+
+
+def test_version_follows_the_configuration():
+    assert RecognizerConfig({}).version == RecognizerConfig({}).version
+    assert RecognizerConfig({}).version != RecognizerConfig({"disable": ["UrlRecognizer"]}).version
+
+
+def test_invalid_pattern_falls_back_to_the_defaults(tmp_path):
+    path = tmp_path / "recognizers.json"
+    path.write_text(json.dumps({"recognizers": [{"entity": "BROKEN", "patterns": [{"regex": "(unclosed"}]}]}))
+    config = load_config(str(path))
+    assert config.recognizers == [] and not config.prescreen("(unclosed")
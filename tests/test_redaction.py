@@ -0,0 +1,155 @@
+import re
+
+import pytest
+
+from app.core.config import settings
+from app.modules.redaction import (
+    PseudonymMap, Span, StreamRestorer, WindowedRedactor, build_result, get_engines, redact_batch,
+    resolve_overlaps, span_cache,
+)
+
+
+@pytest.fixture
+def pipeline_passes(monkeypatch):
+    """
+    Records the texts of every nlp.pipe pass of the batch analyzer.
+    """
+    span_cache.clear()
+    batch_analyzer = get_engines().batch_analyzer
+    analyze_iterator = batch_analyzer.analyze_iterator
+    passes = []
+
+    def recording(texts, **kwargs):
+        passes.append(list(texts))
+        return analyze_iterator(texts=passes[-1], **kwargs)
+
+    monkeypatch.setattr(batch_analyzer, "analyze_iterator", recording)
+    yield passes
+    span_cache.clear()
+
+
+def test_redact_batch_runs_one_pipeline_pass(pipeline_passes):
+    texts = [
+        "My name is John Doe and I live here.",
+        "gpt-4o",
+        "Please ask John Doe about the invoice.",
+        "My name is John Doe and I live here.",
+    ]
+    results = redact_batch(texts)
+
+    # Prose goes through NER once, in one pass, repeated strings only once; ids never do
+    assert pipeline_passes == [[texts[0], texts[2]]]
+    # In input order, with tokens shared by the whole batch
+    assert [result.text for result in results] == [
+        "My name is [PERSON_1] and I live here.",
+        "gpt-4o",
+        "Please ask [PERSON_1] about the invoice.",
+        "My name is [PERSON_1] and I live here.",
+    ]
+    assert results[1].items == {} and results[2].items == {"PERSON": 1}
+
+
+def test_redact_batch_of_nothing_to_analyze(pipeline_passes):
+    results = redact_batch(["", "en_US", "3f2b9c1e-8a4d-4c4e-9f6a-0b1c2d3e4f5a"])
+    assert pipeline_passes == []
+    assert [result.text for result in results] == ["", "en_US", "3f2b9c1e-8a4d-4c4e-9f6a-0b1c2d3e4f5a"]
+
+
+def test_overlaps_keep_the_highest_score(monkeypatch):
+    monkeypatch.setattr(settings, "REDACTION_OVERLAP_PRIORITY", "score")
+    spans = [Span(0, 20, "URL", 0.5), Span(4, 20, "EMAIL_ADDRESS", 1.0), Span(30, 38, "PERSON", 0.85)]
+    assert resolve_overlaps(spans) == [Span(4, 20, "EMAIL_ADDRESS", 1.0), Span(30, 38, "PERSON", 0.85)]
+
+
+def test_overlaps_keep_the_longest_span(monkeypatch):
+    monkeypatch.setattr(settings, "REDACTION_OVERLAP_PRIORITY", "length")
+    spans = [Span(4, 20, "EMAIL_ADDRESS", 1.0), Span(0, 20, "URL", 0.5), Span(20, 24, "PERSON", 0.85)]
+    # Spans that only touch don't overlap
+    assert resolve_overlaps(spans) == [Span(0, 20, "URL", 0.5), Span(20, 24, "PERSON", 0.85)]
+
+
+def test_rewrite_records_offsets_of_originals_and_tokens():
+    text = "Ann met Bob, then Ann left."
+    spans = [Span(0, 3, "PERSON", 0.9), Span(8, 11, "PERSON", 0.9), Span(18, 21, "PERSON", 0.9), Span(1, 2, "X", 0.1)]
+    result = build_result(text, spans)
+
+    assert result.text == "[PERSON_1] met [PERSON_2], then [PERSON_1] left."
+    assert result.items == {"PERSON": 3}
+    for start, end, redacted_start, redacted_end in result.offsets:
+        assert result.mapping[result.text[redacted_start:redacted_end]] == text[start:end]
+
+
+MAPPING = {"[PERSON_1]": "John Doe", "[EMAIL_ADDRESS_1]": "jörg@example.com"}
+
+
+def _restore_chunks(chunks: list[bytes]) -> str:
+    restorer = StreamRestorer(MAPPING)
+    out = b"".join(restorer.feed(chunk) for chunk in chunks) + restorer.flush()
+    return out.decode("utf-8")
+
+
+def test_stream_restorer_token_split_at_every_position():
+    data = "Hi [PERSON_1], write to [EMAIL_ADDRESS_1] – ok?".encode("utf-8")
+    expected = "Hi John Doe, write to jörg@example.com – ok?"
+    for cut in range(len(data) + 1):
+        assert _restore_chunks([data[:cut], data[cut:]]) == expected, cut
+
+
+def test_stream_restorer_byte_by_byte():
+    data = "[PERSON_1][PERSON_1] ü [EMAIL_ADDRESS_1]".encode("utf-8")
+    assert _restore_chunks([data[i:i + 1] for i in range(len(data))]) == "John DoeJohn Doe ü jörg@example.com"
+
+
+def test_stream_restorer_releases_partial_tokens():
+    # Text that only starts like a token is passed on unchanged, also at the end of the stream
+    assert _restore_chunks([b"[PERSONA] and [PERS", b"ON_2] and [PERSON_"]) == "[PERSONA] and [PERSON_2] and [PERSON_"
+
+
+def test_stream_restorer_without_mapping_is_passthrough():
+    restorer = StreamRestorer({})
+    assert restorer.feed(b"[PERSON_1]") + restorer.flush() == b"[PERSON_1]"
+
+
+NAME = re.compile(r"John Doe|Jane Roe")
+
+
+def _detect(text: str) -> list:
+    # Deterministic stand-in for the analyzer
+    return [Span(m.start(), m.end(), "PERSON", 0.85) for m in NAME.finditer(text)]
+
+
+def _redact_windowed(sections: list[str], window: int, overlap: int):
+    redactor = WindowedRedactor(window=window, overlap=overlap)
+    for section in sections:
+        redactor.add(section)
+        while (text := redactor.next_window()) is not None:
+            redactor.commit(_detect(text))
+    redactor.finish()
+    while (text := redactor.next_window()) is not None:
+        redactor.commit(_detect(text))
+    return redactor.result()
+
+
+@pytest.mark.parametrize("window,overlap", [(40, 10), (57, 12), (64, 16), (100, 25)])
+def test_windowed_redactor_matches_whole_text_redaction(window, overlap):
+    text = "".join(f"Line {i}: John Doe met Jane Roe, then John Doe left. " for i in range(12))
+    sections = [text[i:i + 33] for i in range(0, len(text), 33)] # Sections cut through names too
+
+    expected = build_result(text, _detect(text), PseudonymMap())
+    result = _redact_windowed(sections, window, overlap)
+
+    assert result.text == expected.text
+    assert result.items == expected.items == {"PERSON": 36}
+    assert result.mapping == {"[PERSON_1]": "John Doe", "[PERSON_2]": "Jane Roe"}
+    assert result.source_length == len(text)
+    # Offsets point at the originals and at their tokens
+    for start, end, redacted_start, redacted_end in result.offsets:
+        assert NAME.fullmatch(text[start:end])
+        assert result.mapping[result.text[redacted_start:redacted_end]] == text[start:end]
+
+
+def test_windowed_redactor_entity_on_window_edge_is_emitted_once():
+    text = "x" * 35 + " John Doe " + "y" * 30 # The name crosses the first window's end
+    result = _redact_windowed([text], window=40, overlap=10)
+    assert result.text == "x" * 35 + " [PERSON_1] " + "y" * 30
+    assert result.items == {"PERSON": 1}
@@ -0,0 +1,102 @@
+import json
+import os
+
+import pytest
+
+from app.services.providers import adapter_for
+from app.services.routing import DEFAULT_ROUTES, JsonPaths, Router, RoutingTable
+
+
+@pytest.mark.parametrize("host,method,path,expected", [
+    ("api.openai.com", "POST", "/v1/chat/completions", "openai"),
+    ("API.OpenAI.com.", "POST", "/v1/chat/completions", "openai"), # Case and trailing dot
+    ("chatgpt.com", "POST", "/backend-api/conversation", "chatgpt"),
+    ("ab.chatgpt.com", "POST", "/backend-api/conversation", "chatgpt"),
+    ("openai.com.evil.example", "POST", "/v1/chat/completions", None),
+    ("api.openai.com", "GET", "/v1/models", None), # Method not inspected
+    ("chatgpt.com", "POST", "/ces/v1/t", None), # Telemetry
+    ("chatgpt.com", "POST", "/backend-api/f/conversation/prepare", None),
+    ("example.com", "POST", "/v1/chat/completions", None),
+])
+def test_default_routes(host, method, path, expected):
+    route = RoutingTable(DEFAULT_ROUTES).match(host, method, path)
+    assert (route.name if route else None) == expected
+
+
+def test_route_paths_and_wildcards():
+    table = RoutingTable({
+        "ignore_paths": ["telemetry"],
+        "routes": [
+            {"name": "internal", "hosts": ["*.llm.corp"], "methods": ["post"], "paths": [r"^/v\d+/generate"]},
+            {"name": "apex", "hosts": ["llm.corp"], "ignore_paths": ["/health"]},
+        ],
+    })
+    assert table.match("eu.gpu.llm.corp", "POST", "/v2/generate").name == "internal"
+    assert table.match("eu.gpu.llm.corp", "POST", "/v2/embed") is None
+    assert table.match("eu.gpu.llm.corp", "POST", "/v2/generate/telemetry") is None
+    # "*." does not cover the apex, which has a route of its own
+    assert table.match("llm.corp", "PUT", "/anything").name == "apex"
+    assert table.match("llm.corp", "POST", "/health") is None
+
+
+def test_routes_file_is_reloaded_and_a_broken_one_ignored(tmp_path):
+    path = tmp_path / "routes.json"
+    router = Router(str(path), reload_interval=0)
+    assert router.source == "defaults"
+
+    path.write_text(json.dumps({"routes": [{"name": "corp", "hosts": ["llm.corp"]}]}))
+    assert router.match("llm.corp", "POST", "/").name == "corp"
+    assert router.match("api.openai.com", "POST", "/v1/chat/completions") is None
+
+    path.write_text("{broken")
+    os.utime(path, ns=(0, 1)) # A different mtime even within the clock's resolution
+    assert router.match("llm.corp", "POST", "/").name == "corp" # Last good table kept
+
+
+def _leaves(paths: JsonPaths, data) -> list:
+    # The proxy's traversal: only branches some path can still match are entered
+    found = []
+    def walk(obj, state, where):
+        items = obj.items() if isinstance(obj, dict) else enumerate(obj) if isinstance(obj, list) else ()
+        for key, value in items:
+            child = paths.step(state, key)
+            if not child:
+                continue
+            if isinstance(value, str):
+                if paths.matches(child):
+                    found.append(".".join([*where, str(key)]))
+            else:
+                walk(value, child, [*where, str(key)])
+    walk(data, paths.start(), [])
+    return found
+
+
+def test_provider_paths_select_only_user_content():
+    body = {
+        "model": "gpt-4o",
+        "user": "user-1234",
+        "messages": [
+            {"role": "system", "content": "Be brief."},
+            {"role": "user", "content": [{"type": "text", "text": "Hi, I am John."}, {"type": "image_url", "image_url": {"url": "x"}}]},
+        ],
+    }
+    assert _leaves(JsonPaths(adapter_for("openai").inspect), body) == [
+        "messages.0.content", "messages.1.content.0.text",
+    ]
+
+
+def test_wildcards():
+    data = {"a": {"text": "1", "b": {"text": "2", "c": ["3", {"text": "4"}]}}, "text": "0"}
+    assert _leaves(JsonPaths(["**.text"]), data) == ["a.text", "a.b.text", "a.b.c.1.text", "text"]
+    assert _leaves(JsonPaths(["a.*.text"]), data) == ["a.b.text"]
+    assert _leaves(JsonPaths(["a.b.c.*"]), data) == ["a.b.c.0"]
+    assert len(_leaves(JsonPaths(["**"]), data)) == 5
+    assert _leaves(JsonPaths([]), data) == []
+
+
+def test_unknown_providers_use_the_generic_paths():
+    assert adapter_for("gemini").name == "gemini"
+    generic = JsonPaths(adapter_for("some-new-llm").inspect)
+    assert _leaves(generic, {"session": "abc", "payload": {"prompt": "Hi", "parts": ["Hello"]}}) == [
+        "payload.prompt", "payload.parts.0",
+    ]
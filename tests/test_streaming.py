@@ -0,0 +1,85 @@
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.config import settings
+from app.core.database import init_db
+from app.main import app
+from app.services import http_client
+
+# The stand-in answers with the placeholder split over three SSE events
+DELTAS = ["Nice to meet you, [PER", "SON", "_1]. How can I help?"]
+
+
+class StandInLLM(BaseHTTPRequestHandler):
+    """
+    OpenAI-compatible /chat/completions that streams DELTAS as Server-Sent Events.
+    """
+    protocol_version = "HTTP/1.1"
+    prompts = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.prompts.append(body["messages"][0]["content"])
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        events = [{"choices": [{"delta": {"content": delta}}]} for delta in DELTAS]
+        for payload in [*(f"data: {json.dumps(event)}\n\n" for event in events), "data: [DONE]\n\n"]:
+            data = payload.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def stand_in(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandInLLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    StandInLLM.prompts = []
+
+    monkeypatch.setattr(settings, "LLM_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+    monkeypatch.setattr(settings, "LLM_HTTP2", False)
+    monkeypatch.setattr(settings, "OPENAI_API_KEY", "sk-test") # Not a mock key: the real stream path runs
+    asyncio.run(init_db())
+    http_client._client = None # Built for the stand-in on first use
+    yield StandInLLM
+    http_client._client = None
+    server.shutdown()
+    server.server_close()
+
+
+def _events(body: str) -> list:
+    return [line[len("data: "):] for line in body.split("\n\n") if line.startswith("data: ")]
+
+
+def test_stream_restores_placeholders_split_across_chunks(stand_in):
+    client = TestClient(app)
+    with client.stream("POST", "/v1/chat/completions", data={"prompt": "My name is John Doe.", "stream": "true"}) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        body = "".join(response.iter_text())
+
+    # Only the placeholder left the process
+    assert stand_in.prompts == ["My name is [PERSON_1]."]
+
+    events = _events(body)
+    assert events[-1] == "[DONE]"
+    payloads = [json.loads(event) for event in events[:-1]]
+    text = "".join(payload.get("delta", "") for payload in payloads)
+    assert text == "Nice to meet you, John Doe. How can I help?"
+    assert "[PERSON_1]" not in body
+
+    # The stream ends cleanly: a final summary event, no error event
+    assert payloads[-1]["done"] is True
+    assert payloads[-1]["redacted_entities"] == {"PERSON": 1}
+    assert not any("error" in payload for payload in payloads)